@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+API Call Ledger
+
+Shared instrumentation for the Gemini scripts (generate_new_verbs.py,
+evaluate_images.py). Every logical API call appends one record to a local
+SQLite ledger: script, model id, latency, attempt count, backoff seconds,
+token counts, request payload size and outcome.
+
+Usage:
+    python api_ledger.py report               # p50/p95 latency, retries, throughput per run
+    python api_ledger.py report --last 5      # Only the 5 most recent runs
+    python api_ledger.py report --script evaluate_images
+"""
+
+import os
+import time
+import heapq
+import random
+import sqlite3
+import argparse
+import threading
+
+# Configuration
+LEDGER_FILE = os.environ.get("API_LEDGER_FILE", "api_ledger.sqlite")
+
+# One id per process, so every record written by a single invocation of a
+# script can be grouped into a "run" in the report.
+RUN_ID = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+# Approximate list prices in USD per 1M tokens (input, output).
+# Image outputs are billed as output tokens. Update when pricing changes.
+PRICING = {
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.5-flash-image": (0.30, 30.00),
+    "gemini-3-pro-image-preview": (2.00, 120.00),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    script TEXT NOT NULL,
+    model_id TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    latency_s REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    backoff_s REAL NOT NULL,
+    prompt_tokens INTEGER,
+    output_tokens INTEGER,
+    total_tokens INTEGER,
+    outcome TEXT NOT NULL,
+    detail TEXT,
+    payload_bytes INTEGER,
+    queued_s REAL
+)
+"""
+
+# Columns added after the first ledgers were written: name -> SQL type.
+MIGRATIONS = {
+    "payload_bytes": "INTEGER",
+    "queued_s": "REAL",
+}
+
+_write_lock = threading.Lock()
+
+
+def connect(ledger_file=LEDGER_FILE):
+    """Open the ledger, creating the table on first use."""
+    conn = sqlite3.connect(ledger_file, timeout=30)
+    conn.execute(SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(calls)")}
+    for name, sql_type in MIGRATIONS.items():
+        if name not in columns:
+            conn.execute(f"ALTER TABLE calls ADD COLUMN {name} {sql_type}")
+    return conn
+
+
+def record_call(script, model_id, started_at, latency_s, attempts, backoff_s,
+                outcome, usage=None, detail="", payload_bytes=None, queued_s=None,
+                ledger_file=LEDGER_FILE):
+    """Append one call record. Ledger failures never interrupt the caller."""
+    usage = usage or {}
+    try:
+        with _write_lock:
+            conn = connect(ledger_file)
+            with conn:
+                conn.execute(
+                    "INSERT INTO calls (run_id, script, model_id, started_at, latency_s, "
+                    "attempts, backoff_s, prompt_tokens, output_tokens, total_tokens, "
+                    "outcome, detail, payload_bytes, queued_s) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (RUN_ID, script, model_id, started_at, latency_s, attempts, backoff_s,
+                     usage.get("prompt_tokens"), usage.get("output_tokens"),
+                     usage.get("total_tokens"), outcome, detail, payload_bytes, queued_s)
+                )
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"    Warning: could not write to API ledger: {e}")
+
+
+def extract_usage(response):
+    """Pull token counts out of a Gemini response's usage metadata."""
+    meta = getattr(response, "usage_metadata", None)
+    if meta is None:
+        return {}
+    return {
+        "prompt_tokens": getattr(meta, "prompt_token_count", None),
+        "output_tokens": getattr(meta, "candidates_token_count", None),
+        "total_tokens": getattr(meta, "total_token_count", None),
+    }
+
+
+class CallRecord:
+    """Track one logical API call across its retries, then write it to the ledger.
+
+    Usage:
+        call = CallRecord("generate_new_verbs", model_id, detail=filename)
+        for attempt in range(max_retries):
+            call.queued(limiter.wait())   # rate-limiter wait, not counted as latency
+            call.attempt()
+            ...
+            call.backoff(wait_time)   # sleeps and records the wait
+        call.finish("ok", response)
+    """
+
+    def __init__(self, script, model_id, detail="", payload_bytes=None):
+        self.script = script
+        self.model_id = model_id
+        self.detail = detail
+        self.payload_bytes = payload_bytes
+        self.started_at = time.time()
+        self.attempts = 0
+        self.backoff_s = 0.0
+        self.queued_s = 0.0
+        self._t0 = time.perf_counter()
+
+    def attempt(self):
+        self.attempts += 1
+
+    def queued(self, seconds):
+        """Leave time spent waiting for a rate-limiter slot out of the latency."""
+        self.queued_s += seconds
+        if self.attempts == 0:
+            self.started_at += seconds   # the call starts when its first request goes out
+
+    def backoff(self, seconds):
+        self.backoff_s += seconds
+        time.sleep(seconds)
+
+    def finish(self, outcome, response=None):
+        record_call(
+            self.script,
+            self.model_id,
+            self.started_at,
+            time.perf_counter() - self._t0 - self.queued_s,
+            self.attempts,
+            self.backoff_s,
+            outcome,
+            usage=extract_usage(response) if response is not None else None,
+            detail=self.detail,
+            payload_bytes=self.payload_bytes,
+            queued_s=self.queued_s,
+        )
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile of a list (q in 0-100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def estimate_cost(model_id, prompt_tokens, output_tokens):
+    """Estimated USD cost for the given token counts, or None if the model is unpriced."""
+    if model_id not in PRICING:
+        return None
+    in_rate, out_rate = PRICING[model_id]
+    return (prompt_tokens * in_rate + output_tokens * out_rate) / 1_000_000
+
+
+def load_runs(ledger_file=LEDGER_FILE, script=None, model_id=None):
+    """Load call records grouped by (run_id, script, model_id), oldest run first."""
+    if not os.path.exists(ledger_file):
+        return {}
+
+    query = ("SELECT run_id, script, model_id, started_at, latency_s, attempts, backoff_s, "
+             "prompt_tokens, output_tokens, outcome, payload_bytes, queued_s FROM calls")
+    clauses, params = [], []
+    if script:
+        clauses.append("script = ?")
+        params.append(script)
+    if model_id:
+        clauses.append("model_id = ?")
+        params.append(model_id)
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY started_at"
+
+    conn = connect(ledger_file)
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+
+    runs = {}
+    for run_id, scr, model, started_at, latency, attempts, backoff, p_tok, o_tok, outcome, payload, queued in rows:
+        runs.setdefault((run_id, scr, model), []).append({
+            "started_at": started_at,
+            "latency_s": latency,
+            "attempts": attempts,
+            "backoff_s": backoff,
+            "prompt_tokens": p_tok or 0,
+            "output_tokens": o_tok or 0,
+            "outcome": outcome,
+            "payload_bytes": payload,
+            "queued_s": queued,
+        })
+    return runs
+
+
+def summarize_run(model_id, calls):
+    """Compute latency percentiles, retry overhead and throughput for one run."""
+    latencies = [c["latency_s"] for c in calls]
+    total_latency = sum(latencies)
+    backoff = sum(c["backoff_s"] for c in calls)
+    wall = max(c["started_at"] + c["latency_s"] for c in calls) - min(c["started_at"] for c in calls)
+    prompt_tokens = sum(c["prompt_tokens"] for c in calls)
+    output_tokens = sum(c["output_tokens"] for c in calls)
+    payloads = [c["payload_bytes"] for c in calls if c["payload_bytes"] is not None]
+
+    return {
+        "calls": len(calls),
+        "ok": sum(1 for c in calls if c["outcome"] == "ok"),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "retries": sum(c["attempts"] for c in calls) - len(calls),
+        "backoff_s": backoff,
+        "retry_overhead": backoff / total_latency if total_latency else 0.0,
+        "wall_s": wall,
+        "per_min": len(calls) / wall * 60 if wall > 0 else 0.0,
+        "prompt_tokens": prompt_tokens,
+        "output_tokens": output_tokens,
+        "cost": estimate_cost(model_id, prompt_tokens, output_tokens),
+        "payload_kb": sum(payloads) / len(payloads) / 1024 if payloads else None,
+    }
+
+
+def load_history(ledger_file=LEDGER_FILE, script=None, model_id=None):
+    """All recorded calls for a script/model, pooled across runs.
+
+    Calls recorded before queued_s existed have rate-limiter waits folded
+    into their latency, so they are only used when there is nothing newer.
+    """
+    runs = load_runs(ledger_file, script=script, model_id=model_id)
+    calls = [call for calls in runs.values() for call in calls]
+    return [c for c in calls if c["queued_s"] is not None] or calls
+
+
+def simulate_run(history, model_id, num_jobs, workers, interval, trials=200, seed=0):
+    """Predict a batch of num_jobs calls by resampling recorded calls.
+
+    Each trial draws one historical call per job (its latency includes
+    retries and backoff but not rate-limiter waits) and replays the batch through `workers`
+    concurrent workers whose request starts are at least `interval` seconds
+    apart, like generate_new_verbs.RateLimiter. Returns percentiles of wall
+    time, request count and cost across trials, or None without history.
+    """
+    if not history or num_jobs <= 0:
+        return None
+    rng = random.Random(seed)
+    workers = max(1, workers)
+    walls, requests, costs, failures = [], [], [], []
+
+    for _ in range(trials):
+        free_at = [0.0] * workers
+        next_start = 0.0
+        end = 0.0
+        n_requests = n_failed = prompt_tokens = output_tokens = 0
+        for _ in range(num_jobs):
+            call = rng.choice(history)
+            start = max(heapq.heappop(free_at), next_start)
+            next_start = start + interval
+            finish = start + call["latency_s"]
+            heapq.heappush(free_at, finish)
+            end = max(end, finish)
+            n_requests += call["attempts"]
+            n_failed += call["outcome"] != "ok"
+            prompt_tokens += call["prompt_tokens"]
+            output_tokens += call["output_tokens"]
+        walls.append(end)
+        requests.append(n_requests)
+        failures.append(n_failed)
+        costs.append(estimate_cost(model_id, prompt_tokens, output_tokens))
+
+    priced = [c for c in costs if c is not None]
+    return {
+        "history": len(history),
+        "trials": trials,
+        "wall_p50": percentile(walls, 50),
+        "wall_p90": percentile(walls, 90),
+        "requests_p50": percentile(requests, 50),
+        "requests_p90": percentile(requests, 90),
+        "failed_p50": percentile(failures, 50),
+        "cost_p50": percentile(priced, 50) if priced else None,
+        "cost_p90": percentile(priced, 90) if priced else None,
+    }
+
+
+def print_report(runs, last=0):
+    """Print one line of statistics per run."""
+    print("\n" + "=" * 128)
+    print("API LEDGER REPORT")
+    print("=" * 128)
+
+    if not runs:
+        print("No calls recorded yet.")
+        return
+
+    items = list(runs.items())
+    if last > 0:
+        items = items[-last:]
+
+    print(f"\n{'Run':<24} {'Script':<20} {'Model':<28} {'Calls':>6} {'OK':>5} "
+          f"{'p50 s':>7} {'p95 s':>7} {'Retry':>6} {'Backoff':>8} {'/min':>6} {'KB/req':>9} {'Cost $':>8}")
+    print("-" * 128)
+
+    total_cost = 0.0
+    for (run_id, script, model_id), calls in items:
+        s = summarize_run(model_id, calls)
+        cost_str = f"{s['cost']:.3f}" if s["cost"] is not None else "N/A"
+        payload_str = f"{s['payload_kb']:.1f}" if s["payload_kb"] is not None else "N/A"
+        total_cost += s["cost"] or 0.0
+        print(f"{run_id:<24} {script:<20} {model_id:<28} {s['calls']:>6} {s['ok']:>5} "
+              f"{s['p50']:>7.1f} {s['p95']:>7.1f} {s['retries']:>6} "
+              f"{s['retry_overhead']:>8.0%} {s['per_min']:>6.1f} {payload_str:>9} {cost_str:>8}")
+
+    print(f"\nRetry = extra attempts after rate limiting; Backoff = share of call time spent waiting;")
+    print(f"KB/req = mean request payload where recorded.")
+    print(f"Estimated total cost: ${total_cost:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the API call ledger")
+    parser.add_argument("--ledger", default=LEDGER_FILE, help="Ledger SQLite file")
+    subparsers = parser.add_subparsers(dest="command")
+
+    report = subparsers.add_parser("report", help="Per-run latency, retry and throughput report")
+    report.add_argument("--script", type=str, help="Only runs of this script (e.g. 'evaluate_images')")
+    report.add_argument("--model-id", type=str, help="Only runs using this model")
+    report.add_argument("--last", type=int, default=0, help="Only the N most recent runs (0=all)")
+
+    args = parser.parse_args()
+
+    if args.command == "report":
+        runs = load_runs(args.ledger, script=args.script, model_id=args.model_id)
+        print_report(runs, args.last)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,8 @@ import torch
 import clip
 from PIL import Image
 
+import image_dedup
+
 # Configuration
 IMAGE_DIR = "experiments/conceptual-task/chunk_includes"
 OUTPUT_FILE = "clip_verb_scores.json"
@@ -222,6 +224,33 @@ def compute_clarity_metrics(scores):
     }
 
 
+def evaluate_file(model, preprocess, device, filepath):
+    """Score one image and return its results entry (None if the filename can't be parsed)."""
+    info = parse_filename(filepath)
+    if not info:
+        return None
+
+    # Generate descriptions
+    descriptions = generate_descriptions(info["character"], info["verb"])
+
+    # Compute CLIP scores
+    scores = compute_clip_scores(model, preprocess, device, filepath, descriptions)
+
+    # Compute clarity metrics
+    metrics = compute_clarity_metrics(scores)
+
+    return {
+        "info": info,
+        "descriptions": {"primary": descriptions["primary"]},
+        "scores": {
+            "primary": scores["primary_score"],
+            "best_correct": scores["best_correct"],
+            "best_distractor": scores["best_distractor"]
+        },
+        "metrics": metrics
+    }
+
+
 def get_image_files(image_dir, pattern="*.png"):
     """Get all versioned image files."""
     all_images = glob.glob(os.path.join(image_dir, pattern))
@@ -241,8 +270,12 @@ def load_existing_results(output_file):
 
 def save_results(results, output_file):
     """Save results to JSON."""
-    with open(output_file, 'w') as f:
+    # Write-then-rename, so a reader (e.g. select_best_images.py --watch)
+    # never sees a half-written file.
+    temp_path = output_file + ".tmp"
+    with open(temp_path, 'w') as f:
         json.dump(results, f, indent=2)
+    os.replace(temp_path, output_file)
 
 
 def compute_rankings(results):
@@ -328,6 +361,8 @@ def main():
     parser.add_argument("--limit", type=int, default=0, help="Limit number of images (0=all)")
     parser.add_argument("--skip-existing", action="store_true", help="Skip already evaluated images")
     parser.add_argument("--summary-only", action="store_true", help="Just show summary")
+    parser.add_argument("--skip-duplicates", action="store_true",
+                        help="Skip near-duplicate versions (perceptual hash, see image_dedup.py)")
     parser.add_argument("--filter", type=str, help="Filter images by pattern")
     args = parser.parse_args()
 
@@ -348,6 +383,13 @@ def main():
     if args.filter:
         images = [f for f in images if args.filter in os.path.basename(f)]
 
+    # Deduplicate before dropping scored files, so a near-copy of an
+    # already-scored version is skipped too.
+    if args.skip_duplicates:
+        before = len(images)
+        images = image_dedup.drop_duplicates(images)
+        print(f"Skipped {before - len(images)} near-duplicate images")
+
     if args.skip_existing:
         images = [f for f in images if f not in results["evaluations"]]
 
@@ -366,34 +408,17 @@ def main():
         filename = os.path.basename(filepath)
         print(f"\n[{i+1}/{len(images)}] {filename}")
 
-        info = parse_filename(filepath)
-        if not info:
+        entry = evaluate_file(model, preprocess, device, filepath)
+        if not entry:
             print(f"  Could not parse filename")
             continue
 
-        # Generate descriptions
-        descriptions = generate_descriptions(info["character"], info["verb"])
-
-        # Compute CLIP scores
-        scores = compute_clip_scores(model, preprocess, device, filepath, descriptions)
-
-        # Compute clarity metrics
-        metrics = compute_clarity_metrics(scores)
-
+        metrics = entry["metrics"]
         print(f"  Clarity: {metrics['clarity_score']}/100 ({metrics['verdict']})")
         print(f"  Discriminability: {metrics['discriminability']:.3f}, Rank: {metrics['rank']}")
 
         # Store results
-        results["evaluations"][filepath] = {
-            "info": info,
-            "descriptions": {"primary": descriptions["primary"]},
-            "scores": {
-                "primary": scores["primary_score"],
-                "best_correct": scores["best_correct"],
-                "best_distractor": scores["best_distractor"]
-            },
-            "metrics": metrics
-        }
+        results["evaluations"][filepath] = entry
 
         # Update rankings
         results["rankings"] = compute_rankings(results)
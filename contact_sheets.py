@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Contact Sheets for Image Review
+
+Renders one thumbnail grid per combo with each version's combined, Gemini
+and CLIP scores overlaid (best version outlined), plus an index.html that
+shows every sheet in review order (weakest combo first).
+
+Sheets are rendered in parallel across cores and cached: each combo's
+inputs (its images' size and mtime, and the scores shown) are hashed, and
+only combos whose hash changed are re-rendered.
+
+Also used by select_best_images.py --interactive --contact-sheets.
+
+Usage:
+    python contact_sheets.py                      # Render/update sheets and index
+    python contact_sheets.py --filter chef_       # Only matching combos
+    python contact_sheets.py --force              # Ignore the cache
+"""
+
+import os
+import json
+import html
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFont
+
+import select_best_images
+
+# Configuration
+SHEET_DIR = "contact_sheets"
+CACHE_FILE = "sheets.json"
+THUMB_SIZE = 256
+COLUMNS = 5
+CAPTION_HEIGHT = 44
+PADDING = 8
+
+# Bump when the layout changes so every cached sheet is re-rendered.
+LAYOUT_VERSION = 1
+
+
+def resolve_image(version, image_dir):
+    """Path of a version's image, falling back to image_dir (as in export)."""
+    if version["filepath"] and os.path.exists(version["filepath"]):
+        return version["filepath"]
+    return os.path.join(image_dir, version["filename"])
+
+
+def sheet_inputs(combo, data, image_dir):
+    """Everything a combo's sheet depends on, as plain (picklable) data."""
+    versions = []
+    for v in sorted(data["all_versions"], key=lambda v: v["filename"]):
+        path = resolve_image(v, image_dir)
+        stat = os.stat(path) if os.path.exists(path) else None
+        versions.append({
+            "path": path,
+            "version": v["version"],
+            "combined": v["combined_score"],
+            "gemini": v["gemini_score"],
+            "clip": v["clip_clarity"],
+            "best": v["filename"] == data["best_file"],
+            "stat": [stat.st_size, stat.st_mtime_ns] if stat else None,
+        })
+    return {"combo": combo, "versions": versions}
+
+
+def inputs_hash(inputs):
+    payload = json.dumps([LAYOUT_VERSION, THUMB_SIZE, COLUMNS, inputs], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 has no sized default font
+        return ImageFont.load_default()
+
+
+def render_sheet(inputs, out_path):
+    """Draw one combo's thumbnail grid and save it to out_path."""
+    versions = inputs["versions"]
+    columns = max(1, min(COLUMNS, len(versions)))
+    rows = (len(versions) + columns - 1) // columns
+    cell_w = THUMB_SIZE + PADDING
+    cell_h = THUMB_SIZE + CAPTION_HEIGHT + PADDING
+    sheet = Image.new("RGB", (columns * cell_w + PADDING, rows * cell_h + PADDING), "white")
+    draw = ImageDraw.Draw(sheet)
+    font = _font(15)
+
+    for i, v in enumerate(versions):
+        x = PADDING + (i % columns) * cell_w
+        y = PADDING + (i // columns) * cell_h
+
+        if v["stat"]:
+            with Image.open(v["path"]) as img:
+                img.draft("RGB", (THUMB_SIZE, THUMB_SIZE))
+                thumb = img.convert("RGB")
+                thumb.thumbnail((THUMB_SIZE, THUMB_SIZE))
+            sheet.paste(thumb, (x + (THUMB_SIZE - thumb.width) // 2, y + (THUMB_SIZE - thumb.height) // 2))
+        else:
+            draw.text((x + 10, y + THUMB_SIZE // 2), "missing", fill="red", font=font)
+
+        if v["best"]:
+            draw.rectangle([x - 3, y - 3, x + THUMB_SIZE + 2, y + THUMB_SIZE + 2], outline="green", width=4)
+
+        gemini = f"{v['gemini']}/35" if v["gemini"] else "N/A"
+        clip = f"{v['clip']}/100" if v["clip"] else "N/A"
+        label = f"v{v['version']}  {v['combined']:.1f}" + ("  best" if v["best"] else "")
+        draw.text((x, y + THUMB_SIZE + 4), label, fill="green" if v["best"] else "black", font=font)
+        draw.text((x, y + THUMB_SIZE + 22), f"G {gemini}   C {clip}", fill="dimgray", font=font)
+
+    temp_path = out_path + ".tmp"
+    sheet.save(temp_path, format="PNG", optimize=True)
+    os.replace(temp_path, out_path)
+    return out_path
+
+
+def write_index(rankings, sheet_dir):
+    """index.html with every sheet, weakest combo first (the interactive review order)."""
+    parts = ["<!DOCTYPE html>", "<html><head><meta charset='utf-8'><title>Contact sheets</title>",
+             "<style>body{font-family:sans-serif;margin:20px}h2{margin:28px 0 6px}"
+             "img{max-width:100%;border:1px solid #ccc}nav a{margin-right:8px}</style>",
+             "</head><body>", "<h1>Contact sheets</h1>", "<nav>"]
+    ordered = sorted(rankings.items(), key=lambda x: x[1]["best_combined"])
+    parts += [f"<a href='#{html.escape(combo)}'>{html.escape(combo)}</a>" for combo, _ in ordered]
+    parts.append("</nav>")
+    for combo, data in ordered:
+        parts.append(f"<h2 id='{html.escape(combo)}'>{html.escape(combo)} — best "
+                     f"{html.escape(data['best_file'])} ({data['best_combined']:.1f})</h2>")
+        parts.append(f"<img loading='lazy' src='{html.escape(combo)}.png' alt='{html.escape(combo)}'>")
+    parts.append("</body></html>")
+
+    path = os.path.join(sheet_dir, "index.html")
+    with open(path, 'w') as f:
+        f.write("\n".join(parts))
+    return path
+
+
+def render_contact_sheets(rankings, image_dir, sheet_dir=SHEET_DIR, workers=None, force=False):
+    """Render sheets for combos whose inputs changed; return {combo: sheet path}."""
+    os.makedirs(sheet_dir, exist_ok=True)
+    cache_path = os.path.join(sheet_dir, CACHE_FILE)
+    cache = {}
+    if os.path.exists(cache_path) and not force:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+
+    sheets, todo = {}, {}
+    for combo, data in rankings.items():
+        out_path = os.path.join(sheet_dir, f"{combo}.png")
+        sheets[combo] = out_path
+        inputs = sheet_inputs(combo, data, image_dir)
+        digest = inputs_hash(inputs)
+        if cache.get(combo) == digest and os.path.exists(out_path):
+            continue
+        todo[combo] = (inputs, out_path, digest)
+
+    if todo:
+        print(f"Rendering {len(todo)} contact sheets ({len(rankings) - len(todo)} cached)...")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {combo: pool.submit(render_sheet, inputs, out_path)
+                       for combo, (inputs, out_path, _) in todo.items()}
+            for combo, future in futures.items():
+                future.result()
+                cache[combo] = todo[combo][2]
+    else:
+        print(f"All {len(rankings)} contact sheets up to date")
+
+    with open(cache_path + ".tmp", 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(cache_path + ".tmp", cache_path)
+
+    index = write_index(rankings, sheet_dir)
+    print(f"Contact sheet index: {index}")
+    return sheets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render per-combo contact sheets for review")
+    parser.add_argument("--gemini-file", default=select_best_images.GEMINI_FILE,
+                        help="Gemini evaluation results JSON")
+    parser.add_argument("--clip-file", default=select_best_images.CLIP_FILE,
+                        help="CLIP evaluation results JSON")
+    parser.add_argument("--image-dir", default=select_best_images.IMAGE_DIR, help="Source image directory")
+    parser.add_argument("--sheet-dir", default=SHEET_DIR, help="Output directory for sheets")
+    parser.add_argument("--gemini-weight", type=float, default=0.5, help="Weight for Gemini score (0-1)")
+    parser.add_argument("--clip-weight", type=float, default=0.5, help="Weight for CLIP score (0-1)")
+    parser.add_argument("--filter", type=str, help="Only combos matching this pattern")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel processes (default: all cores)")
+    parser.add_argument("--force", action="store_true", help="Re-render every sheet")
+    args = parser.parse_args()
+
+    gemini_data = select_best_images.load_json(args.gemini_file)
+    clip_data = select_best_images.load_json(args.clip_file)
+    if not gemini_data and not clip_data:
+        print("Error: No evaluation data found.")
+        return
+
+    weights = {"gemini": args.gemini_weight, "clip": args.clip_weight}
+    rankings = select_best_images.combine_evaluations(gemini_data, clip_data, weights)
+    if args.filter:
+        rankings = {c: d for c, d in rankings.items() if args.filter in c}
+
+    render_contact_sheets(rankings, args.image_dir, args.sheet_dir, args.workers, args.force)
+
+
+if __name__ == "__main__":
+    main()
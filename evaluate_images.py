@@ -16,6 +16,9 @@ import io
 import time
 import argparse
 
+import api_ledger
+import image_dedup
+
 # Configuration
 IMAGE_DIR = "experiments/conceptual-task/chunk_includes"
 OUTPUT_FILE = "image_evaluations.json"
@@ -148,8 +151,10 @@ def get_client():
 
 def evaluate_image(client, image_path, max_retries=5):
     """Send image to Gemini for temporal neutrality evaluation with retry logic."""
+    call = api_ledger.CallRecord("evaluate_images", MODEL_ID, detail=os.path.basename(image_path))
 
     for attempt in range(max_retries):
+        call.attempt()
         try:
             # Load image
             img = Image.open(image_path)
@@ -182,11 +187,14 @@ def evaluate_image(client, image_path, max_retries=5):
                 if text.startswith("json"):
                     text = text[4:]
 
-            return json.loads(text)
+            result = json.loads(text)
+            call.finish("ok", response)
+            return result
 
         except json.JSONDecodeError as e:
             print(f"  JSON parse error: {e}")
             print(f"  Raw response: {response.text[:200]}...")
+            call.finish("parse_error", response)
             return None
         except Exception as e:
             error_str = str(e)
@@ -194,13 +202,15 @@ def evaluate_image(client, image_path, max_retries=5):
             if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
                 wait_time = (2 ** attempt) * 5  # 5, 10, 20, 40, 80 seconds
                 print(f"  Rate limited. Waiting {wait_time}s before retry ({attempt+1}/{max_retries})...")
-                time.sleep(wait_time)
+                call.backoff(wait_time)
                 continue
             else:
                 print(f"  Evaluation error: {e}")
+                call.finish("error")
                 return None
 
     print(f"  Failed after {max_retries} retries due to rate limiting")
+    call.finish("rate_limited")
     return None
 
 
@@ -249,8 +259,12 @@ def load_existing_results(output_file):
 
 def save_results(results, output_file):
     """Save evaluation results to JSON."""
-    with open(output_file, 'w') as f:
+    # Write-then-rename, so a reader (e.g. select_best_images.py --watch)
+    # never sees a half-written file.
+    temp_path = output_file + ".tmp"
+    with open(temp_path, 'w') as f:
         json.dump(results, f, indent=2)
+    os.replace(temp_path, output_file)
 
 
 def select_best_versions(results):
@@ -338,6 +352,8 @@ def main():
     parser.add_argument("--limit", type=int, default=0, help="Limit number of images to evaluate (0=all)")
     parser.add_argument("--skip-existing", action="store_true", help="Skip already evaluated images")
     parser.add_argument("--summary-only", action="store_true", help="Just show summary of existing results")
+    parser.add_argument("--skip-duplicates", action="store_true",
+                        help="Skip near-duplicate versions (perceptual hash, see image_dedup.py)")
     parser.add_argument("--filter", type=str, help="Only evaluate images matching this pattern (e.g., 'chef_eat')")
     parser.add_argument("--delay", type=float, default=3.0, help="Delay between API calls in seconds (default: 3)")
     args = parser.parse_args()
@@ -360,6 +376,13 @@ def main():
     if args.filter:
         images = [f for f in images if args.filter in os.path.basename(f)]
 
+    # Deduplicate before dropping scored files, so a near-copy of an
+    # already-scored version is skipped too.
+    if args.skip_duplicates:
+        before = len(images)
+        images = image_dedup.drop_duplicates(images)
+        print(f"Skipped {before - len(images)} near-duplicate images")
+
     if args.skip_existing:
         images = [f for f in images if f not in results["evaluations"]]
 
@@ -9,10 +9,14 @@
 # to this path, unless you set them to absolute paths.
 IBEX_WORKING_DIR = "../"
 
-# Options are "toy" or "cgi" (case-sensitive); the value "paste"
+# Options are "toy", "async" or "cgi" (case-sensitive); the value "paste"
 # is equivalent to "toy" and is supported for backwards compatibility.
 #
-# If "toy", the server will run in stand-alone mode.
+# If "toy", the server will run in stand-alone mode, with a thread
+# per connection.
+# If "async", the server will run in stand-alone mode on a single
+# asyncio event loop, with file access on a pool of ASYNC_WORKERS
+# threads (default 16). Use this with many concurrent participants.
 # If "cgi", the server will run as a CGI process.
 #
 # Note that the value of this variable can be overridden by the
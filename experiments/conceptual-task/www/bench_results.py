@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Results Submission Benchmark
+
+Starts server.py against a scratch working directory (so the real results
+and counter are never touched) and measures how many results POSTs per
+second it acknowledges with 1, 10 and 100 concurrent clients. Every client
+keeps one connection open and submits as fast as it gets answers, as a lab
+full of participants finishing together would.
+
+Usage:
+    python3 bench_results.py                       # toy server, 1/10/100 clients
+    python3 bench_results.py -m async              # asyncio server
+    python3 bench_results.py --clients 1 50 --duration 10
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+
+# Configuration
+PORT = 3999
+DURATION = 5.0
+CLIENTS = [1, 10, 100]
+
+
+def submission(n_items=40):
+    """A results POST body of roughly the size a real participant sends."""
+    columns = ["Controller name", "Item number", "Element number", "Type", "Group",
+               "Sentence", "Key", "Correct", "RT"]
+    lines = [[[i, v] for i, v in enumerate(["DashedSentence", n, 0, "critical", 1,
+                                                "The+chef+built+the+tower", "C", "1", 812])]
+             for n in range(n_items)]
+    return json.dumps([False, 0, columns, lines, "benchmarkparticipant00", True]).encode("utf-8")
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not start listening on port {port}")
+
+
+def client(port, body, stop, latencies, errors):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    headers = {"Content-Type": "application/x-www-form-urlencoded; charset=utf-8"}
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            conn.request("POST", "/server.py", body, headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(response.status)
+    except (OSError, http.client.HTTPException) as e:
+        errors.append(str(e))
+    finally:
+        conn.close()
+
+
+def run(port, n_clients, duration, body):
+    """Submissions/sec and latency percentiles for n_clients concurrent clients."""
+    stop = threading.Event()
+    latencies, errors = [], []
+    threads = [threading.Thread(target=client, args=(port, body, stop, latencies, errors))
+               for _ in range(n_clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+    return {"clients": n_clients, "submissions": len(latencies), "per_sec": len(latencies) / elapsed,
+            "p50_ms": pct(0.50), "p99_ms": pct(0.99), "errors": len(errors)}
+
+
+def count_results(work_dir):
+    """Data lines in the scratch results file (comment lines start with '#')."""
+    try:
+        with open(os.path.join(work_dir, "results", "results"), encoding="utf-8") as f:
+            return sum(1 for line in f if line.strip() and not line.startswith("#"))
+    except FileNotFoundError:
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark results POSTs against server.py")
+    parser.add_argument("-m", "--mode", default="toy", choices=["toy", "async"], help="Server mode")
+    parser.add_argument("-p", "--port", type=int, default=PORT, help="Port for the scratch server")
+    parser.add_argument("--clients", type=int, nargs="+", default=CLIENTS, help="Concurrency levels")
+    parser.add_argument("--duration", type=float, default=DURATION, help="Seconds per concurrency level")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch working directory")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="ibex-bench-")
+    env = dict(os.environ, IBEX_WORKING_DIR=work_dir)
+    server = subprocess.Popen([sys.executable, SERVER, "-m", args.mode, "-p", str(args.port)],
+                              cwd=os.path.dirname(SERVER), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    body = submission()
+    total = 0
+    try:
+        wait_for_port(args.port)
+        print(f"{args.mode} server, {len(body)} byte submissions, {args.duration:g}s per level")
+        print(f"{'clients':>8} {'subs/sec':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for n in args.clients:
+            r = run(args.port, n, args.duration, body)
+            total += r["submissions"]
+            print(f"{r['clients']:>8} {r['per_sec']:>10.1f} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['errors']:>7}")
+    finally:
+        server.terminate()
+        server.wait()
+
+    # Every acknowledged submission must be in the results file.
+    lines_per_submission = len(json.loads(body)[3])
+    written = count_results(work_dir) // lines_per_submission
+    print(f"Acknowledged {total}, found {written} in the results file")
+    if args.keep:
+        print(f"Scratch directory: {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if written < total:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 # You may need to add a #! line at the beginning of this file, eg.:
-#     #!/usr/bin/python
+#     #!/usr/bin/env python3
 
 #
 # You may need to edit this.
@@ -36,14 +36,61 @@ SERVER_CONF_PY_FILE = "../server_conf.py"
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+#
+# Running the server:
+#
+#     python server.py                 # SERVER_MODE from server_conf.py ("toy" or "cgi")
+#     python server.py -m toy -p 3000  # Override the mode and port
+#     python server.py -m async        # Stand-alone server on asyncio
+#     python server.py -r              # Reset the latin square counter, then serve
+#
+# The module also exposes a WSGI callable, 'application', so it can be run
+# under a pre-fork WSGI server with several worker processes, e.g. from the
+# www directory:
+#
+#     gunicorn --workers 4 --bind :3000 server:application
+#
+# Each worker creates its own app on its first request (see create_app()).
+# Results are appended by a writer thread in each worker, which flocks each
+# results file while it writes a group of submissions. The latin square
+# counter is kept in memory, and each worker appends its changes to a log
+# (server_state/counter.log) while holding a flock on counter.lock. The other
+# workers replay that log when it changes. Any number of workers can share
+# both the results files and the counter.
+#
+
 import sys
+import io
 import os
 import os.path
 import getopt
 import errno
-
-PY_SCRIPT_DIR = os.path.split(sys.argv[0])[0]
-PY_SCRIPT_NAME = os.path.split(sys.argv[0])[1]
+import re
+import json
+import logging
+import queue
+import itertools
+import hashlib
+import zlib
+import uuid
+import mimetypes
+import threading
+import socketserver
+import asyncio
+import email.utils
+import concurrent.futures
+import time as time_module
+import urllib.parse
+import urllib.request
+import wsgiref.handlers
+import wsgiref.simple_server
+
+# Directory and file name of this script. These come from __file__ rather
+# than sys.argv[0], which is the WSGI server's executable when this module
+# is imported by one. PY_SCRIPT_NAME is also the URL path component that
+# requests for includes, results etc. are addressed to.
+PY_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PY_SCRIPT_NAME = os.path.basename(__file__)
 
 # Function for generating overview.html and experiment.html.
 #
@@ -52,8 +99,9 @@ PY_SCRIPT_NAME = os.path.split(sys.argv[0])[1]
 #       backwards compatibility.
 #     * We want to generate them automatically, since they're almost identical.
 #     * We also want server.py to be able to generate the same HTML dynamically
-#       in order to implement the 'withsquare' option.
-def generate_html(setcounter=None, overview=False):
+#       in order to implement the 'withsquare' option, and to version the
+#       include URLs (see bundle_versions()) so browsers can cache them for good.
+def generate_html(setcounter=None, overview=False, versions=None):
     html = u"""<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.0 Transitional//EN">
 <html>
 <head>
@@ -82,16 +130,16 @@ def generate_html(setcounter=None, overview=False):
     <!-- Backwards compatability cruft to ensure that old JS data files work. -->
     <script type="application/x-javascript" src="backcompatcruft.js"></script>
     <!-- JS includes. -->
-    <script type="application/x-javascript" src="%s?include=js"></script>
+    <script type="application/x-javascript" src="%s?include=js%s"></script>
     <!-- Data file JS includes. -->
-    <script type="application/x-javascript" src="%s?include=data"></script>
+    <script type="application/x-javascript" src="%s?include=data%s"></script>
     <!-- Set up configuration variables. -->
     <script type="application/x-javascript" src="conf.js"></script>
 
     <!-- The main body of JS code. -->
     <script type="application/x-javascript" src="%s?include=main.js%s%s"></script>
 
-    <link rel="stylesheet" type="text/css" href="%s?include=css">
+    <link rel="stylesheet" type="text/css" href="%s?include=css%s">
 
     <!-- To be reset by JavaScript. -->
     <title>Experiment</title>
@@ -113,80 +161,12 @@ def generate_html(setcounter=None, overview=False):
 </body>
 </html>
 """
-    return html % (PY_SCRIPT_NAME, PY_SCRIPT_NAME, PY_SCRIPT_NAME, PY_SCRIPT_NAME,
+    def v(name):
+        return versions and u"&v=%s" % versions[name] or u""
+    return html % (PY_SCRIPT_NAME, PY_SCRIPT_NAME, v('js'), PY_SCRIPT_NAME, v('data'), PY_SCRIPT_NAME,
                    setcounter is not None and u"&withsquare=%i" % setcounter or u"",
                    overview and u"&overview=yes" or u"",
-                   PY_SCRIPT_NAME)
-
-command_line_options = None
-try:
-    command_line_options, _ = getopt.getopt(sys.argv[1:], "m:p:r:", ["genhtml="])
-except getopt.GetoptError:
-    sys.stderr.write("Bad arguments\n")
-    sys.exit(1)
-
-if __name__ == "__main__":
-    gh = [x for x in command_line_options if x[0] == '--genhtml']
-    gh.reverse()
-
-    if gh:
-        # Not much point catching exceptions here, since this is just going
-        # to be run on the command line, and the default Python errors will be fine.
-        experiment_html = generate_html(setcounter=None, overview=False)
-        overview_html = generate_html(setcounter=None, overview=True)
-        ef = open(os.path.join(gh[0][1], 'experiment.html'), "w")
-        ef.write(experiment_html)
-        ef.close()
-        of = open(os.path.join(gh[0][1], 'overview.html'), "w")
-        of.write(overview_html)
-        of.close()
-        sys.exit(0)
-
-
-import types
-import logging
-import getopt
-import itertools
-import StringIO
-if (sys.version.split(' ')[0]) >= '3.0': # No md5 module in Python 3000.
-    import hashlib as md5
-else:
-    import md5
-import time as time_module
-import types
-import cgi
-import string
-import urllib
-
-
-# The 'json' module was introduced in Python 2.6. If it's not available we use a simple
-# method to serialize a dict of strings to JSON.
-dict_to_json = None
-try:
-    import json
-    dict_to_json = json.dumps
-except ImportError:
-    def dtj(d):
-        out = StringIO()
-        out.write("{")
-        its = d.items()
-        count = 0
-        for k, v in its:
-            if not isinstance(v, basestring):
-                raise TypeError("dict_to_json cannot handle non-string key values")
-            out.write('"')
-            for c in k:
-                out.write("\\u%04x" % ord(c))
-            out.write('":"')
-            for c in v:
-                out.write("\\u%04x" % ord(c))
-            out.write('"')
-            if count < len(its) - 1:
-                out.write(',')
-            count += 1
-        out.write("}")
-        return out.getvalue()
-    dict_to_json = dtj
+                   PY_SCRIPT_NAME, v('css'))
 
 
 #
@@ -223,7 +203,7 @@ except ImportError:
 # SOFTWARE.
 # */
 
-from StringIO import StringIO
+from io import StringIO
 
 def jsmin(js):
     ins = StringIO(js)
@@ -409,347 +389,6 @@ class JavascriptMinify(object):
 #
 
 
-#
-# ========== START OF decoder.py AND scanner.py FROM simple_json PACKAGE ==========
-#
-# This package is licensed under the MIT license (which is compatible with the BSD
-# license used for Ibex).
-#
-# http://pypi.python.org/pypi/simplejson
-#
-import re
-
-# In the original code: from simplejson.scanner import Scanner, pattern
-import sre_parse, sre_compile, sre_constants
-from sre_constants import BRANCH, SUBPATTERN
-from re import VERBOSE, MULTILINE, DOTALL
-import re
-
-__all__ = ['Scanner', 'pattern']
-
-FLAGS = (VERBOSE | MULTILINE | DOTALL)
-class Scanner(object):
-    def __init__(self, lexicon, flags=FLAGS):
-        self.actions = [None]
-        # combine phrases into a compound pattern
-        s = sre_parse.Pattern()
-        s.flags = flags
-        p = []
-        for idx, token in enumerate(lexicon):
-            phrase = token.pattern
-            try:
-                subpattern = sre_parse.SubPattern(s,
-                    [(SUBPATTERN, (idx + 1, sre_parse.parse(phrase, flags)))])
-            except sre_constants.error:
-                raise
-            p.append(subpattern)
-            self.actions.append(token)
-
-        p = sre_parse.SubPattern(s, [(BRANCH, (None, p))])
-        self.scanner = sre_compile.compile(p)
-
-
-    def iterscan(self, string, idx=0, context=None):
-        """
-        Yield match, end_idx for each match
-        """
-        match = self.scanner.scanner(string, idx).match
-        actions = self.actions
-        lastend = idx
-        end = len(string)
-        while True:
-            m = match()
-            if m is None:
-                break
-            matchbegin, matchend = m.span()
-            if lastend == matchend:
-                break
-            action = actions[m.lastindex]
-            if action is not None:
-                rval, next_pos = action(m, context)
-                if next_pos is not None and next_pos != matchend:
-                    # "fast forward" the scanner
-                    matchend = next_pos
-                    match = self.scanner.scanner(string, matchend).match
-                yield rval, matchend
-            lastend = matchend
-
-def pattern(pattern, flags=FLAGS):
-    def decorator(fn):
-        fn.pattern = pattern
-        fn.regex = re.compile(pattern, flags)
-        return fn
-    return decorator
-
-FLAGS = re.VERBOSE | re.MULTILINE | re.DOTALL
-
-def _floatconstants():
-    import struct
-    import sys
-    _BYTES = '7FF80000000000007FF0000000000000'.decode('hex')
-    if sys.byteorder != 'big':
-        _BYTES = _BYTES[:8][::-1] + _BYTES[8:][::-1]
-    nan, inf = struct.unpack('dd', _BYTES)
-    return nan, inf, -inf
-
-NaN, PosInf, NegInf = _floatconstants()
-
-def linecol(doc, pos):
-    lineno = doc.count('\n', 0, pos) + 1
-    if lineno == 1:
-        colno = pos
-    else:
-        colno = pos - doc.rindex('\n', 0, pos)
-    return lineno, colno
-
-def errmsg(msg, doc, pos, end=None):
-    lineno, colno = linecol(doc, pos)
-    if end is None:
-        return '%s: line %d column %d (char %d)' % (msg, lineno, colno, pos)
-    endlineno, endcolno = linecol(doc, end)
-    return '%s: line %d column %d - line %d column %d (char %d - %d)' % (
-        msg, lineno, colno, endlineno, endcolno, pos, end)
-
-_CONSTANTS = {
-    '-Infinity': NegInf,
-    'Infinity': PosInf,
-    'NaN': NaN,
-    'true': True,
-    'false': False,
-    'null': None,
-}
-
-def JSONConstant(match, context, c=_CONSTANTS):
-    return c[match.group(0)], None
-pattern('(-?Infinity|NaN|true|false|null)')(JSONConstant)
-
-def JSONNumber(match, context):
-    match = JSONNumber.regex.match(match.string, *match.span())
-    integer, frac, exp = match.groups()
-    if frac or exp:
-        res = float(integer + (frac or '') + (exp or ''))
-    else:
-        res = int(integer)
-    return res, None
-pattern(r'(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?')(JSONNumber)
-
-STRINGCHUNK = re.compile(r'(.*?)(["\\])', FLAGS)
-BACKSLASH = {
-    '"': u'"', '\\': u'\\', '/': u'/',
-    'b': u'\b', 'f': u'\f', 'n': u'\n', 'r': u'\r', 't': u'\t',
-}
-
-DEFAULT_ENCODING = "UTF-8"
-
-def scanstring(s, end, encoding=None, _b=BACKSLASH, _m=STRINGCHUNK.match):
-    if encoding is None:
-        encoding = DEFAULT_ENCODING
-    chunks = []
-    _append = chunks.append
-    begin = end - 1
-    while 1:
-        chunk = _m(s, end)
-        if chunk is None:
-            raise ValueError(
-                errmsg("Unterminated string starting at", s, begin))
-        end = chunk.end()
-        content, terminator = chunk.groups()
-        if content:
-            if not isinstance(content, unicode):
-                content = unicode(content, encoding)
-            _append(content)
-        if terminator == '"':
-            break
-        try:
-            esc = s[end]
-        except IndexError:
-            raise ValueError(
-                errmsg("Unterminated string starting at", s, begin))
-        if esc != 'u':
-            try:
-                m = _b[esc]
-            except KeyError:
-                raise ValueError(
-                    errmsg("Invalid \\escape: %r" % (esc,), s, end))
-            end += 1
-        else:
-            esc = s[end + 1:end + 5]
-            try:
-                m = unichr(int(esc, 16))
-                if len(esc) != 4 or not esc.isalnum():
-                    raise ValueError
-            except ValueError:
-                raise ValueError(errmsg("Invalid \\uXXXX escape", s, end))
-            end += 5
-        _append(m)
-    return u''.join(chunks), end
-
-def JSONString(match, context):
-    encoding = getattr(context, 'encoding', None)
-    return scanstring(match.string, match.end(), encoding)
-pattern(r'"')(JSONString)
-
-WHITESPACE = re.compile(r'\s*', FLAGS)
-
-def JSONObject(match, context, _w=WHITESPACE.match):
-    pairs = {}
-    s = match.string
-    end = _w(s, match.end()).end()
-    nextchar = s[end:end + 1]
-    # trivial empty object
-    if nextchar == '}':
-        return pairs, end + 1
-    if nextchar != '"':
-        raise ValueError(errmsg("Expecting property name", s, end))
-    end += 1
-    encoding = getattr(context, 'encoding', None)
-    iterscan = JSONScanner.iterscan
-    while True:
-        key, end = scanstring(s, end, encoding)
-        end = _w(s, end).end()
-        if s[end:end + 1] != ':':
-            raise ValueError(errmsg("Expecting : delimiter", s, end))
-        end = _w(s, end + 1).end()
-        try:
-            value, end = iterscan(s, idx=end, context=context).next()
-        except StopIteration:
-            raise ValueError(errmsg("Expecting object", s, end))
-        pairs[key] = value
-        end = _w(s, end).end()
-        nextchar = s[end:end + 1]
-        end += 1
-        if nextchar == '}':
-            break
-        if nextchar != ',':
-            raise ValueError(errmsg("Expecting , delimiter", s, end - 1))
-        end = _w(s, end).end()
-        nextchar = s[end:end + 1]
-        end += 1
-        if nextchar != '"':
-            raise ValueError(errmsg("Expecting property name", s, end - 1))
-    object_hook = getattr(context, 'object_hook', None)
-    if object_hook is not None:
-        pairs = object_hook(pairs)
-    return pairs, end
-pattern(r'{')(JSONObject)
-
-def JSONArray(match, context, _w=WHITESPACE.match):
-    values = []
-    s = match.string
-    end = _w(s, match.end()).end()
-    # look-ahead for trivial empty array
-    nextchar = s[end:end + 1]
-    if nextchar == ']':
-        return values, end + 1
-    iterscan = JSONScanner.iterscan
-    while True:
-        try:
-            value, end = iterscan(s, idx=end, context=context).next()
-        except StopIteration:
-            raise ValueError(errmsg("Expecting object", s, end))
-        values.append(value)
-        end = _w(s, end).end()
-        nextchar = s[end:end + 1]
-        end += 1
-        if nextchar == ']':
-            break
-        if nextchar != ',':
-            raise ValueError(errmsg("Expecting , delimiter", s, end))
-        end = _w(s, end).end()
-    return values, end
-pattern(r'\[')(JSONArray)
-
-ANYTHING = [
-    JSONObject,
-    JSONArray,
-    JSONString,
-    JSONConstant,
-    JSONNumber,
-]
-
-JSONScanner = Scanner(ANYTHING)
-
-class JSONDecoder(object):
-    """
-    Simple JSON <http://json.org> decoder
-
-    Performs the following translations in decoding:
-
-    +---------------+-------------------+
-    | JSON          | Python            |
-    +===============+===================+
-    | object        | dict              |
-    +---------------+-------------------+
-    | array         | list              |
-    +---------------+-------------------+
-    | string        | unicode           |
-    +---------------+-------------------+
-    | number (int)  | int, long         |
-    +---------------+-------------------+
-    | number (real) | float             |
-    +---------------+-------------------+
-    | true          | True              |
-    +---------------+-------------------+
-    | false         | False             |
-    +---------------+-------------------+
-    | null          | None              |
-    +---------------+-------------------+
-
-    It also understands ``NaN``, ``Infinity``, and ``-Infinity`` as
-    their corresponding ``float`` values, which is outside the JSON spec.
-    """
-
-    _scanner = Scanner(ANYTHING)
-    __all__ = ['__init__', 'decode', 'raw_decode']
-
-    def __init__(self, encoding=None, object_hook=None):
-        """
-        ``encoding`` determines the encoding used to interpret any ``str``
-        objects decoded by this instance (utf-8 by default).  It has no
-        effect when decoding ``unicode`` objects.
-
-        Note that currently only encodings that are a superset of ASCII work,
-        strings of other encodings should be passed in as ``unicode``.
-
-        ``object_hook``, if specified, will be called with the result
-        of every JSON object decoded and its return value will be used in
-        place of the given ``dict``.  This can be used to provide custom
-        deserializations (e.g. to support JSON-RPC class hinting).
-        """
-        self.encoding = encoding
-        self.object_hook = object_hook
-
-    def decode(self, s, _w=WHITESPACE.match):
-        """
-        Return the Python representation of ``s`` (a ``str`` or ``unicode``
-        instance containing a JSON document)
-        """
-        obj, end = self.raw_decode(s, idx=_w(s, 0).end())
-        end = _w(s, end).end()
-        if end != len(s):
-            raise ValueError(errmsg("Extra data", s, end, len(s)))
-        return obj
-
-    def raw_decode(self, s, **kw):
-        """
-        Decode a JSON document from ``s`` (a ``str`` or ``unicode`` beginning
-        with a JSON document) and return a 2-tuple of the Python
-        representation and the index in ``s`` where the document ended.
-
-        This can be used to decode a JSON document from a string that may
-        have extraneous data at the end.
-        """
-        kw.setdefault('context', self)
-        try:
-            obj, end = self._scanner.iterscan(s, **kw).next()
-        except StopIteration:
-            raise ValueError("No JSON object could be decoded")
-        return obj, end
-
-__all__ = ['JSONDecoder']
-#
-# ========== END OF decoder.py AND scanner.py ==========
-#
 
 #
 # Random utility.
@@ -784,7 +423,7 @@ def css_parse(css):
     while i < len(css):
         c = css[i]
 
-        if state is "selector":
+        if state == "selector":
             if c.isspace():
                 pass
             elif c == "/":
@@ -808,18 +447,18 @@ def css_parse(css):
                 state = "selector_tagname"
             else:
                 assert False
-        elif state is "precomment":
+        elif state == "precomment":
             if c == "*":
                 state = "comment"
             else:
                 state = precomment_return_to_state
-        elif state is "comment":
+        elif state == "comment":
             if c == "*":
                 state = "preclose_comment"
-        elif state is "preclose_comment":
+        elif state == "preclose_comment":
             if c == "/":
                 state = precomment_return_to_state
-        elif state is "operator":
+        elif state == "operator":
             # Special handling of comments since they separate operators. (We don't
             # want to go back to this state, but rather to the "selector" state.)
             if c == "/":
@@ -831,7 +470,7 @@ def css_parse(css):
                 current_selectors.append(current_op.getvalue())
                 i -= 1 # IMPORTANT IMPORTANT IMPORTANT
                 state = "selector"
-        elif state is "operator_comment":
+        elif state == "operator_comment":
             if c == "*":
                 current_selectors.append(current_op.getvalue())
                 precomment_return_to_state = "selector"
@@ -839,7 +478,7 @@ def css_parse(css):
             else:
                 current_op.write(c) # We'll allow '/' chars in the middle of operators -- this is a permissive parser.
                 state = "operator"
-        elif state is "selector_tagname":
+        elif state == "selector_tagname":
             if c == "/":
                 current_selectors.append([current_selector_tagname.getvalue(), '', ''])
                 precomment_return_to_state = "selector"
@@ -862,7 +501,7 @@ def css_parse(css):
                 current_selector_kind = (c in KINDS_CHARS and (c,) or (None,))[0]
                 current_selector_rest = StringIO()
                 state = "selector_rest"
-        elif state is "selector_rest":
+        elif state == "selector_rest":
             if c.isalnum() or c in ":-":
                 current_selector_rest.write(c)
             else:
@@ -883,7 +522,7 @@ def css_parse(css):
                 else: #elif c == "{": # Being lax here because we don't want this parser to ever fail.
                     current_body = StringIO()
                     state = "body"
-        elif state is "body":
+        elif state == "body":
             if c == "}":
                 definitions.append((current_selectors, current_body.getvalue()))
 
@@ -904,7 +543,7 @@ def css_parse(css):
                 state = "body_instring"
             else:
                 current_body.write(c)
-        elif state is "body_instring":
+        elif state == "body_instring":
             current_body.write(c)
             if c == quote_char and prev_char != "\\":
                 state = "body"
@@ -944,155 +583,133 @@ def css_spit_out(css_definitions, ofile):
 # Logging and configuration variables.
 #
 
-# If EXTERNAL_CONFIG_URL has already been defined in this file, don't attempt
-# to open SERVER_CONF_PY_FILE, even if it's defined.
+DEFAULT_ENCODING = "utf-8"
+
+# These are set by create_app().
 CFG = { }
-if (not globals().has_key('EXTERNAL_CONFIG_URL') or (not globals()['EXTERNAL_CONFIG_URL'])) and globals().has_key('SERVER_CONF_PY_FILE') and globals()['SERVER_CONF_PY_FILE']:
-    try:
-        execfile(SERVER_CONF_PY_FILE, CFG)
-    except Exception, e:
-        print "Could not open/load config file: %s" % e
-        sys.exit(1)
-else:
-    CFG = globals()
-
-# Check if we're using external or internal config.
-extkeys = ['EXTERNAL_CONFIG_URL', 'EXTERNAL_CONFIG_METHOD', 'EXTERNAL_CONFIG_PASS_PARAMS']
-for k in extkeys: # Note that logging can't be set up till config is parsed, so we use sys.stderr here.
-    if CFG.has_key(k) and CFG[k]:
-        for kk in extkeys:
-            if not (CFG.has_key(kk) and CFG[kk]):
-                vs = ', '.join(map(lambda x: "'%s'" % x))
-                sys.stderr.write("If one of the configuration variables %s is present, then all %i must be present." % (vs, len(vs)))
-                sys.exit(1)
+PWD = None
+logger = logging.getLogger("server")
 
-        # Check that EXTERNAL_CONFIG_METHOD IS 'GET' (haven't added support for POST yet).
-        if not CFG['EXTERNAL_CONFIG_METHOD'] == 'GET':
-            sys.stderr.write("'GET' is currently the only supported method for getting external config via HTTP.")
-            sys.exit(1)
+class ConfigError(Exception):
+    pass
 
-        # Make a request to the external config HTTP server, receiving a JSON record as a reply (we hope).
-        r = None
+def resolve_path(path):
+    """Relative paths in the configuration are taken relative to the www
+    directory (which server.py used to have to be started from), so that
+    the working directory of a WSGI server doesn't matter."""
+    return os.path.join(PY_SCRIPT_DIR, path)
+
+def load_config(overrides=None):
+    # If EXTERNAL_CONFIG_URL has already been defined in this file, don't attempt
+    # to open SERVER_CONF_PY_FILE, even if it's defined.
+    cfg = { }
+    if not globals().get('EXTERNAL_CONFIG_URL') and globals().get('SERVER_CONF_PY_FILE'):
         try:
-            url = CFG['EXTERNAL_CONFIG_URL']
-            if CFG['EXTERNAL_CONFIG_PASS_PARAMS'] and CFG['EXTERNAL_CONFIG_METHOD'].upper() == "GET":
-                sepchr = '?' in url and '&' or '?' # Don't screw it up if the url already has params.
-                url += sepchr + "dir=" + urllib.quote(PY_SCRIPT_DIR)
-            try:
-                req_data = None
-#                if CFG['EXTERNAL_CONFIG_PASS_PARAMS'] and CFG['EXTERNAL_CONFIG_METHOD'].upper() == "POST":
-#                    sys.stderr.write("NOT IMPLEMENTED!!!!\n")
-#                    sys.exit(1)
-                r = urllib.urlopen(url)
-                data = r.read()
-                dec = JSONDecoder()
-                try:
-                     json = dec.decode(data)
-                     if type(json) != type({}):
-                         sys.stderr.write("JSON data received from the following external configuration URL parsed correctly but was not a dictionary as required: %s" % url)
-                         sys.exit(1)
-                     CFG = json
-                except ValueError:
-                    sys.stderr.write("Bad JSON data received from the following external configuration URL: %s" % url)
-                    sys.exit(1)
-            except IOError, e:
-                sys.stderr.write("Error opening the following URL to get external configuration: %s (%s)" % (url, str(e)))
-                sys.exit(1)
-        finally:
-            if r: r.close()
+            with open(resolve_path(SERVER_CONF_PY_FILE)) as f:
+                exec(compile(f.read(), SERVER_CONF_PY_FILE, 'exec'), cfg)
+        except Exception as e:
+            raise ConfigError("Could not open/load config file: %s" % e)
+    else:
+        cfg = dict(globals())
 
-        break
+    # Check if we're using external or internal config.
+    extkeys = ['EXTERNAL_CONFIG_URL', 'EXTERNAL_CONFIG_METHOD', 'EXTERNAL_CONFIG_PASS_PARAMS']
+    if any(cfg.get(k) for k in extkeys):
+        if not all(cfg.get(k) for k in extkeys):
+            vs = ', '.join(["'%s'" % k for k in extkeys])
+            raise ConfigError("If one of the configuration variables %s is present, then all %i must be present." % (vs, len(extkeys)))
 
-# Back compat.
-if CFG.has_key('WEBSPR_WORKING_DIR') and not CFG.has_key('IBEX_WORKING_DIR'):
-    CFG['IBEX_WORKING_DIR'] = CFG['WEBSPR_WORKING_DIR']
+        # Check that EXTERNAL_CONFIG_METHOD IS 'GET' (haven't added support for POST yet).
+        if not cfg['EXTERNAL_CONFIG_METHOD'] == 'GET':
+            raise ConfigError("'GET' is currently the only supported method for getting external config via HTTP.")
 
-logging.basicConfig()
-logger = logging.getLogger("server")
-logger.addHandler(logging.StreamHandler())
-log_filename = os.path.join(CFG.has_key('IBEX_WORKING_DIR') and CFG['IBEX_WORKING_DIR'] or '', 'server.log')
-try:
-    open(log_filename, "w").close();
-except:
-    sys.stderr.write("Error touching server log file '%s'" % log_filename)
-logger.addHandler(logging.FileHandler(filename=log_filename))
-
-# Check that all conf variables have been defined
-# (except the optional IBEX_WORKING_DIR and PORT variables).
-for k in ['RESULT_FILE_NAME',
-          'RAW_RESULT_FILE_NAME', 'SERVER_STATE_DIR',
-          'SERVER_MODE', 'JS_INCLUDES_DIR', 'DATA_INCLUDES_DIR', 'CHUNK_INCLUDES_DIR',
-          'CSS_INCLUDES_DIR', 'OTHER_INCLUDES_DIR', 'CACHE_DIR', 'JS_INCLUDES_LIST', 'DATA_INCLUDES_LIST',
-          'CSS_INCLUDES_LIST', 'STATIC_FILES_DIR', 'INCLUDE_COMMENTS_IN_RESULTS_FILE',
-          'SIMPLE_RESULTS_FILE_COMMENTS', 'INCLUDE_HEADERS_IN_RESULTS_FILE']:
-    if not CFG.has_key(k):
-        logger.error("Configuration variable '%s' was not defined." % k)
-        sys.exit(1)
-# Define optional variables if they are not already defined.
-CFG['PORT'] = CFG.has_key('PORT') and CFG['PORT'] or None
-CFG['IBEX_WORKING_DIR'] = CFG.has_key('IBEX_WORKING_DIR') and CFG['IBEX_WORKING_DIR'] or None
-CFG['MINIFY_JS'] = CFG.has_key('MINIFY_JS') and CFG['MINIFY_JS'] or False
-
-# Check for "-m" and "-p" options (sets server mode and port respectively).
-# Also check for "-r" option (resest counter on startup).
-COUNTER_SHOULD_BE_RESET = False
-try:
-    for k,v in command_line_options:
-        if k == "-m":
-            CFG['SERVER_MODE'] = v
-        elif k == "-p":
-            CFG['PORT'] = int(v)
-        elif k == "-r":
-            COUNTER_SHOULD_BE_RESET = True
-except ValueError:
-    logger.error("Argument to -p must be an integer")
-    sys.exit(1)
-
-# Check values of (some) conf variables.
-if CFG['SERVER_MODE'] != "cgi" and type(CFG['PORT']) != types.IntType:
-    logger.error("Bad value (or no value) for server port.")
-    sys.exit(1)
-if type(CFG['JS_INCLUDES_LIST']) != types.ListType or len(CFG['JS_INCLUDES_LIST']) < 1 or (CFG['JS_INCLUDES_LIST'][0] not in ["block", "allow"]):
-    logger.error("Bad value for 'JS_INCLUDES_LIST' conf variable.")
-    sys.exit(1)
-if type(CFG['CSS_INCLUDES_LIST']) != types.ListType or len(CFG['CSS_INCLUDES_LIST']) < 1 or (CFG['CSS_INCLUDES_LIST'][0] not in ["block", "allow"]):
-    logger.error("Bad value for 'CSS_INCLUDES_LIST' conf variable.")
-    sys.exit(1)
-if type(CFG['DATA_INCLUDES_LIST']) != types.ListType or len(CFG['DATA_INCLUDES_LIST']) < 1 or (CFG['DATA_INCLUDES_LIST'][0] not in ["block", "allow"]):
-    logger.error("Bad value for 'DATA_INCLUDES_LIST' conf variable.")
-    sys.exit(1)
+        # Make a request to the external config HTTP server, receiving a JSON record as a reply (we hope).
+        url = cfg['EXTERNAL_CONFIG_URL']
+        if cfg['EXTERNAL_CONFIG_PASS_PARAMS']:
+            sepchr = '?' in url and '&' or '?' # Don't screw it up if the url already has params.
+            url += sepchr + "dir=" + urllib.parse.quote(PY_SCRIPT_DIR)
+        try:
+            with urllib.request.urlopen(url) as r:
+                data = r.read()
+        except IOError as e:
+            raise ConfigError("Error opening the following URL to get external configuration: %s (%s)" % (url, str(e)))
+        try:
+            cfg = json.loads(data)
+        except ValueError:
+            raise ConfigError("Bad JSON data received from the following external configuration URL: %s" % url)
+        if not isinstance(cfg, dict):
+            raise ConfigError("JSON data received from the following external configuration URL parsed correctly but was not a dictionary as required: %s" % url)
+
+    # Back compat.
+    if 'WEBSPR_WORKING_DIR' in cfg and 'IBEX_WORKING_DIR' not in cfg:
+        cfg['IBEX_WORKING_DIR'] = cfg['WEBSPR_WORKING_DIR']
+
+    # Check that all conf variables have been defined
+    # (except the optional IBEX_WORKING_DIR and PORT variables).
+    for k in ['RESULT_FILE_NAME',
+              'RAW_RESULT_FILE_NAME', 'SERVER_STATE_DIR',
+              'SERVER_MODE', 'JS_INCLUDES_DIR', 'DATA_INCLUDES_DIR', 'CHUNK_INCLUDES_DIR',
+              'CSS_INCLUDES_DIR', 'OTHER_INCLUDES_DIR', 'CACHE_DIR', 'JS_INCLUDES_LIST', 'DATA_INCLUDES_LIST',
+              'CSS_INCLUDES_LIST', 'STATIC_FILES_DIR', 'INCLUDE_COMMENTS_IN_RESULTS_FILE',
+              'SIMPLE_RESULTS_FILE_COMMENTS', 'INCLUDE_HEADERS_IN_RESULTS_FILE']:
+        if k not in cfg:
+            raise ConfigError("Configuration variable '%s' was not defined." % k)
+    # Define optional variables if they are not already defined.
+    cfg['PORT'] = cfg.get('PORT') or None
+    cfg['IBEX_WORKING_DIR'] = cfg.get('IBEX_WORKING_DIR') or None
+    cfg['MINIFY_JS'] = cfg.get('MINIFY_JS') or False
+    cfg['ASYNC_WORKERS'] = cfg.get('ASYNC_WORKERS') or ASYNC_WORKERS
+
+    # Values given on the command line ("-m" and "-p") take precedence.
+    cfg.update(overrides or { })
+
+    # Check values of (some) conf variables.
+    if cfg['SERVER_MODE'] not in ["paste", "toy", "cgi", "async"]:
+        raise ConfigError("Unrecognized value for SERVER_MODE configuration variable (or '-m' command line option).")
+    if cfg['SERVER_MODE'] != "cgi" and not isinstance(cfg['PORT'], int):
+        raise ConfigError("Bad value (or no value) for server port.")
+    if not isinstance(cfg['ASYNC_WORKERS'], int) or cfg['ASYNC_WORKERS'] < 1:
+        raise ConfigError("Bad value for 'ASYNC_WORKERS' conf variable.")
+    for k in ['JS_INCLUDES_LIST', 'CSS_INCLUDES_LIST', 'DATA_INCLUDES_LIST']:
+        if not isinstance(cfg[k], list) or len(cfg[k]) < 1 or cfg[k][0] not in ["block", "allow"]:
+            raise ConfigError("Bad value for '%s' conf variable." % k)
+
+    return cfg
+
+def working_dir(cfg):
+    pwd = os.environ.get("IBEX_WORKING_DIR") or cfg['IBEX_WORKING_DIR']
+    if pwd is None:
+        raise ConfigError("No value was given for config variable IBEX_WORKING_DIR")
+    return resolve_path(pwd)
+
+def setup_logging(reset_log=False):
+    logging.basicConfig()
+    log_filename = os.path.join(PWD, 'server.log')
+    if reset_log:
+        try:
+            open(log_filename, "w").close()
+        except IOError:
+            sys.stderr.write("Error touching server log file '%s'\n" % log_filename)
+    for h in logger.handlers:
+        if isinstance(h, logging.FileHandler):
+            logger.removeHandler(h)
+            h.close()
+    logger.addHandler(logging.FileHandler(filename=log_filename))
 
 
 # File locking on UNIX/Linux/OS X
 HAVE_FLOCK = False
-if (sys.version.split(' ')[0]) >= '2.4': # File locking doesn't seem to work well in Python 2.3.
-    try:
-        import fcntl # For flock.
-        if 'flock' in dir(fcntl) and \
-                type(fcntl.flock) == types.BuiltinFunctionType:
-            HAVE_FLOCK = True
-    except:
-        pass
-
-# Configuration.
-if CFG['SERVER_MODE'] not in ["paste", "toy", "cgi"]:
-    logger.error("Unrecognized value for SERVER_MODE configuration variable (or '-m' command line option).")
-    sys.exit(1)
-
-if CFG['SERVER_MODE'] in ["toy", "paste"]:
-    import threading
-    import BaseHTTPServer
-    import SimpleHTTPServer
-    import SocketServer
+try:
+    import fcntl # For flock.
+    HAVE_FLOCK = hasattr(fcntl, 'flock')
+except ImportError:
+    pass
 
-PWD = None
-if CFG.has_key('IBEX_WORKING_DIR'):
-    PWD = CFG['IBEX_WORKING_DIR']
-if os.environ.get("IBEX_WORKING_DIR"):
-    PWD = os.environ.get("IBEX_WORKING_DIR")
-if PWD is None:
-    logger.error("No value was given for config variable IBEX_WORKING_DIR")
-    sys.exit(1)
+# Brotli is optional; without it, responses are only precompressed with gzip.
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 #
 # Some utility functions/classes.
@@ -1109,35 +726,162 @@ def unlock_and_close(f):
 #        fcntl.flock(f.fileno(), 8)
     f.close()
 
+#
+# The latin square counter.
+#
+# The counter is held in memory. Every change is appended, as an absolute
+# value, to a write-ahead log (counter.log) next to the snapshot in
+# server_state/counter, and the log is folded back into the snapshot every
+# COUNTER_COMPACT_RECORDS changes. Processes sharing the state directory take
+# turns through flock on counter.lock, and notice each other's changes by the
+# log's size or mtime moving, so reading the counter costs an fstat. (While a
+# server is running, change the counter with ?setsquare= rather than by
+# editing the snapshot.)
+#
+
+COUNTER_COMPACT_RECORDS = 1000
+
+class LatinSquareCounter(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dir = None
+        self.pid = None
+        self.lock_fd = None
+        self.log_fd = None
+        self.value = None
+        self.seen = None    # (size, mtime) of the log when self.value was read.
+        self.tail = 0       # Length of the log up to its last complete record.
+        self.records = 0
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def open(self, dir):
+        """Use (and replay) the counter in the given state directory."""
+        with self.lock:
+            self.close()
+            self.dir = dir
+            self.reopen()
+            self.flock(False)
+            try:
+                self.load()
+            finally:
+                self.unflock()
+
+    def close(self):
+        for fd in (self.lock_fd, self.log_fd):
+            if fd is not None:
+                os.close(fd)
+        self.lock_fd = self.log_fd = self.pid = self.seen = None
+
+    def reopen(self):
+        # flocks belong to open files, which a forked child shares with its
+        # parent, so each process opens its own.
+        if self.pid == os.getpid():
+            return
+        self.close()
+        self.lock_fd = os.open(self.path('counter.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        self.log_fd = os.open(self.path('counter.log'), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self.pid = os.getpid()
+
+    def flock(self, exclusive):
+        if HAVE_FLOCK:
+            fcntl.flock(self.lock_fd, exclusive and fcntl.LOCK_EX or fcntl.LOCK_SH)
+
+    def unflock(self):
+        if HAVE_FLOCK:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    def log_state(self):
+        st = os.fstat(self.log_fd)
+        return st.st_size, st.st_mtime_ns
+
+    def load(self):
+        """Read the snapshot and replay the log (with counter.lock held)."""
+        with open(self.path('counter')) as f:
+            value = int(f.read().strip())
+        state = self.log_state()
+        with open(self.path('counter.log'), "rb") as f:
+            log = f.read(state[0])
+        # A record without its newline was cut short by a crash; ignore it.
+        self.tail = log.rfind(b"\n") + 1
+        records = log[:self.tail].split()
+        for record in records:
+            try:
+                value = int(record)
+            except ValueError:
+                logger.error("Ignoring bad record %r in counter log" % record)
+        self.value = value
+        self.records = len(records)
+        self.seen = state
+
+    def get(self):
+        with self.lock:
+            self.reopen()
+            if self.log_state() != self.seen:
+                self.flock(False)
+                try:
+                    self.load()
+                finally:
+                    self.unflock()
+            return self.value
+
+    def update(self, update_func):
+        with self.lock:
+            self.reopen()
+            self.flock(True)
+            try:
+                if self.log_state() != self.seen:
+                    self.load()
+                if self.tail != self.seen[0]:
+                    os.ftruncate(self.log_fd, self.tail)
+                value = update_func(self.value)
+                os.write(self.log_fd, b"%d\n" % value)
+                os.fsync(self.log_fd)
+                self.value = value
+                self.records += 1
+                if self.records >= COUNTER_COMPACT_RECORDS:
+                    self.compact()
+                self.seen = self.log_state()
+                self.tail = self.seen[0]
+                return value
+            finally:
+                self.unflock()
+
+    def compact(self):
+        # The snapshot is replaced before the log is emptied, and both hold
+        # absolute values, so a crash in between loses nothing.
+        snapshot = self.path('counter')
+        tmp_path = "%s.%d.tmp" % (snapshot, os.getpid())
+        with open(tmp_path, "w") as f:
+            f.write(str(self.value))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snapshot)
+        os.ftruncate(self.log_fd, 0)
+        os.fsync(self.log_fd)
+        self.records = 0
+
+counter = LatinSquareCounter()
+
+# These raise IOError (after logging it) if the server state can't be read or
+# written; callers answer with a 500 rather than taking the server down.
 def get_counter():
     try:
-        f = lock_and_open(os.path.join(PWD, CFG['SERVER_STATE_DIR'], 'counter'), "r")
-        n = int(f.read().strip())
-        unlock_and_close(f)
-        return n
-    except (IOError, ValueError), e:
+        return counter.get()
+    except (IOError, ValueError) as e:
         logger.error("Error reading counter from server state: %s" % str(e))
-        sys.exit(1)
+        raise IOError(str(e))
+
 def set_counter(n):
-    try:
-        f = lock_and_open(os.path.join(PWD, CFG['SERVER_STATE_DIR'], 'counter'), "w")
-        f.write(str(n))
-        unlock_and_close(f)
-    except IOError, e:
-        logger.error("Error setting counter in server state: %s" % str(e))
-        sys.exit(1)
+    update_counter(lambda x: n)
+
 def update_counter(update_func):
     try:
-        f = lock_and_open(os.path.join(PWD, CFG['SERVER_STATE_DIR'], 'counter'), "r+")
-        n = int(f.read().strip())
-        newn = update_func(n)
-        f.truncate(0)
-        f.seek(0)
-        f.write(str(newn))
-        unlock_and_close(f)
-    except IOError, e:
+        return counter.update(update_func)
+    except (IOError, ValueError) as e:
         logger.error("Error updating counter in server state: %s" % str(e))
-        sys.exit(1)
+        raise IOError(str(e))
 
 class HighLevelParseError(Exception):
     def __init__(self, *args):
@@ -1162,17 +906,17 @@ def group_list(l, n):
     return newl
 
 def rearrange(parsed_json, thetime, ip, user_agent):
-    if type(parsed_json) != types.ListType or len(parsed_json) != 6:
+    if not isinstance(parsed_json, list) or len(parsed_json) != 6:
         raise HighLevelParseError()
 
     random_counter = parsed_json[0]
-    if type(random_counter) != types.BooleanType:
+    if not isinstance(random_counter, bool):
         raise HighLevelParseError()
 
     counter = None
     try:
         counter = int(parsed_json[1])
-    except ValueError:
+    except (ValueError, TypeError):
         raise HighLevelParseError()
 
     names_array = parsed_json[2]
@@ -1182,15 +926,12 @@ def rearrange(parsed_json, thetime, ip, user_agent):
         return names_array[index]
 
     unique_md5 = parsed_json[4]
-    if (type(unique_md5) != type("") and type(unique_md5) != type(u"")) or \
-       len(unique_md5) != 22:
+    if not isinstance(unique_md5, str) or len(unique_md5) != 22:
         raise HighLevelParseError()
     uid = ip + ':' + user_agent + unique_md5
-    uid_hexdigest = md5.md5(uid).hexdigest()
+    uid_hexdigest = hashlib.md5(uid.encode(DEFAULT_ENCODING)).hexdigest()
 
     should_update_counter = parsed_json[5]
-    if (type(random_counter) != types.BooleanType):
-        raise HighLeveLParseError()
 
     #
     # This is a fairly horrible bit of code that does most of the work
@@ -1210,7 +951,7 @@ def rearrange(parsed_json, thetime, ip, user_agent):
     next_comment_index = None
     while main_index < len(parsed_json[3]):
         old_main_index = main_index
-        for phase in xrange(1, 6): # [1, 2, 3, 4, 5]
+        for phase in range(1, 6): # [1, 2, 3, 4, 5]
             next_comment_index = main_index
             subs = group_list(itertools.islice(parsed_json[3], main_index, None), phase)
 
@@ -1219,7 +960,7 @@ def rearrange(parsed_json, thetime, ip, user_agent):
             for sub in subs:
                 names = []
                 for line in sub:
-                    names.append(map(lambda x: getname(x[0]), line))
+                    names.append([getname(x[0]) for x in line])
 
                 if not old_names:
                     old_names = names
@@ -1227,7 +968,7 @@ def rearrange(parsed_json, thetime, ip, user_agent):
                     break
                 else:
                     # Add columns common to all lines.
-                    rs.extend(map(lambda l: [int(round(thetime)), uid_hexdigest] + map(lambda x: x[1], l), sub))
+                    rs.extend([[int(round(thetime)), uid_hexdigest] + [x[1] for x in l] for l in sub])
                     main_index += phase
             if len(rs) == 1:
                 main_index -= phase
@@ -1241,9 +982,9 @@ def rearrange(parsed_json, thetime, ip, user_agent):
 
         # Fallback to commenting each line.
         if old_main_index == main_index:
-            for line, i in itertools.izip(itertools.islice(parsed_json[3], main_index, None), itertools.count(0)):
-                new_results.append([int(round(thetime)), uid_hexdigest] + map(lambda x: x[1], line))
-                column_names.append([main_index + i, [map(lambda x: getname(x[0]), line)]])
+            for line, i in zip(itertools.islice(parsed_json[3], main_index, None), itertools.count(0)):
+                new_results.append([int(round(thetime)), uid_hexdigest] + [x[1] for x in line])
+                column_names.append([main_index + i, [[getname(x[0]) for x in line]]])
             break
 
     return random_counter, counter, new_results, column_names, should_update_counter
@@ -1256,26 +997,26 @@ def ensure_period(s):
 
 def intersperse_comments(main, name_specs):
     newr = []
-    for line, i in itertools.izip(main, itertools.count(0)):
+    for line, i in zip(main, itertools.count(0)):
         for idx, name_spec in name_specs:
             if idx == i:
                 if len(name_spec) == 1:
                     newr.append([u"# Columns below this comment are as follows:"])
                     newr.append([u"# 1. Time results were received."])
                     newr.append([u"# 2. MD5 hash of participant's IP address."])
-                    for colname,n in itertools.izip(name_spec[0], itertools.count(3)):
-                        newr.append([u"# %i. %s" % (n, ensure_period(unicode(colname)))])
+                    for colname,n in zip(name_spec[0], itertools.count(3)):
+                        newr.append([u"# %i. %s" % (n, ensure_period(str(colname)))])
                     break
                 else:
                     newr.append([u"# The lines below this comment are in groups of %i." % len(name_spec)])
                     newr.append([u"# The formats of the lines in each of these groups are as follows:"])
                     newr.append([u"#"])
-                    for names, i in itertools.izip(name_spec, itertools.count(1)):
+                    for names, i in zip(name_spec, itertools.count(1)):
                         newr.append([u"# Line %i:" % i])
                         newr.append([u"#     Col. 1: Time results were received."])
                         newr.append([u"#     Col. 2: MD5 hash of participant's IP address."])
-                        for name, j in itertools.izip(names, itertools.count(3)):
-                            newr.append([u"#     Col. %i: %s" % (j, ensure_period(unicode(name)))])
+                        for name, j in zip(names, itertools.count(3)):
+                            newr.append([u"#     Col. %i: %s" % (j, ensure_period(str(name)))])
                     break
         newr.append(line)
     return newr
@@ -1293,7 +1034,7 @@ def simple_intersperse_comments(main, name_specs):
             ["#"]]
     name_specs_index = 0
     start_i = 0
-    for line, i in itertools.izip(main, itertools.count(0)):
+    for line, i in zip(main, itertools.count(0)):
         if name_specs_index < len(name_specs)-1 and \
            name_specs[name_specs_index+1][0] == i:
             start_i = i
@@ -1303,7 +1044,7 @@ def simple_intersperse_comments(main, name_specs):
         cns = ns[(i - start_i) % len(ns)]
         assert len(cns) == len(line) - 2 # -2 because of time and IP MD5 columns.
         assert len(cns) >= 5
-        newr.append([u"# ...First 7... " + u" -- ".join([("[%i] %s" % (i+8,s)) for i,s in itertools.izip(itertools.count(0), cns[5:])])])
+        newr.append([u"# ...First 7... " + u" -- ".join([("[%i] %s" % (i+8,s)) for i,s in zip(itertools.count(0), cns[5:])])])
         newr.append(line)
     return newr
 
@@ -1316,536 +1057,1139 @@ def get_comment_intersperser():
 def to_csv(lines):
     s = StringIO()
     for l in lines:
-        s.write(u','.join(map(unicode, l)))
+        s.write(u','.join(map(str, l)))
         s.write(u'\n')
     return s.getvalue()
 
+#
+# Results are written by one thread per process, which commits submissions
+# in groups: everything that queued up while the previous group was being
+# written (plus anything arriving within RESULTS_COMMIT_WINDOW) is appended
+# to each file with a single write and fsync, and counted with a single
+# counter update. A results POST is only answered once its group is on disk.
+# The files are still flocked for each group, so several processes (CGI, a
+# pre-fork server) can write safely.
+#
+
+RESULTS_COMMIT_WINDOW = 0       # Seconds. Worth raising a little on disks with slow fsyncs.
+RESULTS_MAX_GROUP = 256         # Submissions.
+
+class Submission(object):
+    __slots__ = ('raw', 'results', 'update_counter', 'done', 'error')
+    def __init__(self, raw, results, update_counter):
+        self.raw = raw
+        self.results = results
+        self.update_counter = update_counter
+        self.done = threading.Event()
+        self.error = None
+
+def append_durably(filename, data):
+    f = lock_and_open(filename, "ab")
+    try:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        unlock_and_close(f)
+
+class ResultsWriter(object):
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def submit(self, raw, results=b'', update_counter=False):
+        """Queue a submission (raw POST data and CSV lines, as bytes) and
+        wait until it has been written. Raises IOError if the results (as
+        opposed to the raw data) couldn't be written."""
+        self.ensure_started()
+        s = Submission(raw, results, update_counter)
+        self.queue.put(s)
+        s.done.wait()
+        if s.error:
+            raise s.error
+
+    def ensure_started(self):
+        # The thread is started by the first submission rather than on import
+        # or in create_app, so that it exists in the process that serves the
+        # request even if the module was loaded before a fork.
+        if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+                self.queue = queue.Queue()
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run, name="results-writer", daemon=True)
+                self.thread.start()
+
+    def next_group(self):
+        group = [self.queue.get()]
+        deadline = time_module.monotonic() + RESULTS_COMMIT_WINDOW
+        while len(group) < RESULTS_MAX_GROUP:
+            timeout = deadline - time_module.monotonic()
+            try:
+                if timeout > 0:
+                    group.append(self.queue.get(timeout=timeout))
+                else:
+                    group.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return group
+
+    def run(self):
+        while True:
+            group = self.next_group()
+            error = None
+            try:
+                self.commit(group)
+            except Exception as e:
+                logger.error("Error writing results: %s" % str(e))
+                error = IOError(str(e))
+            for s in group:
+                s.error = error
+                s.done.set()
+
+    def commit(self, group):
+        results_dir = os.path.join(PWD, CFG['RESULT_FILES_DIR'])
+        try:
+            append_durably(os.path.join(results_dir, CFG['RAW_RESULT_FILE_NAME']), b''.join(s.raw for s in group))
+        except IOError as e:
+            # As ever, a failure to back up the raw data isn't fatal.
+            logger.error("Error writing raw results: %s" % str(e))
+
+        results = b''.join(s.results for s in group)
+        if results:
+            append_durably(os.path.join(results_dir, CFG['RESULT_FILE_NAME']), results)
+
+        # Everything went OK with recording the results, so update the counter.
+        # (The results are safe by now, so a failure here, which has already
+        # been logged, doesn't fail the submissions.)
+        n = sum(1 for s in group if s.update_counter)
+        if n:
+            try:
+                update_counter(lambda x: x + n)
+            except IOError:
+                pass
+
+results_writer = ResultsWriter()
+
 
 #
 # The server itself.
 #
 
-def create_monster_string(dir, extension, block_allow, cacheKey=None, manipulator=None):
-    if cacheKey and os.path.isfile(os.path.join(PWD, CFG['CACHE_DIR'], cacheKey)):
-        cacheCreatedTime = os.path.getmtime(os.path.join(PWD, CFG['CACHE_DIR'], cacheKey))
+# Seconds between checks of an include directory for changes. In between,
+# a bundle is served straight from memory without touching the filesystem.
+INCLUDE_CHECK_INTERVAL = 2.0
+
+def include_sources(dir, extension, block_allow):
+    """[(path, size, mtime_ns)] of the files a bundle is built from, in order.
+    (extension may also be a tuple of extensions.)"""
+    sources = []
+    try:
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                if not (entry.name.endswith(extension) and entry.is_file()):
+                    continue
+                if (block_allow[0] == "block" and entry.name not in block_allow[1:]) or \
+                   (block_allow[0] == "allow" and entry.name in block_allow[1:]):
+                    st = entry.stat()
+                    sources.append((entry.path, st.st_size, st.st_mtime_ns))
+    except OSError:
+        logger.error("Error getting directory listing for include directory '%s'" % dir)
+        raise
+    sources.sort()
+    return sources
+
+def include_fingerprint(sources):
+    """Hash of a bundle's source files (names, sizes and mtimes) and of the
+    config that affects how it is built."""
+    return hashlib.sha1(repr((sources, CFG['MINIFY_JS'])).encode(DEFAULT_ENCODING)).hexdigest()
+
+def create_monster_string(sources, fingerprint, cacheKey=None, manipulator=None):
+    """Concatenate the given include files.
+
+    With a cacheKey, the result is also kept in CACHE_DIR, tagged with the
+    fingerprint of its sources, so that a fresh process (a CGI request, a
+    newly started worker) can reuse it.
+    """
+    cache_path = cacheKey and os.path.join(PWD, CFG['CACHE_DIR'], cacheKey)
+    if cacheKey:
         try:
-            ds = os.listdir(dir)
-            canUseCache = True
-            for path in ds:
-                if os.path.getmtime(os.path.join(dir, path)) >= cacheCreatedTime:
-                    canUseCache = False
-                    break
-            if canUseCache:
-                f = open(os.path.join(PWD, CFG['CACHE_DIR'], cacheKey))
-                return f.read()
-        except IOError:
+            with open(cache_path, encoding=DEFAULT_ENCODING) as f:
+                if f.readline().rstrip('\n') == fingerprint:
+                    return f.read()
+        except (IOError, ValueError):
             # Just ignore the error -- it just means we won't use the cache this time.
             pass
 
     # We can't use the cache, so go ahead and create the string...
 
-    filenames = []
-    try:
-        ds = os.listdir(dir)
-        ds.sort()
-        for path in ds:
-            fullpath = os.path.join(dir, path)
-            if os.path.isfile(fullpath) and path.endswith(extension):
-                if block_allow[0] == "block" and path not in block_allow[1:]:
-                    filenames.append(fullpath)
-                elif block_allow[0] == "allow" and path in block_allow[1:]:
-                    filenames.append(fullpath)
-    except IOError:
-        logger.error("Error getting directory listing for Javascript include directory '%s'" % dir)
-        sys.exit(1)
-
     s = StringIO()
-    f = None
     try:
-        try:
-            for fn in filenames:
-                f = open(fn)
-                if not manipulator:
-                    s.write(f.read())
-                else:
-                    content = f.read()
-                    newcontent = manipulator(os.path.split(fn)[1], content, s)
-                s.write('\n\n')
-                f.close()
-        except Exception, e:
-            logger.error("Error reading Javascript files in '%s'" % dir)
-            sys.exit(1)
-    finally:
-        if f: f.close()
+        for fn, _, _ in sources:
+            with open(fn, encoding=DEFAULT_ENCODING) as f:
+                content = f.read()
+            if not manipulator:
+                s.write(content)
+            else:
+                manipulator(os.path.split(fn)[1], content, s)
+            s.write('\n\n')
+    except (IOError, ValueError):
+        logger.error("Error reading include file '%s'" % fn)
+        raise
 
     val = s.getvalue()
 
     # If a cache key was given, create a cache of the result before returning it.
+    # (Written to a temporary file first so other processes never see half of it.)
     if cacheKey:
-        f = None
+        tmp_path = "%s.%d.%d.tmp" % (cache_path, os.getpid(), threading.get_ident())
         try:
-            try:
-                f = open(os.path.join(PWD, CFG['CACHE_DIR'], cacheKey), 'w')
+            with open(tmp_path, 'w', encoding=DEFAULT_ENCODING) as f:
+                f.write(fingerprint + '\n')
                 f.write(val)
-            except IOError:
-                # Ignore errors -- it just means that a cache won't be created.
-                pass
-        finally:
-            if f: f.close()
+            os.replace(tmp_path, cache_path)
+        except IOError:
+            # Ignore errors -- it just means that a cache won't be created.
+            pass
 
     return val
 
-def js_create_monster_string(dir, extension, block_allow, cacheKey=None):
-    def manipulator(filename, content, ofile):
-        if CFG['MINIFY_JS']:
-            ofile.write(jsmin(content))
-        else:
-            ofile.write(content)
-    return create_monster_string(dir, extension, block_allow, cacheKey, manipulator)
+def js_manipulator(filename, content, ofile):
+    if CFG['MINIFY_JS']:
+        ofile.write(jsmin(content))
+    else:
+        ofile.write(content)
+
+def css_manipulator(filename, content, ofile):
+    if filename.startswith("global_"):
+        ofile.write(content)
+    else:
+        parsed = css_parse(content)
+        name = filename.split('.')[0] + '-'
+        css_add_namespace(parsed, name)
+        css_spit_out(parsed, ofile)
+
+# ?include=<name> -> (directory conf variable, extension, block/allow conf variable,
+#                     manipulator, Content-Type)
+BUNDLES = {
+    'js'   : ('JS_INCLUDES_DIR', '.js', 'JS_INCLUDES_LIST', js_manipulator, 'application/x-javascript; charset=UTF-8'),
+    'css'  : ('CSS_INCLUDES_DIR', '.css', 'CSS_INCLUDES_LIST', css_manipulator, 'text/css; charset=UTF-8'),
+    'data' : ('DATA_INCLUDES_DIR', '.js', 'DATA_INCLUDES_LIST', js_manipulator, 'application/x-javascript; charset=UTF-8'),
+}
+
+# Extensions of the chunk files sent by ?allchunks. Anything else in
+# CHUNK_INCLUDES_DIR (images, audio, archives) is only served by ?resource=.
+CHUNK_EXTENSIONS = ('.html', '.htm', '.txt', '.csv', '.tsv', '.json', '.xml', '.svg', '.md')
+
+# name -> {'body': list of byte strings, 'fingerprint': ..., 'version': content hash,
+#          'etag': ..., 'variants': see compressed_variants(), 'content_type': ...,
+#          'checked': monotonic time of last check}
+bundle_cache = { }
+bundle_locks = dict((name, threading.Lock()) for name in list(BUNDLES) + ['allchunks'])
 
-def css_create_monster_string(dir, extension, block_allow, cacheKey=None):
-    def manipulator (filename, content, ofile):
-        if filename.startswith("global_"):
-            ofile.write(content)
+def cached_entry(name, scan, build):
+    """The cache entry for name. scan() lists its sources, and build(sources,
+    fingerprint) makes a new entry when their fingerprint has changed.
+
+    Within INCLUDE_CHECK_INTERVAL of the last check this is a dictionary
+    lookup. After that, one thread rescans (and rebuilds only if the
+    fingerprint changed) while other threads carry on serving the entry
+    they already have.
+    """
+    entry = bundle_cache.get(name)
+    if entry and time_module.monotonic() - entry['checked'] < INCLUDE_CHECK_INTERVAL:
+        return entry
+
+    lock = bundle_locks[name]
+    if not lock.acquire(blocking=entry is None):
+        return entry
+    try:
+        entry = bundle_cache.get(name)
+        if entry and time_module.monotonic() - entry['checked'] < INCLUDE_CHECK_INTERVAL:
+            return entry
+
+        sources = scan()
+        fingerprint = include_fingerprint(sources)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            entry = build(sources, fingerprint)
+            entry['fingerprint'] = fingerprint
         else:
-            parsed = css_parse(content)
-            name = filename.split('.')[0] + '-'
-            css_add_namespace(parsed, name)
-            css_spit_out(parsed, ofile)
-    return create_monster_string(dir, extension, block_allow, cacheKey, manipulator)
+            entry = dict(entry)
+        entry['checked'] = time_module.monotonic()
+        # Replaced rather than updated in place, so readers never see a mix.
+        bundle_cache[name] = entry
+        return entry
+    finally:
+        lock.release()
+
+def content_entry(chunks, content_type):
+    """A cache entry for a body given as a list of byte strings."""
+    h = hashlib.sha1()
+    for chunk in chunks:
+        h.update(chunk)
+    # The version is a hash of the content, so every worker process
+    # agrees on it however the body was built.
+    version = h.hexdigest()[:16]
+    return {
+        'body': chunks,
+        'content_type': content_type,
+        'version': version,
+        'etag': '"%s"' % version,
+        'variants': compressed_variants(chunks, '"%s"' % version),
+    }
+
+def get_bundle(name):
+    """The cache entry for an include bundle (see cached_entry())."""
+    dir_key, extension, list_key, manipulator, content_type = BUNDLES[name]
+    def scan():
+        return include_sources(os.path.join(PWD, CFG[dir_key]), extension, CFG[list_key])
+    def build(sources, fingerprint):
+        m = create_monster_string(sources, fingerprint, name + "_includes", manipulator)
+        return content_entry([m.encode(DEFAULT_ENCODING)], content_type)
+    return cached_entry(name, scan, build)
+
+def encode_allchunks(sources):
+    """The ?allchunks JSON object, encoded one file at a time into a list of byte strings."""
+    chunks = []
+    for path, _, _ in sources:
+        try:
+            with open(path, encoding=DEFAULT_ENCODING) as f:
+                content = f.read()
+        except ValueError:
+            logger.warning("Chunk file '%s' is not valid %s, so it was left out of allchunks" % (path, DEFAULT_ENCODING))
+            continue
+        chunks.append((u"%s%s:%s" % (chunks and u"," or u"{", json.dumps(os.path.basename(path)),
+                                     json.dumps(content))).encode(DEFAULT_ENCODING))
+    chunks.append(chunks and b"}" or b"{}")
+    return chunks
+
+def get_allchunks():
+    """The cache entry for the ?allchunks payload (see cached_entry())."""
+    def scan():
+        return include_sources(os.path.join(PWD, CFG['CHUNK_INCLUDES_DIR']), CHUNK_EXTENSIONS, ["block"])
+    def build(sources, fingerprint):
+        return content_entry(encode_allchunks(sources), 'text/plain; charset=UTF-8') # Still trying to support IE 6 LOL
+    return cached_entry('allchunks', scan, build)
+
+def make_dir(key, description):
+    path = os.path.join(PWD, CFG[key])
+    if os.path.isfile(path):
+        raise ConfigError("'%s' is a file, so could not create %s" % (CFG[key], description))
+    try:
+        if not os.path.isdir(path):
+            os.mkdir(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST: # Another worker may have just created it.
+            raise ConfigError("Could not create %s at %s" % (description, path))
+
+def init_directories():
+    # Create a directory for storing results (if it doesn't already exist).
+    make_dir('RESULT_FILES_DIR', "results directory")
+
+    # Create a directory for storing the server state
+    # (if it doesn't already exist), and initialize the counter.
+    make_dir('SERVER_STATE_DIR', "server state directory")
+    try:
+        # Initialize the counter, if there isn't one already. ("x" so that
+        # two workers starting at once can't both write it.)
+        with open(os.path.join(PWD, CFG['SERVER_STATE_DIR'], 'counter'), "x") as f:
+            f.write("0")
+    except FileExistsError:
+        pass
+    except IOError:
+        raise ConfigError("Could not create server state directory at %s" % os.path.join(PWD, CFG['SERVER_STATE_DIR']))
+    try:
+        counter.open(os.path.join(PWD, CFG['SERVER_STATE_DIR']))
+    except (IOError, ValueError) as e:
+        raise ConfigError("Could not read the counter in server state: %s" % str(e))
 
-# Create a directory for storing results (if it doesn't already exist).
-try:
-    # Create the directory.
-    if os.path.isfile(os.path.join(PWD, CFG['RESULT_FILES_DIR'])):
-        logger.error("'%s' is a file, so could not create results directory" % CFG['RESULT_FILES_DIR'])
-        sys.exit(1)
-    elif not os.path.isdir(os.path.join(PWD, CFG['RESULT_FILES_DIR'])):
-        os.mkdir(os.path.join(PWD, CFG['RESULT_FILES_DIR']))
-except os.error, IOError:
-    logger.error("Could not create results directory at %s" % os.path.join(PWD, CFG['RESULT_FILES_DIR']))
-    sys.exit(1)
-
-# Create a directory for storing the server state
-# (if it doesn't already exist), and initialize the counter.
-try:
-    # Create the directory.
-    if os.path.isfile(os.path.join(PWD, CFG['SERVER_STATE_DIR'])):
-        logger.error("'%s' is a file, so could not create server state directory" % CFG['SERVER_STATE_DIR'])
-        sys.exit(1)
-    elif not os.path.isdir(os.path.join(PWD, CFG['SERVER_STATE_DIR'])):
-        os.mkdir(os.path.join(PWD, CFG['SERVER_STATE_DIR']))
+    # Create a cache directory (if it doesn't already exist).
+    make_dir('CACHE_DIR', "cache directory")
 
-    # Initialize the counter, if there isn't one already.
-    if not os.path.isfile(os.path.join(PWD, CFG['SERVER_STATE_DIR'], 'counter')):
-        f = open(os.path.join(PWD, CFG['SERVER_STATE_DIR'], 'counter'), "w")
-        f.write("0")
-        f.close()
-except os.error, IOError:
-    logger.error("Could not create server state directory at %s" % os.path.join(PWD, CFG['SERVER_STATE_DIR']))
-    sys.exit(1)
+def bundle_versions():
+    """{name: version} of the current include bundles, for generate_html()."""
+    return dict((name, get_bundle(name)['version']) for name in BUNDLES)
 
-# Create a cache directory (if it doesn't already exist).
-mjs = None # To get this in the scope of finally.
-try:
+def create_app(overrides=None, reset_log=False):
+    """Load the configuration, set up logging and the state directories, and
+    return the WSGI application.
+
+    Everything that used to happen when this module was imported happens
+    here instead, once per process. Raises ConfigError if the configuration
+    is unusable.
+    """
+    global CFG, PWD
+    cfg = load_config(overrides)
+    PWD = working_dir(cfg)
+    CFG = cfg
+    setup_logging(reset_log)
+    init_directories()
+    bundle_cache.clear()
+    static_cache.clear()
+    return control
+
+_app = None
+_app_lock = threading.Lock()
+
+def application(env, start_response):
+    """WSGI entry point (e.g. 'gunicorn server:application').
+
+    The app is created on the first request a process handles rather than
+    at import, so a pre-fork server that imports this module in its master
+    process doesn't share any open files between its workers.
+    """
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+    return _app(env, start_response)
+
+# Files under STATIC_FILES_DIR that are served as they are.
+STATIC_FILES = [
+    'experiment.html',
+    'overview.html',
+    'json.js',
+    'conf.js',
+    'shuffle.js',
+    'util.js',
+    'backcompatcruft.js',
+    'jquery.min.js',
+    'jquery-ui.min.js',
+    'PluginDetect.js',
+    'jsDump.js',
+    'soundmanager2-jsmin.js',
+    'soundmanager2_debug.swf'
+]
+STATIC_CONTENT_TYPES = {
+    ''      : "application/octet-stream",
+    ".html" : "text/html; charset=UTF-8",
+    ".css"  : "text/css",
+    ".js"   : "application/x-javascript",
+    ".swf"  : "application/x-shockwave-flash"
+}
+
+# Cache-Control for versioned include URLs: the content at such a URL never changes.
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Bodies smaller than this aren't worth compressing.
+COMPRESS_MIN_SIZE = 1024
+COMPRESSIBLE_TYPES = ('text/', 'application/x-javascript')
+
+def compressed_variants(chunks, etag):
+    """{coding: (compressed body, etag)} for each coding that makes the body
+    (a list of byte strings) smaller.
+
+    Called once per version of a bundle or static file, never per request.
+    The gzip header has no timestamp, so every worker produces the same bytes.
+    """
+    variants = { }
+    size = sum(len(chunk) for chunk in chunks)
+    if size < COMPRESS_MIN_SIZE:
+        return variants
+    codings = [('gzip', zlib.compressobj(9, zlib.DEFLATED, 31), 'compress', 'flush')]
+    if brotli:
+        codings.append(('br', brotli.Compressor(quality=11), 'process', 'finish'))
+    for coding, compressor, feed, finish in codings:
+        data = b''.join([getattr(compressor, feed)(chunk) for chunk in chunks] + [getattr(compressor, finish)()])
+        if len(data) < size:
+            variants[coding] = (data, '%s-%s"' % (etag[:-1], coding))
+    return variants
+
+def choose_encoding(env, variants):
+    """The best coding in variants that the request's Accept-Encoding allows, or None."""
+    accepted = { }
+    for part in env.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = part.partition(';')
+        q = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    for coding in ('br', 'gzip'):
+        if coding in variants and accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+def error_page(start_response, status):
+    start_response(status, [('Content-Type', 'text/html; charset=UTF-8')])
+    return [("<html><body><h1>%s</h1></body></html>" % status).encode(DEFAULT_ENCODING)]
+
+def etag_matches(env, etag):
+    """Does the request's If-None-Match header cover etag? (Weak comparison.)"""
+    header = env.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(',')]
+    return '*' in tags or etag in tags or ('W/' + etag) in tags
+
+def send_cacheable(env, start_response, body, content_type, etag, cache_control='no-cache', variants=None):
+    """Respond with body (or its best precompressed variant the client
+    accepts), or with a bodiless 304 if the client already has that."""
+    headers = [('Cache-Control', cache_control)]
+    encoding = None
+    if variants:
+        headers.append(('Vary', 'Accept-Encoding'))
+        encoding = choose_encoding(env, variants)
+        if encoding:
+            body, etag = variants[encoding]
+    headers.insert(0, ('ETag', etag))
+    if etag_matches(env, etag):
+        start_response('304 Not Modified', headers)
+        return []
+    if encoding:
+        headers.append(('Content-Encoding', encoding))
+    chunks = isinstance(body, list) and body or [body]
+    start_response('200 OK', [('Content-Type', content_type), ('Content-Length', str(sum(len(c) for c in chunks)))] + headers)
+    return chunks
+
+# filename -> {'etag': ..., 'body': ..., 'variants': ...}, rebuilt when the file changes.
+static_cache = { }
+
+def serve_static(env, filename, start_response):
+    path = os.path.join(PWD, CFG['STATIC_FILES_DIR'], filename)
     try:
-        if os.path.isfile(os.path.join(PWD, CFG['CACHE_DIR'])):
-            logger.error("'%s' is a file, so could not create cache directory" % CFG['CACHE_DIR'])
-            sys.exit(1)
-        elif not os.path.isdir(os.path.join(PWD, CFG['CACHE_DIR'])):
-            os.mkdir(os.path.join(PWD, CFG['CACHE_DIR']))
-
-        # We need to be careful to clear out the cache if the value of the MINIFY_JS config
-        # variable has changed. Note that the lack of file locking here isn't too much of
-        # a problem -- if the file is read when it's in an inconsistent state, all that will
-        # happen is that the cache will be reset.
-        if not os.path.isfile(os.path.join(PWD, CFG['CACHE_DIR'], 'MINIFY_JS')):
-            mjs = open(os.path.join(PWD, CFG['CACHE_DIR'], 'MINIFY_JS'), 'w')
-            mjs.write(str(CFG['MINIFY_JS']) + '\r\n')
+        st = os.stat(path)
+        etag = '"%x-%x"' % (st.st_mtime_ns, st.st_size)
+        content_type = STATIC_CONTENT_TYPES.get(os.path.splitext(filename)[1], STATIC_CONTENT_TYPES[''])
+        entry = static_cache.get(filename)
+        if entry is None or entry['etag'] != etag:
+            with open(path, 'rb') as f:
+                body = f.read()
+            variants = content_type.startswith(COMPRESSIBLE_TYPES) and compressed_variants([body], etag) or { }
+            entry = {'etag': etag, 'body': body, 'variants': variants}
+            static_cache[filename] = entry
+    except IOError:
+        return error_page(start_response, '404 Not Found')
+    return send_cacheable(env, start_response, entry['body'], content_type, etag, variants=entry['variants'])
+
+def serve_page(env, start_response, setcounter=None, overview=False):
+    """experiment.html/overview.html, with the current bundle versions in the include URLs."""
+    try:
+        versions = bundle_versions()
+    except (IOError, ValueError):
+        return error_page(start_response, '500 Internal Server Error')
+    body = generate_html(setcounter=setcounter, overview=overview, versions=versions).encode(DEFAULT_ENCODING)
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+    return send_cacheable(env, start_response, body, 'text/html; charset=UTF-8', etag)
+
+# Block size for sending resources when the server has no wsgi.file_wrapper.
+RESOURCE_BLOCK_SIZE = 256 * 1024
+# More ranges than this in one request get the whole file instead.
+MAX_RANGES = 16
+
+def parse_ranges(header, size):
+    """The (start, end) byte ranges (inclusive, sorted, merged) of a Range
+    header for a file of the given size. [] if none is satisfiable; None if
+    the header should be ignored (malformed, not bytes, too many ranges)."""
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for part in spec.split(','):
+        first, sep, last = part.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+            else:
+                start, end = max(0, size - int(last)), size - 1
+        except ValueError:
+            return None
+        if start < size and end >= start:
+            ranges.append((start, min(end, size - 1)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
         else:
-            mjs = open(os.path.join(PWD, CFG['CACHE_DIR'], 'MINIFY_JS'), 'r+')
-            contents = mjs.read()
-            if contents != str(CFG['MINIFY_JS']):
-                mjs.truncate(0)
-                mjs.seek(0)
-                mjs.write(str(CFG['MINIFY_JS']) + '\r\n')
-
-                # Clean out the cache. We do this because changes to the server configuration
-                # since the last time the server was run may have implications for what should
-                # be stored in the cache (e.g. if JS minification has been turned on/off).
-                fs = os.listdir(os.path.join(PWD, CFG['CACHE_DIR']))
-                for fname in fs:
-                    if fname != 'MINIFY_JS' and os.path.isfile(os.path.join(PWD, CFG['CACHE_DIR'], fname)):
-                        os.remove(os.path.join(PWD, CFG['CACHE_DIR'], fname))
-    except os.error, IOError:
-        logger.error("Could not create cache directory at %s" % os.path.join(PWD, CFG['CACHE_DIR']))
-finally:
-    if mjs: mjs.close()
+            merged.append((start, end))
+    return merged
+
+def file_parts(f, parts):
+    """Yield the bytes of f for each (prefix, start, end) in parts, each
+    preceded by prefix, in blocks of at most RESOURCE_BLOCK_SIZE."""
+    try:
+        for prefix, start, end in parts:
+            if prefix:
+                yield prefix
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                block = f.read(min(remaining, RESOURCE_BLOCK_SIZE))
+                if not block:
+                    return
+                remaining -= len(block)
+                yield block
+    finally:
+        f.close()
+
+def serve_resource(env, start_response, name):
+    """A file from CHUNK_INCLUDES_DIR, with conditional GET and Range support."""
+    base = os.path.normpath(os.path.join(PWD, CFG['CHUNK_INCLUDES_DIR']))
+    path = os.path.normpath(os.path.join(base, name))
+    if not path.startswith(base + os.sep): # e.g. '../server_conf.py'
+        return error_page(start_response, '404 Not Found')
+    try:
+        f = open(path, 'rb')
+        st = os.fstat(f.fileno())
+    except IOError:
+        return error_page(start_response, '404 Not Found')
+
+    size = st.st_size
+    etag = '"%x-%x"' % (st.st_mtime_ns, size)
+    last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    headers = [('ETag', etag), ('Last-Modified', last_modified), ('Cache-Control', 'no-cache'),
+               ('Accept-Ranges', 'bytes')]
+
+    not_modified = etag_matches(env, etag)
+    if 'HTTP_IF_NONE_MATCH' not in env and env.get('HTTP_IF_MODIFIED_SINCE'):
+        try:
+            not_modified = int(st.st_mtime) <= email.utils.parsedate_to_datetime(env['HTTP_IF_MODIFIED_SINCE']).timestamp()
+        except (TypeError, ValueError):
+            pass
+    if not_modified:
+        f.close()
+        start_response('304 Not Modified', headers)
+        return []
+
+    ranges = None
+    if env.get('HTTP_RANGE') and env.get('HTTP_IF_RANGE', etag) in (etag, last_modified):
+        ranges = parse_ranges(env['HTTP_RANGE'], size)
+
+    if ranges == []:
+        f.close()
+        start_response('416 Range Not Satisfiable', [('Content-Range', 'bytes */%i' % size), ('Content-Length', '0')] + headers)
+        return []
+
+    if ranges is None:
+        start_response('200 OK', [('Content-Type', content_type), ('Content-Length', str(size))] + headers)
+        if env.get('REQUEST_METHOD') == 'HEAD':
+            f.close()
+            return []
+        if 'wsgi.file_wrapper' in env:
+            # Lets the server use sendfile() where it can.
+            return env['wsgi.file_wrapper'](f, RESOURCE_BLOCK_SIZE)
+        return file_parts(f, [(b'', 0, size - 1)])
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        parts = [(b'', start, end)]
+        start_response('206 Partial Content', [('Content-Type', content_type),
+                                               ('Content-Range', 'bytes %i-%i/%i' % (start, end, size)),
+                                               ('Content-Length', str(end - start + 1))] + headers)
+    else:
+        boundary = uuid.uuid4().hex
+        parts = []
+        for i, (start, end) in enumerate(ranges):
+            prefix = "%s--%s\r\nContent-Type: %s\r\nContent-Range: bytes %i-%i/%i\r\n\r\n" % \
+                (i and "\r\n" or "", boundary, content_type, start, end, size)
+            parts.append((prefix.encode('latin-1'), start, end))
+        parts.append(((u"\r\n--%s--\r\n" % boundary).encode('latin-1'), 0, -1))
+        length = sum(len(prefix) + end - start + 1 for prefix, start, end in parts)
+        start_response('206 Partial Content', [('Content-Type', 'multipart/byteranges; boundary=%s' % boundary),
+                                               ('Content-Length', str(length))] + headers)
+    if env.get('REQUEST_METHOD') == 'HEAD':
+        f.close()
+        return []
+    return file_parts(f, parts)
 
 def control(env, start_response):
     # Save the time the results were received.
     thetime = time_module.time()
 
-    ip = None
-    if env.has_key('HTTP_X_FORWARDED_FOR'):
-        ip = env['HTTP_X_FORWARDED_FOR']
-    else:
-        ip = env['REMOTE_ADDR']
+    ip = env.get('HTTP_X_FORWARDED_FOR') or env.get('REMOTE_ADDR', '')
 
     user_agent = "Unknown user agent"
-    if env.has_key('USER_AGENT'):
+    if 'USER_AGENT' in env:
         user_agent = env['USER_AGENT']
-    elif env.has_key('HTTP_USER_AGENT'):
+    elif 'HTTP_USER_AGENT' in env:
         user_agent = env['HTTP_USER_AGENT']
 
-    base = None
-    if env.has_key('REQUEST_URI'):
-        base = env['REQUEST_URI']
-    else:
-        base = env['PATH_INFO']
+    base = env.get('REQUEST_URI') or (env.get('SCRIPT_NAME', '') + env.get('PATH_INFO', ''))
     # Sometimes the query string likes to stick around.
     base = base.split('?')[0]
 
-    if not base:
+    components = [x for x in base.split('/') if x]
+    if not components:
         # Redirect to experiment.html by default.
         start_response('302 Found', [('Location', '/experiment.html')])
         return []
 
-    last = filter(lambda x: x != [], base.split('/'))[-1];
-
-    if last == PY_SCRIPT_NAME:
-        qs = env.has_key('QUERY_STRING') and env['QUERY_STRING'].lstrip('?') or ''
-        qs_hash = cgi.parse_qs(qs)
-
-        # Is it a request for a JS/CSS include file?
-        if qs_hash.has_key('include'):
-            if qs_hash['include'][0] == 'serverinfo_js':
-                start_response('200 OK', [('Content-Type', 'application/x-javascript; charset=UTF-8')])
-                # Can't use a generator expression here because we need to maintain Python 2.3 compat.
-                return ["var __server_py_script_name__ = \"%s\";\n" % ''.join(["\\u%.4x" % ord(c) for c in PY_SCRIPT_NAME])]
-            elif qs_hash['include'][0] == 'js':
-                m = js_create_monster_string(os.path.join(PWD, CFG['JS_INCLUDES_DIR']), '.js', CFG['JS_INCLUDES_LIST'], "js_includes")
-                start_response('200 OK', [('Content-Type', 'application/x-javascript; charset=UTF-8'), ('Pragma', 'no-cache')])
-                return [m]
-            elif qs_hash['include'][0] == 'css':
-                sys.stderr.write(os.path.join(PWD, CFG['CSS_INCLUDES_DIR']))
-                m = css_create_monster_string(os.path.join(PWD, CFG['CSS_INCLUDES_DIR']), '.css', CFG['CSS_INCLUDES_LIST'], "css_includes")
-                start_response('200 OK', [('Content-Type', 'text/css; charset=UTF-8'), ('Pragma', 'no-cache')])
-                return [m]
-            elif qs_hash['include'][0] == 'data':
-                m = js_create_monster_string(os.path.join(PWD, CFG['DATA_INCLUDES_DIR']), '.js', CFG['DATA_INCLUDES_LIST'], "data_includes")
-                start_response('200 OK', [('Content-Type', 'application/x-javascript; charset=UTF-8'), ('Pragma', 'no-cache')])
-                return [m]
-            elif qs_hash['include'][0] == 'main.js':
-                contents = None
-                f = None
-                try:
-                    try:
-                        f = open(os.path.join(PWD, CFG['OTHER_INCLUDES_DIR'], 'main.js'))
-                        contents = f.read()
-                    except IOError:
-                        start_response('500 Internal Server Error', [('Content-Type', 'text/html; charset=UTF-8')])
-                        return ["<html><body><h1>500 Internal Server Error</h1></body></html>"]
-                finally:
-                    if f: f.close()
+    last = components[-1]
 
-                # UGLY: Holds some var defs that we'll prepend to the main.js.
-                defs = []
+    if last in STATIC_FILES and env.get('REQUEST_METHOD', 'GET') in ('GET', 'HEAD'):
+        if last in ('experiment.html', 'overview.html'):
+            return serve_page(env, start_response, overview=(last == 'overview.html'))
+        return serve_static(env, last, start_response)
 
-                # Do we set the 'overview' option?
-                retlist = [contents]
-                if qs_hash.has_key('overview') and qs_hash['overview'][0].upper() == "YES":
-                    defs.append("var conf_showOverview = true;\n")
+    if last != PY_SCRIPT_NAME:
+        return error_page(start_response, '404 Not Found')
 
-                # Set the value of the counter (either saved, or provided as part of the URL).
-                counter_value = None
-                try:
-                    counter_value = (qs_hash.has_key('withsquare') and (int(qs_hash['withsquare'][0]),) or (get_counter(),))[0]
-                except ValueError:
-                    start_response('400 Bad Request', [('Content-Type', 'text/html; charset=UTF-8')])
-                    return ["<html><body><h1>400 Bad Request</h1></body></html>"]
-                defs.append("var __counter_value_from_server__ = %i;\n" % counter_value)
-
-                retlist = defs + retlist
-                start_response('200 OK', [('Content-Type', 'application/x-javascript; charset=UTF-8')])
-                return retlist
-
-        # Is it a request for a JSON dict of all chunks? This should maybe be cached at some point.
-        if qs_hash.has_key('allchunks'):
-            jsondict = { }
-            f = None
+    qs = env.get('QUERY_STRING', '').lstrip('?')
+    qs_hash = urllib.parse.parse_qs(qs)
+
+    # Is it a request for a JS/CSS include file?
+    if 'include' in qs_hash:
+        if qs_hash['include'][0] == 'serverinfo_js':
+            start_response('200 OK', [('Content-Type', 'application/x-javascript; charset=UTF-8')])
+            return [("var __server_py_script_name__ = \"%s\";\n" % ''.join(["\\u%.4x" % ord(c) for c in PY_SCRIPT_NAME])).encode(DEFAULT_ENCODING)]
+        elif qs_hash['include'][0] in BUNDLES:
             try:
-                for fname in os.listdir(os.path.join(PWD, CFG['CHUNK_INCLUDES_DIR'])):
-                    if fname.endswith(".wav") or fname.endswith(".mp3") or fname.endswith("m4a"):
-                        continue
-                    f = None
-                    try:
-                        try:
-                            f = open(os.path.join(PWD, CFG['CHUNK_INCLUDES_DIR'], fname))
-                            jsondict[fname] = f.read()
-                        except IOError, e:
-                            if e.errno == errno.EISDIR:
-                                pass
-                            else:
-                                start_response('500 Internal Server Error', [('Content-Type', 'text/html; charset=UTF-8')])
-                                return ["<html><body><h1>500 Internal Server Error</h1></body></html>"]
-                    finally:
-                        if f: f.close()
-            except IOError, e:
-                start_response('500 Internal Server Error', [('Content-Type', 'text/html; charset=UTF-8')])
-                return ["<html><body><h1>500 Internal Server Error</h1></body></html>"]
-
-            start_response('200 OK', [('Content-Type', 'text/plain; charset=UTF-8')]) # Still trying to support IE 6 LOL
-            return [dict_to_json(jsondict)]
-
-        # or a resource?
-        if qs_hash.has_key('resource'):
-            f = None
+                bundle = get_bundle(qs_hash['include'][0])
+            except (IOError, ValueError):
+                return error_page(start_response, '500 Internal Server Error')
+            # Only a URL carrying the current version may be cached for good; a
+            # stale page asking for an old version gets the current bundle, revalidated.
+            cache_control = qs_hash.get('v', [None])[0] == bundle['version'] and IMMUTABLE or 'no-cache'
+            return send_cacheable(env, start_response, bundle['body'], bundle['content_type'],
+                                  bundle['etag'], cache_control, bundle['variants'])
+        elif qs_hash['include'][0] == 'main.js':
             try:
-                p = os.path.join(PWD, CFG['CHUNK_INCLUDES_DIR'], qs_hash['resource'][0])
-                stats = os.stat(p)
-                # Don't allow files bigger than 10MB to be downloaded.
-                if stats.st_size > 10 * 1024 * 1024:
-                    start_response('500 Internal Server Error' [('Content-Type', 'text/html; charset=UTF-8')])
-                    return ["<html><body><h1>500 Internal Server Error</h1></body></html>"]
-                f = open(p, 'rb')
-                def it():
-                    block = None
-                    while block is None or len(block) > 0:
-                        block = f.read(2048)
-                        if len(block) == 0:
-                            f.close()
-                            raise StopIteration
-                        yield block
-
-                start_response('200 OK', [('Content-Type', 'audio/mpeg'), ('Content-Length', stats.st_size)])
-                return it()
-            except IOError, e:
-                start_response('500 Internal Server Error' [('Content-Type', 'text/html; charset=UTF-8')])
-                return ["<html><body><h1>500 Internal Server Error</h1></body></html>"]
-
-        if qs_hash.has_key('withsquare'):
-            ivalue = None
+                with open(os.path.join(PWD, CFG['OTHER_INCLUDES_DIR'], 'main.js'), encoding=DEFAULT_ENCODING) as f:
+                    contents = f.read()
+            except IOError:
+                return error_page(start_response, '500 Internal Server Error')
+
+            # UGLY: Holds some var defs that we'll prepend to the main.js.
+            defs = []
+
+            # Do we set the 'overview' option?
+            if 'overview' in qs_hash and qs_hash['overview'][0].upper() == "YES":
+                defs.append("var conf_showOverview = true;\n")
+
+            # Set the value of the counter (either saved, or provided as part of the URL).
             try:
-                ivalue = int(qs_hash['withsquare'][0])
+                counter_value = int(qs_hash['withsquare'][0]) if 'withsquare' in qs_hash else get_counter()
             except ValueError:
-                start_response('400 Bad Request', [('Content-Type', 'text/html; charset=UTF-8')])
-                return ["<html><body><h1>400 Bad Request</h1></body></html>"]
+                return error_page(start_response, '400 Bad Request')
+            except IOError:
+                return error_page(start_response, '500 Internal Server Error')
+            defs.append("var __counter_value_from_server__ = %i;\n" % counter_value)
 
-            start_response('200 OK', [('Content-Type', 'text/html; charset=UTF-8')])
-            return [generate_html(setcounter=ivalue, overview=False)]
+            start_response('200 OK', [('Content-Type', 'application/x-javascript; charset=UTF-8')])
+            return [s.encode(DEFAULT_ENCODING) for s in defs + [contents]]
 
-        if qs_hash.has_key('setsquare'):
-            updatef = None
-            setsquare = qs_hash['setsquare'][0]
-            try:
-                if setsquare.startswith('inc-'):
-                    ivalue = int(setsquare[4:])
-                    updatef = lambda x: x + ivalue
-                else:
-                    ivalue = int(setsquare)
-                    updatef = lambda x: ivalue
-            except ValueError, e:
-                start_response('400 Bad Request', [('Content-Type', 'text/html; charset=UTF-8')])
-                return ["<html><body><h1>400 Bad Request</h1></body></html>"]
-            update_counter(updatef)
-            start_response('200 OK', [('Content-Type', 'text/html; charset=UTF-8')])
-            return []
+    # Is it a request for a JSON dict of all chunks?
+    if 'allchunks' in qs_hash:
+        try:
+            chunks = get_allchunks()
+        except IOError:
+            return error_page(start_response, '500 Internal Server Error')
+        return send_cacheable(env, start_response, chunks['body'], chunks['content_type'],
+                              chunks['etag'], variants=chunks['variants'])
+
+    # or a resource?
+    if 'resource' in qs_hash:
+        return serve_resource(env, start_response, qs_hash['resource'][0])
 
-        # (All branches above end with a return from this function.)
+    if 'withsquare' in qs_hash:
+        try:
+            ivalue = int(qs_hash['withsquare'][0])
+        except ValueError:
+            return error_page(start_response, '400 Bad Request')
 
-        # ...if none of the above, it's some results.
-        if not (env['REQUEST_METHOD'] == 'POST' and env.has_key('CONTENT_LENGTH')):
-            start_response('400 Bad Request', [('Content-Type', 'text/html; charset=UTF-8')])
-            return ["<html><body><h1>400 Bad Request</h1></body></html>"]
+        return serve_page(env, start_response, setcounter=ivalue)
 
-        content_length = None
-        content_encoding = None
+    if 'setsquare' in qs_hash:
+        setsquare = qs_hash['setsquare'][0]
         try:
-            content_length = int(env['CONTENT_LENGTH'])
-            encoding_re = re.compile(r"((charset)|(encoding))\s*=\s*(?P<encoding>[A-Za-z0-9_-]+)")
-            res = encoding_re.search(env['CONTENT_TYPE'])
-            if res: content_encoding = res.group('encoding')
+            if setsquare.startswith('inc-'):
+                ivalue = int(setsquare[4:])
+                updatef = lambda x: x + ivalue
+            else:
+                ivalue = int(setsquare)
+                updatef = lambda x: ivalue
         except ValueError:
-            start_response('500 Internal Server Error', [('Content-Type', 'text/html; charset=UTF-8')])
-            return ["<html><body><h1>500 Internal Server Error</h1></body></html>"]
-        except IndexError:
-            pass
-        if not content_encoding: content_encoding = DEFAULT_ENCODING
+            return error_page(start_response, '400 Bad Request')
+        try:
+            update_counter(updatef)
+        except IOError:
+            return error_page(start_response, '500 Internal Server Error')
+        start_response('200 OK', [('Content-Type', 'text/html; charset=UTF-8')])
+        return []
 
-        post_data = env['wsgi.input'].read(content_length)
+    # (All branches above end with a return from this function.)
+
+    # ...if none of the above, it's some results.
+    if not (env.get('REQUEST_METHOD') == 'POST' and env.get('CONTENT_LENGTH')):
+        return error_page(start_response, '400 Bad Request')
+
+    content_encoding = None
+    try:
+        content_length = int(env['CONTENT_LENGTH'])
+    except ValueError:
+        return error_page(start_response, '500 Internal Server Error')
+    encoding_re = re.compile(r"((charset)|(encoding))\s*=\s*(?P<encoding>[A-Za-z0-9_-]+)")
+    res = encoding_re.search(env.get('CONTENT_TYPE', ''))
+    if res: content_encoding = res.group('encoding')
+    if not content_encoding: content_encoding = DEFAULT_ENCODING
+
+    post_data = env['wsgi.input'].read(content_length)
+    try:
         post_data = post_data.decode(content_encoding, 'ignore')
+    except LookupError: # Unknown encoding.
+        post_data = post_data.decode(DEFAULT_ENCODING, 'ignore')
 
-        # This will be called in the normal course of events, and if
-        # there is an error parsing the JSON.
-        def backup_raw_post_data(header=None):
-            bf = None
-            try:
-                try:
-                    bf = lock_and_open(os.path.join(PWD, CFG['RESULT_FILES_DIR'], CFG['RAW_RESULT_FILE_NAME']), "a")
-                    if header:
-                        bf.write(u"\n")
-                        bf.write(header.encode(DEFAULT_ENCODING))
-                    bf.write(post_data.encode(DEFAULT_ENCODING))
-                except:
-                    pass
-            finally:
-                if bf: unlock_and_close(bf)
+    # The raw data is backed up in the normal course of events, and if
+    # there is an error parsing the JSON.
+    def raw_post_data(header=None):
+        return ((header and u"\n" + header or u"") + post_data).encode(DEFAULT_ENCODING)
 
-        rf = None
+    try:
+        parsed_json = json.loads(post_data)
+        random_counter, counter, main_results, column_names, should_update_counter = rearrange(parsed_json, thetime, ip, user_agent)
+        header = None
+        if CFG['INCLUDE_HEADERS_IN_RESULTS_FILE']:
+            header = u'#\n# Results on %s.\n# USER AGENT: %s\n# %s\n#\n' % \
+                (time_module.strftime(u"%A %B %d %Y %H:%M:%S UTC",
+                                      time_module.gmtime(thetime)),
+                 user_agent,
+                 u"Design number was " + ((random_counter and u"random = " or u"non-random = ") + str(counter)))
+        if CFG['INCLUDE_COMMENTS_IN_RESULTS_FILE']:
+            main_results = get_comment_intersperser()(main_results, column_names)
+        csv_results = to_csv(main_results)
+    except (ValueError, HighLevelParseError): # JSON parse failed, or wasn't in the expected format.
         try:
+            results_writer.submit(raw_post_data(header="# BAD REQUEST FROM %s\n" % user_agent))
+        except IOError:
+            pass
+        return error_page(start_response, '400 Bad Request')
+
+    try:
+        results_writer.submit(raw_post_data(header),
+                              ((header or u"") + csv_results).encode(DEFAULT_ENCODING),
+                              bool(should_update_counter))
+    except IOError:
+        return error_page(start_response, '500 Internal Server Error')
+    start_response('200 OK', [('Content-Type', 'text/plain; charset=ascii')])
+    return [b"OK"]
+
+class ThreadedWSGIServer(socketserver.ThreadingMixIn, wsgiref.simple_server.WSGIServer):
+    daemon_threads = True
+
+#
+# Stand-alone server on asyncio ("async" mode).
+#
+# The "toy" server needs a thread per connection, and participants' browsers
+# hold connections open. Here a single event loop accepts connections and
+# parses HTTP/1.1 (with keep-alive), so each connection costs a coroutine.
+# Requests are handed to the same WSGI app as in the other modes, on a thread
+# pool of at most ASYNC_WORKERS threads: that is where all the blocking work
+# (reading includes, flock on the counter and results files) happens.
+#
+
+ASYNC_WORKERS = 16
+ASYNC_KEEPALIVE_TIMEOUT = 30        # Seconds an idle connection is kept open.
+ASYNC_MAX_HEADERS = 100
+ASYNC_MAX_BODY = 16 * 1024 * 1024   # Results are far smaller than this.
+ASYNC_WRITE_BATCH = 64 * 1024       # Bytes of response body pulled per executor call.
+
+class BadRequest(Exception):
+    pass
+
+class AsyncFileWrapper(object):
+    """wsgi.file_wrapper for the async server. Iterable like any other body,
+    but the server sends it with loop.sendfile() (zero-copy) instead."""
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+    def __iter__(self):
+        while True:
+            block = self.filelike.read(self.blksize)
+            if not block:
+                return
+            yield block
+    def close(self):
+        self.filelike.close()
+
+async def read_request_head(reader):
+    """Read a request line and headers. Returns None on a clean EOF,
+    otherwise (method, target, version, [(name, value)])."""
+    line = await reader.readline()
+    while line in (b'\r\n', b'\n'): # Tolerate stray CRLFs between requests.
+        line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise BadRequest()
+    if not version.startswith('HTTP/1.'):
+        raise BadRequest()
+
+    headers = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise BadRequest()
+        if line in (b'\r\n', b'\n'):
+            break
+        name, sep, value = line.decode('latin-1').partition(':')
+        if not sep or len(headers) >= ASYNC_MAX_HEADERS:
+            raise BadRequest()
+        headers.append((name.strip(), value.strip()))
+    return method, target, version, headers
+
+async def read_request_body(reader, headers):
+    h = dict((k.lower(), v) for k, v in headers)
+    if 'chunked' in h.get('transfer-encoding', '').lower():
+        chunks = []
+        size = 0
+        while True:
             try:
-                dec = JSONDecoder()
-                parsed_json = dec.decode(post_data)
-                random_counter, counter, main_results, column_names, should_update_counter = rearrange(parsed_json, thetime, ip, user_agent)
-                header = None
-                if CFG['INCLUDE_HEADERS_IN_RESULTS_FILE']:
-                    header = u'#\n# Results on %s.\n# USER AGENT: %s\n# %s\n#\n' % \
-                        (time_module.strftime(u"%A %B %d %Y %H:%M:%S UTC",
-                                              time_module.gmtime(thetime)),
-                         user_agent,
-                         u"Design number was " + ((random_counter and u"random = " or u"non-random = ") + unicode(counter)))
-                backup_raw_post_data(header)
-                if CFG['INCLUDE_COMMENTS_IN_RESULTS_FILE']:
-                    main_results = get_comment_intersperser()(main_results, column_names)
-                csv_results = to_csv(main_results)
-                rf = lock_and_open(os.path.join(PWD, CFG['RESULT_FILES_DIR'], CFG['RESULT_FILE_NAME']), "a")
-                rf.write(header.encode(DEFAULT_ENCODING))
-                rf.write(csv_results.encode(DEFAULT_ENCODING))
-
-                # Everything went OK with receiving and recording the results, so
-                # update the counter.
-                if should_update_counter:
-                    update_counter(lambda x: x + 1)
-
-                start_response('200 OK', [('Content-Type', 'text/plain; charset=ascii')])
-                return ["OK"]
-            except ValueError: # JSON parse failed.
-                backup_raw_post_data(header="# BAD REQUEST FROM %s\n" % user_agent)
-                start_response('400 Bad Request', [('Content-Type', 'text/html; charset=UTF-8')])
-                return ["<html><body><1>400 Bad Request</h1></body></html>"]
-            except HighLevelParseError:
-                backup_raw_post_data(header="# BAD REQUEST FROM %s\n" % user_agent)
-                start_response('400 Bad Request', [('Content-Type', 'text/html; charset=UTF-8')])
-                return ["<html><body><1>400 Bad Request</h1></body></html>"]
-            except IOError:
-                start_response('500 Internal Server Error', [('Content-Type', 'text/html; charset=UTF-8')])
-                return ["<html><body><h1>500 Internal Server Error</h1></body></html>"]
-        finally:
-            if rf: unlock_and_close(rf)
+                n = int((await reader.readline()).split(b';')[0], 16)
+            except ValueError:
+                raise BadRequest()
+            if n == 0:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''): # Trailers.
+                    pass
+                return b''.join(chunks)
+            size += n
+            if size > ASYNC_MAX_BODY:
+                raise BadRequest()
+            chunks.append(await reader.readexactly(n))
+            await reader.readline()
+    try:
+        length = int(h.get('content-length', 0))
+    except ValueError:
+        raise BadRequest()
+    if length < 0 or length > ASYNC_MAX_BODY:
+        raise BadRequest()
+    return await reader.readexactly(length) if length else b''
+
+def async_environ(method, target, version, headers, body, writer, port):
+    path, _, query = target.partition('?')
+    peer = writer.get_extra_info('peername') or ('', 0)
+    env = {
+        'REQUEST_METHOD'    : method,
+        'SCRIPT_NAME'       : '',
+        'PATH_INFO'         : urllib.parse.unquote(path, encoding='latin-1'),
+        'QUERY_STRING'      : query,
+        'SERVER_NAME'       : 'localhost',
+        'SERVER_PORT'       : str(port),
+        'SERVER_PROTOCOL'   : version,
+        'REMOTE_ADDR'       : peer[0],
+        'wsgi.version'      : (1, 0),
+        'wsgi.url_scheme'   : 'http',
+        'wsgi.input'        : io.BytesIO(body),
+        'wsgi.errors'       : sys.stderr,
+        'wsgi.multithread'  : True,
+        'wsgi.multiprocess' : False,
+        'wsgi.run_once'     : False,
+        'wsgi.file_wrapper' : AsyncFileWrapper,
+    }
+    for name, value in headers:
+        key = name.upper().replace('-', '_')
+        if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            env[key] = value
+        else:
+            key = 'HTTP_' + key
+            env[key] = key in env and env[key] + ',' + value or value
+    if 'CONTENT_LENGTH' not in env and body:
+        env['CONTENT_LENGTH'] = str(len(body))
+    return env
+
+def call_app(app, env):
+    """Run the app (on an executor thread).
+
+    Returns (status, headers, first bytes, rest iterator or None, body)."""
+    response = []
+    def start_response(status, headers, exc_info=None):
+        if exc_info and response:
+            raise exc_info[1].with_traceback(exc_info[2])
+        response[:] = [status, headers]
+    body = app(env, start_response)
+    if isinstance(body, list): # The common case: the whole response is already in memory.
+        return response[0], response[1], b''.join(body), None, body
+    it = iter(body)
+    # The status is only guaranteed to be set once the first chunk has been produced.
+    first = next(it, b'') if not response else b''
+    if not response:
+        raise RuntimeError("WSGI app returned without calling start_response")
+    return response[0], response[1], first, it, body
+
+def next_batch(it, body):
+    """Pull up to ASYNC_WRITE_BATCH bytes from a response body (on an executor thread)."""
+    batch = []
+    size = 0
+    for chunk in it:
+        batch.append(chunk)
+        size += len(chunk)
+        if size >= ASYNC_WRITE_BATCH:
+            break
     else:
-        start_response('404 Not Found', [('Content-Type', 'text/html; charset=UTF-8')])
-        return ["<html><body><h1>404 Not Found</h1></body></html>"]
+        if hasattr(body, 'close'):
+            body.close()
+    return b''.join(batch), size >= ASYNC_WRITE_BATCH
 
-if CFG['SERVER_MODE'] != "cgi":
-    class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
-        pass
+def format_response_head(version, status, headers):
+    lines = ["%s %s" % (version, status)]
+    lines.extend("%s: %s" % h for h in headers)
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
 
-    class MyHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler, ):
-        STATIC_FILES = [
-            'experiment.html',
-            'overview.html',
-            'json.js',
-            'conf.js',
-            'shuffle.js',
-            'util.js',
-            'backcompatcruft.js',
-            'jquery.min.js',
-            'jquery-ui.min.js',
-            'PluginDetect.js',
-            'jsDump.js',
-            'soundmanager2-jsmin.js',
-            'soundmanager2_debug.swf'
-        ]
-
-        def __init__(self, request, client_address, server):
-            self.extensions_map = {
-                '' : "application/octet-stream",
-                ".html" : "text/html; charset=UTF-8",
-                ".css"  : "text/css",
-                ".js"   : "application/x-javascript",
-                ".swf"  : "application/x-shockwave-flash"
-            }
-
-            SimpleHTTPServer.SimpleHTTPRequestHandler.__init__(self, request, client_address, server)
-
-        def do_either(self, method_name):
-            last = filter(lambda x: x != [], self.path.split('/'))[-1];
-            ps = last.split('?')
-            qs = len(ps) > 1 and ps[1] or None
-            path = ps[0]
-            if method_name == 'GET' and path in MyHTTPRequestHandler.STATIC_FILES:
-                return SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self);
-            else:
-                # Bit of a hack. The 'control' function was written for use with the
-                # paste module's simple HTTP server, but SimpleHTTPServer has a different
-                # interface, so we bridge the gap here.
-                response_type = [None]
-                headers = [None]
-                def start_response(response_type_, headers_):
-                    response_type[0] = response_type_
-                    headers[0] = headers_
-                env = {
-                    "REMOTE_ADDR"    : self.client_address[0], # self.client_address is a (host,port) tuple.
-                    "REQUEST_URI"    : path,
-                    "REQUEST_METHOD" : method_name,
-                }
-                if qs:
-                    env['QUERY_STRING'] = qs
-                if method_name == "POST":
-                    env['wsgi.input'] = self.rfile
-                cl = self.headers.getheader("Content-Length")
-                if cl:
-                    env['CONTENT_LENGTH'] = cl
-                ct = self.headers.getheader("Content-Type")
-                if ct:
-                    env['CONTENT_TYPE'] = ct
-                ua = self.headers.getheader("User-Agent")
-                if ua:
-                    env['USER_AGENT'] = ua
-
-                body = control(env, start_response)
-                assert response_type[0]
-                rts = response_type[0].split(' ')
+async def handle_async_connection(app, executor, port, reader, writer):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(read_request_head(reader), ASYNC_KEEPALIVE_TIMEOUT)
+                if head is None:
+                    break
+                method, target, version, headers = head
+                if any(k.lower() == 'expect' and v.lower() == '100-continue' for k, v in headers):
+                    writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                body = await read_request_body(reader, headers)
+            except (BadRequest, ValueError, asyncio.IncompleteReadError):
+                writer.write(format_response_head("HTTP/1.1", "400 Bad Request", [('Content-Length', '0'), ('Connection', 'close')]))
+                break
+            except asyncio.TimeoutError:
+                break
+
+            connection = dict((k.lower(), v.lower()) for k, v in headers).get('connection', '')
+            keep_alive = (version == 'HTTP/1.1' and connection != 'close') or connection == 'keep-alive'
+
+            env = async_environ(method, target, version, headers, body, writer, port)
+            try:
+                status, resp_headers, first, it, resp_body = await loop.run_in_executor(executor, call_app, app, env)
+            except Exception:
+                logger.exception("Error handling %s %s" % (method, target))
+                writer.write(format_response_head(version, "500 Internal Server Error", [('Content-Length', '0'), ('Connection', 'close')]))
+                break
+
+            resp_headers = list(resp_headers)
+            names = set(h[0].lower() for h in resp_headers)
+            if it is None and 'content-length' not in names and not status.startswith(('204', '304')):
+                resp_headers.append(('Content-Length', str(len(first))))
+                names.add('content-length')
+            chunked = 'content-length' not in names and method != 'HEAD' and not status.startswith(('204', '304'))
+            if chunked and version != 'HTTP/1.1':
+                chunked, keep_alive = False, False
+            if chunked:
+                resp_headers.append(('Transfer-Encoding', 'chunked'))
+            if 'date' not in names:
+                resp_headers.append(('Date', email.utils.formatdate(usegmt=True)))
+            resp_headers.append(('Connection', keep_alive and 'keep-alive' or 'close'))
+            writer.write(format_response_head(version, status, resp_headers))
+            sys.stderr.write('%s - - [%s] "%s %s %s" %s\n' % (env['REMOTE_ADDR'], time_module.strftime("%d/%b/%Y %H:%M:%S"), method, target, version, status.split(' ')[0]))
+
+            if isinstance(resp_body, AsyncFileWrapper) and not chunked:
                 try:
-                    self.send_response(int(rts[0]), ' '.join(rts[1:]))
-                    if headers[0]:
-                        for h in headers[0]:
-                            self.send_header(h[0], h[1])
-                    self.wfile.write('\n')
-                    for cs in body:
-                        self.wfile.write(cs)
-                except:
-                    # If we let exceptions percolate, we end up serving things as static
-                    # files which shouldn't be.
-                    logger.error("Error in responding to GET/POST request for toy Python HTTP server.");
-
-        def do_GET(self):
-            self.do_either('GET')
-
-        def do_POST(self):
-            self.do_either('POST')
+                    if method != 'HEAD':
+                        await writer.drain()
+                        length = int(dict((k.lower(), v) for k, v in resp_headers)['content-length'])
+                        await loop.sendfile(writer.transport, resp_body.filelike, resp_body.filelike.tell(), length)
+                finally:
+                    resp_body.close()
+                if not keep_alive:
+                    break
+                continue
+
+            data = first
+            more = it is not None
+            while True:
+                if data and method != 'HEAD':
+                    writer.write(chunked and b"%x\r\n%s\r\n" % (len(data), data) or data)
+                    await writer.drain()
+                if not more:
+                    break
+                data, more = await loop.run_in_executor(executor, next_batch, it, resp_body)
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+            await writer.drain()
 
-if __name__ == "__main__":
-    if COUNTER_SHOULD_BE_RESET:
-        set_counter(0)
-        print "Counter for latin square designs has been reset.\n"
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+def run_async_server(app, port, workers=ASYNC_WORKERS):
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    async def serve():
+        server = await asyncio.start_server(
+            lambda r, w: handle_async_connection(app, executor, port, r, w), port=port)
+        async with server:
+            await server.serve_forever()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(wait=False)
+
+
+def main():
+    try:
+        command_line_options, _ = getopt.getopt(sys.argv[1:], "m:p:r", ["genhtml="])
+    except getopt.GetoptError:
+        sys.stderr.write("Bad arguments\n")
+        sys.exit(1)
+
+    gh = [x for x in command_line_options if x[0] == '--genhtml']
+    gh.reverse()
+
+    if gh:
+        # Not much point catching exceptions here, since this is just going
+        # to be run on the command line, and the default Python errors will be fine.
+        experiment_html = generate_html(setcounter=None, overview=False)
+        overview_html = generate_html(setcounter=None, overview=True)
+        with open(os.path.join(gh[0][1], 'experiment.html'), "w", encoding=DEFAULT_ENCODING) as ef:
+            ef.write(experiment_html)
+        with open(os.path.join(gh[0][1], 'overview.html'), "w", encoding=DEFAULT_ENCODING) as of:
+            of.write(overview_html)
+        sys.exit(0)
+
+    # Check for "-m" and "-p" options (sets server mode and port respectively).
+    # Also check for "-r" option (resest counter on startup).
+    overrides = { }
+    counter_should_be_reset = False
+    for k,v in command_line_options:
+        if k == "-m":
+            overrides['SERVER_MODE'] = v
+        elif k == "-p":
+            try:
+                overrides['PORT'] = int(v)
+            except ValueError:
+                sys.stderr.write("Argument to -p must be an integer\n")
+                sys.exit(1)
+        elif k == "-r":
+            counter_should_be_reset = True
+
+    try:
+        app = create_app(overrides, reset_log=True)
+    except ConfigError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    if counter_should_be_reset:
+        try:
+            set_counter(0)
+        except IOError:
+            sys.exit(1)
+        print("Counter for latin square designs has been reset.\n")
 
     if CFG['SERVER_MODE'] in ["paste", "toy"]:
-        server_address = ('', CFG['PORT'])
-        httpd = ThreadedHTTPServer(server_address, MyHTTPRequestHandler)
-        httpd.path = CFG['STATIC_FILES_DIR']
+        httpd = wsgiref.simple_server.make_server('', CFG['PORT'], app, server_class=ThreadedWSGIServer)
         httpd.serve_forever()
+    elif CFG['SERVER_MODE'] == "async":
+        run_async_server(app, CFG['PORT'], CFG['ASYNC_WORKERS'])
     elif CFG['SERVER_MODE'] == "cgi":
-        #wsgiref.handlers.CGIHandler().run(control)
-        env = { }
-        for k in os.environ:
-            env[k] = os.environ[k]
-        env['wsgi.input'] = sys.stdin
-        def start_response(type, headers):
-            sys.stdout.write("Content-Type: %s\n" % type)
-            for h in headers:
-                sys.stdout.write("%s: %s\n" % h)
-            sys.stdout.write("\n")
-        for l in control(env, start_response):
-            sys.stdout.write(l)
+        wsgiref.handlers.CGIHandler().run(app)
+
+if __name__ == "__main__":
+    main()
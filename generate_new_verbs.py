@@ -14,14 +14,26 @@ New verbs to generate (replacing punctual verbs):
 - spin_top (replaces light_candle) - Practice
 """
 
+import io
 import os
+import json
 import time
+import hashlib
 import argparse
+import tempfile
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 from google import genai
 from PIL import Image as PILImage
 
+import api_ledger
+import image_dedup
+import optimize_pngs
+import score_pipeline
+from generation_jobs import JobQueue, JOBS_FILE
+
 # Configuration
 BASE_DIR = "experiments/conceptual-task/chunk_includes/base"
 OUTPUT_DIR = "experiments/conceptual-task/chunk_includes"
@@ -58,6 +70,12 @@ NEW_ACTIONS = {
 # Number of versions to generate per action
 NUM_VERSIONS = 5
 
+# Uploaded reference images, reused across runs while still valid server-side.
+# Uploads expire after 48h; a handle with less than REFERENCE_MIN_TTL left is
+# re-uploaded rather than risk it expiring mid-run.
+REFERENCE_CACHE_FILE = "reference_uploads.json"
+REFERENCE_MIN_TTL = 6 * 3600
+
 
 def get_client():
     """Get Gemini client from env var or token file."""
@@ -92,7 +110,9 @@ def load_base_images(base_dir):
     for char_name in CHARACTERS.keys():
         filename = os.path.join(base_dir, f"{char_name}_base.png")
         if os.path.exists(filename):
-            base_images[char_name] = PILImage.open(filename)
+            # copy() forces the lazy PNG decode now, so worker threads
+            # never race on loading the shared reference image.
+            base_images[char_name] = PILImage.open(filename).copy()
             print(f"  Loaded base image: {filename}")
         else:
             print(f"  Warning: Base image not found: {filename}")
@@ -100,10 +120,129 @@ def load_base_images(base_dir):
     return base_images
 
 
-def generate_image(client, prompt, reference_image=None, max_retries=5, model_id=MODEL_ID):
-    """Generate image using Gemini with optional reference image."""
+class Reference:
+    """A character's reference image as attached to requests.
+
+    content is either an uploaded file handle or the PIL image itself (sent
+    inline); payload_bytes is roughly what attaching it adds to each request.
+    """
+
+    def __init__(self, content, payload_bytes, source):
+        self.content = content
+        self.payload_bytes = payload_bytes
+        self.source = source   # "upload", "cached upload" or "inline"
+
+
+def inline_payload_bytes(image):
+    """Approximate request bytes for an inline image (PNG, base64-encoded in JSON)."""
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return (buffer.tell() + 2) // 3 * 4
+
+
+def file_sha256(filepath):
+    with open(filepath, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_reference_cache(cache_file=REFERENCE_CACHE_FILE):
+    if os.path.exists(cache_file):
+        with open(cache_file, "r") as f:
+            return json.load(f)
+    return {}
+
+
+def save_reference_cache(cache, cache_file=REFERENCE_CACHE_FILE):
+    temp_path = cache_file + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(temp_path, cache_file)
+
+
+def cached_upload(client, entry, digest):
+    """Return the cached file handle if it matches digest and is still usable, else None."""
+    if not entry or entry.get("sha256") != digest:
+        return None
+    if entry.get("expires_at", 0) - time.time() < REFERENCE_MIN_TTL:
+        return None
+    try:
+        handle = client.files.get(name=entry["name"])
+    except Exception:
+        return None
+    state = getattr(handle.state, "name", handle.state)
+    return handle if state in (None, "ACTIVE") else None
+
+
+def upload_reference(client, filepath):
+    """Upload one reference image and return (handle, cache entry)."""
+    call = api_ledger.CallRecord("generate_new_verbs", "files.upload", detail=filepath,
+                                 payload_bytes=os.path.getsize(filepath))
+    call.attempt()
+    try:
+        handle = client.files.upload(file=filepath, config={"mime_type": "image/png"})
+    except Exception:
+        call.finish("error")
+        raise
+    call.finish("ok")
+
+    expires = getattr(handle, "expiration_time", None)
+    expires_at = expires.timestamp() if expires else time.time() + 48 * 3600
+    return handle, {"name": handle.name, "uri": handle.uri, "expires_at": expires_at}
+
+
+def prepare_references(client, base_dir, base_images, inline=False, cache_file=REFERENCE_CACHE_FILE):
+    """Upload each character's reference once and return {char: Reference}.
+
+    Handles from earlier runs are reused when the base image is unchanged
+    (same sha256) and the upload hasn't expired. If uploading fails, that
+    character falls back to sending its image inline with every request.
+    """
+    references = {}
+    cache = load_reference_cache(cache_file)
+
+    for char_name, image in base_images.items():
+        inline_ref = Reference(image, inline_payload_bytes(image), "inline")
+        if inline:
+            references[char_name] = inline_ref
+            continue
+
+        filepath = os.path.abspath(os.path.join(base_dir, f"{char_name}_base.png"))
+        digest = file_sha256(filepath)
+        handle = cached_upload(client, cache.get(filepath), digest)
+        source = "cached upload"
+        if handle is None:
+            try:
+                handle, entry = upload_reference(client, filepath)
+            except Exception as e:
+                print(f"  Warning: could not upload {filepath} ({e}); sending it inline")
+                references[char_name] = inline_ref
+                continue
+            cache[filepath] = dict(entry, sha256=digest)
+            source = "upload"
+
+        references[char_name] = Reference(handle, len(handle.uri or handle.name), source)
+
+    save_reference_cache(cache, cache_file)
+    for char_name, ref in references.items():
+        print(f"  {char_name}: {ref.source} reference, ~{ref.payload_bytes / 1024:.1f} KB per request")
+    return references
+
+
+def generate_image(client, prompt, reference_image=None, max_retries=5, model_id=MODEL_ID, label="",
+                   payload_bytes=None, limiter=None):
+    """Generate image using Gemini with optional reference image (PIL image or file handle).
+
+    With a RateLimiter, every attempt (retries included) waits for its turn,
+    and a rate-limit response holds back all workers sharing the limiter.
+    """
+    call = api_ledger.CallRecord("generate_new_verbs", model_id, detail=label,
+                                 payload_bytes=payload_bytes)
+    prefix = f"    [{label}] " if label else "    "
 
     for attempt in range(max_retries):
+        if limiter:
+            call.queued(limiter.wait())
+        call.attempt()
         try:
             contents = [prompt]
             if reference_image:
@@ -118,32 +257,344 @@ def generate_image(client, prompt, reference_image=None, max_retries=5, model_id
             )
 
             for part in response.parts:
-                if image := part.as_image():
-                    # Save to temp and reload as PIL
-                    temp_path = "/tmp/gemini_temp.png"
-                    image.save(temp_path)
-                    return PILImage.open(temp_path)
-
-            print(f"    No image in response")
+                if part.inline_data and part.inline_data.data:
+                    # Decode the returned bytes in memory; the caller writes
+                    # the image once, atomically, to its final path.
+                    image = PILImage.open(io.BytesIO(part.inline_data.data))
+                    image.load()
+                    call.finish("ok", response)
+                    return image
+
+            print(f"{prefix}No image in response")
+            call.finish("no_image", response)
             return None
 
         except Exception as e:
             error_str = str(e)
             if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
                 wait_time = (2 ** attempt) * 5
-                print(f"    Rate limited. Waiting {wait_time}s...")
-                time.sleep(wait_time)
+                print(f"{prefix}Rate limited. Waiting {wait_time}s...")
+                if limiter:
+                    limiter.backoff(wait_time)
+                call.backoff(wait_time)
                 continue
             if "NOT_FOUND" in error_str or "not found" in error_str:
-                print("    Model not found. Try --model-id gemini-2.5-flash-image or gemini-3-pro-image-preview.")
+                print(f"{prefix}Model not found. Try --model-id gemini-2.5-flash-image or gemini-3-pro-image-preview.")
             else:
-                print(f"    Error: {e}")
+                print(f"{prefix}Error: {e}")
+            call.finish("error")
             return None
 
-    print(f"    Failed after {max_retries} retries")
+    print(f"{prefix}Failed after {max_retries} retries")
+    call.finish("rate_limited")
     return None
 
 
+class RateLimiter:
+    """Space API request starts at least `interval` seconds apart across all workers."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until this request's turn; returns the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+        return start - now
+
+    def backoff(self, seconds):
+        """Hold every worker's next request back for at least `seconds` (after a 429)."""
+        with self._lock:
+            self._next_start = max(self._next_start, time.monotonic() + seconds)
+
+
+def save_image_atomic(image, filepath, optimize=True):
+    """Write a PNG via a temp file in the same directory, then rename into place.
+
+    Readers (and the evaluators) never see a half-written file, and a killed
+    run never leaves a truncated PNG behind. With optimize, the image is
+    stored as a small-palette PNG (see optimize_pngs.py).
+    """
+    directory = os.path.dirname(filepath) or "."
+    fd, temp_path = tempfile.mkstemp(suffix=".png.tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if optimize:
+                f.write(optimize_pngs.optimize_image(image)[0])
+            else:
+                image.save(f, format="PNG")
+        # mkstemp files are 0600; give the image the mode a plain save would.
+        os.chmod(temp_path, optimize_pngs.replacement_mode(filepath))
+        os.replace(temp_path, filepath)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def build_prompt(char_desc, action_desc):
+    """Full generation prompt for one character/action."""
+    return (
+        f"{STYLE_PROMPT} {char_desc} The character is {action_desc}. "
+        f"Full body shot. Clear mid-action pose. Isolated on white background. "
+        f"The character should be actively engaged in the action, not before or after."
+    )
+
+
+def build_jobs(characters, actions, num_versions, output_dir):
+    """List one independent job per output image."""
+    jobs = []
+    for char_name, char_desc in characters.items():
+        for action_key, action_desc in actions.items():
+            prompt = build_prompt(char_desc, action_desc)
+            for v in range(1, num_versions + 1):
+                filename = f"{char_name}_{action_key}_v{v}.png"
+                jobs.append({
+                    "character": char_name,
+                    "action": action_key,
+                    "version": v,
+                    "filename": filename,
+                    "filepath": os.path.join(output_dir, filename),
+                    "prompt": prompt,
+                })
+    return jobs
+
+
+def run_job(client, job, reference, limiter, model_id, dedup=None, optimize_png=True):
+    """Generate and save a single image. Returns True on success.
+
+    With a dedup (HashIndex, max distance) pair, an image that near-duplicates
+    an existing version of the same combo is discarded instead of saved.
+    """
+    image = generate_image(
+        client,
+        job["prompt"],
+        reference_image=reference.content,
+        model_id=model_id,
+        label=job["filename"],
+        payload_bytes=len(job["prompt"].encode()) + reference.payload_bytes,
+        limiter=limiter,
+    )
+    if not image:
+        return False
+    if dedup:
+        index, max_distance = dedup
+        match = index.add_unless_duplicate(job["filepath"], image, max_distance)
+        if match:
+            job["error"] = f"near-duplicate of {os.path.basename(match[0])} (distance {match[1]})"
+            print(f"    [{job['filename']}] Discarded: {job['error']}")
+            return False
+    try:
+        save_image_atomic(image, job["filepath"], optimize_png)
+    except BaseException:
+        if dedup:
+            dedup[0].discard(job["filepath"])
+        raise
+    return True
+
+
+class Progress:
+    """Thread-safe completion counter with throughput reporting."""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = []
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def report(self, job, ok):
+        with self._lock:
+            self.done += 1
+            if not ok:
+                self.failed.append(job["filename"])
+            elapsed = time.monotonic() - self.start
+            rate = self.done / elapsed * 60 if elapsed > 0 else 0
+            status = f"Saved: {job['filepath']}" if ok else "FAILED"
+            print(f"[{self.done}/{self.total}] {job['filename']}: {status} "
+                  f"({elapsed:.0f}s elapsed, {rate:.1f} images/min)")
+
+
+def worker_loop(client, queue, references, characters, actions, args, limiter, progress,
+                pipeline=None):
+    """Claim and run jobs from the queue until it is drained.
+
+    With a score pipeline, each saved image is handed straight to the scorers.
+    """
+    while True:
+        claimed = queue.claim(list(characters), list(actions), args.num_versions, args.model_id)
+        if not claimed:
+            return
+
+        job = dict(claimed)
+        job["prompt"] = build_prompt(characters[job["character"]], actions[job["action"]])
+        job["filepath"] = os.path.join(args.output_dir, job["filename"])
+
+        try:
+            ok = run_job(client, job, references[job["character"]], limiter, args.model_id,
+                         args.dedup_check, not args.no_optimize_png)
+        except Exception as e:
+            print(f"    [{job['filename']}] Error saving: {e}")
+            ok = False
+            job["error"] = str(e)
+
+        if ok:
+            queue.complete(job["filename"])
+        else:
+            queue.fail(job["filename"], job.get("error", "generation failed"))
+        progress.report(job, ok)
+
+        if ok and pipeline:
+            pipeline.submit(job["filepath"])
+
+
+def score_version(scorers, store, filepath):
+    """Score one image with each scorer that hasn't scored it yet.
+
+    Returns (combined score, whether a Gemini evaluation call was made).
+    """
+    evaluated = False
+    if "clip" in scorers and not store.has_clip(filepath):
+        entry = scorers["clip"].score(filepath)
+        if entry:
+            store.add_clip(filepath, entry)
+    if "gemini" in scorers and not store.has_gemini(filepath):
+        result = scorers["gemini"].score(filepath)
+        evaluated = True
+        if result:
+            store.add_gemini(filepath, result)
+    return store.combined_score(filepath), evaluated
+
+
+def adaptive_combo(client, scorers, store, char_name, char_desc, action_key, action_desc,
+                   reference, limiter, args):
+    """Generate versions of one combo one at a time until one clears the threshold.
+
+    Versions already on disk are scored (if needed) instead of regenerated,
+    so an interrupted adaptive run resumes where it stopped.
+    """
+    prompt = build_prompt(char_desc, action_desc)
+    combo = f"{char_name}_{action_key}"
+    result = {"combo": combo, "calls": 0, "versions": 0, "evaluations": 0, "best_file": None,
+              "best_score": None, "passed": False}
+
+    for v in range(1, args.max_attempts + 1):
+        filename = f"{combo}_v{v}.png"
+        filepath = os.path.join(args.output_dir, filename)
+
+        if not os.path.exists(filepath):
+            job = {"filename": filename, "filepath": filepath, "prompt": prompt}
+            result["calls"] += 1
+            if not run_job(client, job, reference, limiter, args.model_id, args.dedup_check,
+                           not args.no_optimize_png):
+                print(f"    [{filename}] FAILED")
+                continue
+
+        result["versions"] += 1
+        score, evaluated = score_version(scorers, store, filepath)
+        result["evaluations"] += evaluated
+        score_str = f"{score:.1f}" if score is not None else "N/A"
+        print(f"    [{filename}] combined={score_str} (threshold {args.threshold:.0f})")
+
+        if score is not None and (result["best_score"] is None or score > result["best_score"]):
+            result["best_file"], result["best_score"] = filename, score
+        if score is not None and score >= args.threshold:
+            result["passed"] = True
+            break
+
+    return result
+
+
+def run_adaptive(client, references, characters, actions, args):
+    """Adaptive mode: stop generating a combo once a version is good enough."""
+    scorers = {}
+    if args.score_with in ("both", "clip"):
+        scorers["clip"] = score_pipeline.ClipScorer()
+    if args.score_with in ("both", "gemini"):
+        # One evaluation limiter for all adaptive workers, separate from generation's.
+        scorers["gemini"] = score_pipeline.GeminiScorer(
+            limiter=RateLimiter(score_pipeline.GEMINI_DELAY))
+    store = score_pipeline.ScoreStore()
+    limiter = RateLimiter(args.delay)
+
+    combos = [(c, d, a, ad) for c, d in characters.items() for a, ad in actions.items()]
+    # Evaluations fixed-count mode would make in this run: versions not scored already.
+    unscored = sum(1 for c, _, a, _ in combos for v in range(1, args.num_versions + 1)
+                   if not store.has_gemini(os.path.join(args.output_dir, f"{c}_{a}_v{v}.png")))
+    print(f"\nAdaptive generation: {len(combos)} combos, threshold {args.threshold:.0f}, "
+          f"up to {args.max_attempts} versions each, scoring with {args.score_with}")
+
+    results = []
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = [
+            pool.submit(adaptive_combo, client, scorers, store, c, d, a, ad,
+                        references[c], limiter, args)
+            for c, d, a, ad in combos
+        ]
+        for future in futures:
+            r = future.result()
+            results.append(r)
+            best = f"{r['best_file']} ({r['best_score']:.1f})" if r["best_file"] else "none"
+            status = "PASS" if r["passed"] else "below threshold"
+            print(f"[{len(results)}/{len(combos)}] {r['combo']}: {status}, best {best}, "
+                  f"{r['calls']} generation call(s)")
+
+    calls = sum(r["calls"] for r in results)
+    fixed = len(combos) * args.num_versions
+    passed = sum(1 for r in results if r["passed"])
+    elapsed = time.monotonic() - start
+    print(f"\n{'='*60}")
+    print("ADAPTIVE GENERATION SUMMARY")
+    print(f"{'='*60}")
+    print(f"  Combos passing threshold: {passed}/{len(combos)}")
+    print(f"  Generation calls: {calls} (fixed-count mode: {fixed} at {args.num_versions} per combo)")
+    if fixed:
+        print(f"  Generation calls saved: {fixed - calls} ({(fixed - calls) / fixed:.0%})")
+    if "gemini" in scorers:
+        evaluations = sum(r["evaluations"] for r in results)
+        print(f"  Gemini evaluation calls: {evaluations} (fixed-count mode: {unscored}, "
+              f"not counting versions scored before this run)")
+        print(f"  Gemini evaluation calls saved: {unscored - evaluations}")
+    print(f"  Elapsed: {elapsed:.0f}s")
+    failing = [r["combo"] for r in results if not r["passed"]]
+    if failing:
+        print(f"  Below threshold after {args.max_attempts} versions: {', '.join(failing)}")
+
+
+def print_estimate(args, num_jobs):
+    """Predict wall time, requests and cost for num_jobs from the API ledger history."""
+    history = api_ledger.load_history(script="generate_new_verbs", model_id=args.model_id)
+    estimate = api_ledger.simulate_run(history, args.model_id, num_jobs, args.workers, args.delay)
+
+    print(f"\n{'='*60}")
+    print("ESTIMATE")
+    print(f"{'='*60}")
+    if not estimate:
+        print(f"  No recorded generate_new_verbs calls for {args.model_id} in {api_ledger.LEDGER_FILE};")
+        print("  run a small batch first to calibrate the estimate.")
+        return
+
+    print(f"  {num_jobs} images on {args.workers} worker(s), min {args.delay:.1f}s between requests")
+    print(f"  Based on {estimate['history']} recorded calls for {args.model_id} "
+          f"({estimate['trials']} simulated runs)")
+    print(f"  Wall time:  ~{estimate['wall_p50'] / 60:.1f} min (p90 {estimate['wall_p90'] / 60:.1f} min)")
+    print(f"  Requests:   ~{estimate['requests_p50']:.0f} (p90 {estimate['requests_p90']:.0f}, "
+          f"incl. retries)")
+    print(f"  Failures:   ~{estimate['failed_p50']:.0f} images")
+    if estimate["cost_p50"] is not None:
+        print(f"  Cost:       ~${estimate['cost_p50']:.2f} (p90 ${estimate['cost_p90']:.2f})")
+    else:
+        print(f"  Cost:       N/A (no pricing for {args.model_id} in api_ledger.PRICING)")
+    if args.adaptive:
+        print("  (--adaptive stops combos early, so treat these as upper bounds)")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Generate images for new verbs")
     parser.add_argument("--base-dir", default=BASE_DIR, help="Directory with base images")
@@ -151,15 +602,44 @@ def main():
     parser.add_argument("--num-versions", type=int, default=NUM_VERSIONS, help="Versions per action")
     parser.add_argument("--character", type=str, help="Generate for specific character only")
     parser.add_argument("--action", type=str, help="Generate specific action only")
-    parser.add_argument("--delay", type=float, default=2.0, help="Delay between API calls")
+    parser.add_argument("--delay", type=float, default=2.0,
+                        help="Minimum seconds between API request starts, shared by all workers")
+    parser.add_argument("--workers", type=int, default=1, help="Concurrent generation workers")
     parser.add_argument(
         "--model-id",
         default=MODEL_ID,
         help="Gemini model id (default: GEMINI_MODEL_ID env var or gemini-2.5-flash-image)",
     )
-    parser.add_argument("--dry-run", action="store_true", help="Show what would be generated")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Show what would be generated, with a time/cost estimate from past runs")
     parser.add_argument("--skip-existing", action="store_true", help="Skip if file exists")
+    parser.add_argument("--jobs-db", default=JOBS_FILE, help="Persistent job queue (SQLite)")
+    parser.add_argument("--retry-failed", action="store_true", help="Re-queue previously failed jobs")
+    parser.add_argument("--reset-jobs", action="store_true",
+                        help="Forget the queued jobs for this output directory (and filters) and start over")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Score each image with CLIP/Gemini as soon as it is generated")
+    parser.add_argument("--score-with", choices=["both", "clip", "gemini"], default="both",
+                        help="Scorers used by --pipeline")
+    parser.add_argument("--pipeline-queue", type=int, default=score_pipeline.QUEUE_SIZE,
+                        help="Images buffered per scoring stage before generation waits")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Discard images that near-duplicate an existing version of the same combo")
+    parser.add_argument("--dedup-distance", type=int, default=image_dedup.MAX_DISTANCE,
+                        help="Max perceptual-hash Hamming distance treated as a duplicate")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Generate one version at a time per combo until one scores >= --threshold")
+    parser.add_argument("--threshold", type=float, default=70,
+                        help="Combined score (0-100) that ends a combo in --adaptive mode")
+    parser.add_argument("--max-attempts", type=int, default=None,
+                        help="Version cap per combo in --adaptive mode (default: --num-versions)")
+    parser.add_argument("--inline-reference", action="store_true",
+                        help="Send reference images inline with every request instead of uploading once")
+    parser.add_argument("--no-optimize-png", action="store_true",
+                        help="Save full 24-bit PNGs instead of small-palette ones")
     args = parser.parse_args()
+    if args.max_attempts is None:
+        args.max_attempts = args.num_versions
 
     # Filter characters and actions if specified
     characters = {args.character: CHARACTERS[args.character]} if args.character else CHARACTERS
@@ -174,10 +654,18 @@ def main():
 
     if args.dry_run:
         print("\nDry run - would generate:")
-        for char in characters:
-            for action in actions:
-                for v in range(1, args.num_versions + 1):
-                    print(f"  {char}_{action}_v{v}.png")
+        planned = build_jobs(characters, actions, args.num_versions, args.output_dir)
+        if args.adaptive or args.reset_jobs:
+            # Adaptive runs don't use the job queue, and a reset starts every job afresh.
+            if args.skip_existing:
+                planned = [j for j in planned if not os.path.exists(j["filepath"])]
+        else:
+            # Only what the job queue would leave pending (read-only: a dry run writes nothing).
+            queue = JobQueue(args.jobs_db, args.output_dir, readonly=True)
+            planned = queue.would_run(planned, args.retry_failed, args.skip_existing)
+        for job in planned:
+            print(f"  {job['filename']}")
+        print_estimate(args, len(planned))
         return
 
     # Setup
@@ -194,58 +682,104 @@ def main():
 
     os.makedirs(args.output_dir, exist_ok=True)
 
-    # Generate images
-    count = 0
-    for char_name, char_desc in characters.items():
-        ref_image = base_images.get(char_name)
-
-        if not ref_image:
+    dedup_index = None
+    args.dedup_check = None
+    if args.dedup:
+        existing = [os.path.join(args.output_dir, f) for f in os.listdir(args.output_dir)
+                    if f.endswith(".png") and "_v" in f]
+        dedup_index = image_dedup.HashIndex()
+        dedup_index.refresh(existing)
+        args.dedup_check = (dedup_index, args.dedup_distance)
+        print(f"Near-duplicate check against {len(existing)} existing versions "
+              f"(distance <= {args.dedup_distance})")
+
+    # Only characters with a reference image can be generated
+    for char_name in characters:
+        if char_name not in base_images:
             print(f"\nWarning: No reference for {char_name}, skipping...")
-            continue
+    characters = {c: d for c, d in characters.items() if c in base_images}
 
-        for action_key, action_desc in actions.items():
-            # Build prompt
-            full_prompt = (
-                f"{STYLE_PROMPT} {char_desc} The character is {action_desc}. "
-                f"Full body shot. Clear mid-action pose. Isolated on white background. "
-                f"The character should be actively engaged in the action, not before or after."
-            )
+    print("\nPreparing reference images...")
+    references = prepare_references(client, args.base_dir,
+                                    {c: base_images[c] for c in characters}, args.inline_reference)
 
-            for v in range(1, args.num_versions + 1):
-                filename = f"{char_name}_{action_key}_v{v}.png"
-                filepath = os.path.join(args.output_dir, filename)
+    if args.adaptive:
+        run_adaptive(client, references, characters, actions, args)
+        if dedup_index:
+            dedup_index.save()
+        return
 
-                count += 1
-                print(f"\n[{count}/{total}] {filename}")
+    # Seed and recover the persistent job queue
+    queue = JobQueue(args.jobs_db, args.output_dir)
+    if args.reset_jobs:
+        print(f"\nReset {queue.reset(list(characters), list(actions))} jobs for {queue.output_dir}")
+    added = queue.seed(build_jobs(characters, actions, args.num_versions, args.output_dir))
+    recovered = queue.requeue_abandoned()
+    missing = queue.requeue_missing(list(characters), list(actions))
+    requeued = queue.requeue_failed(list(characters), list(actions)) if args.retry_failed else 0
+    skipped = (queue.mark_done_if_exists(list(characters), list(actions))
+               if args.skip_existing else 0)
+
+    counts = queue.counts(list(characters), list(actions), args.num_versions)
+    print(f"\nJob queue {args.jobs_db}: {added} new, {recovered} recovered from interrupted runs, "
+          f"{missing} done but missing on disk, {requeued} failed re-queued, {skipped} skipped (exist)")
+    print(f"  pending={counts['pending']} in_flight={counts['in_flight']} "
+          f"done={counts['done']} failed={counts['failed']}")
+    if counts["failed"] and not args.retry_failed:
+        print("  (use --retry-failed to re-queue failures)")
+
+    print(f"\nRunning {counts['pending']} jobs on {args.workers} worker(s), "
+          f"min {args.delay:.1f}s between requests")
+
+    pipeline = None
+    if args.pipeline:
+        print(f"Pipeline scoring with: {args.score_with} (queue size {args.pipeline_queue})")
+        pipeline = score_pipeline.ScorePipeline(
+            score_pipeline.ScoreStore(),
+            use_clip=args.score_with in ("both", "clip"),
+            use_gemini=args.score_with in ("both", "gemini"),
+            queue_size=args.pipeline_queue,
+        )
 
-                if args.skip_existing and os.path.exists(filepath):
-                    print(f"    Skipping (exists)")
-                    continue
+    # Generate images
+    limiter = RateLimiter(args.delay)
+    progress = Progress(counts["pending"])
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        workers = [
+            pool.submit(worker_loop, client, queue, references, characters, actions,
+                        args, limiter, progress, pipeline)
+            for _ in range(max(1, args.workers))
+        ]
+        for worker in workers:
+            worker.result()
 
-                # Generate
-                image = generate_image(
-                    client,
-                    full_prompt,
-                    reference_image=ref_image,
-                    model_id=args.model_id,
-                )
+    if dedup_index:
+        dedup_index.save()
 
-                if image:
-                    image.save(filepath)
-                    print(f"    Saved: {filepath}")
-                else:
-                    print(f"    FAILED")
+    if pipeline:
+        print("\nGeneration finished; waiting for scoring to drain...")
+        pipeline.close()
+        print(f"Scored {pipeline.scored} images")
 
-                time.sleep(args.delay)
+    elapsed = time.monotonic() - progress.start
+    print(f"\nGenerated {progress.done - len(progress.failed)}/{progress.done} images in {elapsed:.0f}s")
+    if progress.failed:
+        print(f"Failed ({len(progress.failed)}): {', '.join(sorted(progress.failed))}")
+        print("Re-run with --retry-failed to try them again.")
 
     print(f"\n{'='*60}")
     print(f"Generation complete!")
     print(f"Output directory: {args.output_dir}")
     print(f"\nNext steps:")
     print(f"  1. Review generated images")
-    print(f"  2. Run: python evaluate_images.py --filter shake_bottle")
-    print(f"  3. Run: python clip_verb_clarity.py --filter shake_bottle")
-    print(f"  4. Run: python select_best_images.py --checklist")
+    if args.pipeline:
+        print(f"  2. Run: python select_best_images.py --checklist")
+    else:
+        print(f"  2. Run: python evaluate_images.py --filter shake_bottle")
+        print(f"  3. Run: python clip_verb_clarity.py --filter shake_bottle")
+        print(f"  4. Run: python select_best_images.py --checklist")
+        print(f"  (or generate with --pipeline to score images as they are produced)")
+    print(f"\nAPI usage for this run: python api_ledger.py report --last 1")
 
 
 if __name__ == "__main__":
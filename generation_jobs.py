@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Generation Job Queue
+
+Persistent job table for generate_new_verbs.py. One row per output image
+(output directory × character × action × version) with a status of pending,
+in_flight, done or failed, plus attempt counts, the model used and the last
+error. A queue is bound to one output directory, so runs into different
+directories never see each other's jobs.
+
+Workers claim jobs inside an immediate SQLite transaction, so any number of
+threads or processes can drain the same queue without double-claiming. Jobs
+left in flight by a killed run are returned to pending on the next start.
+
+Usage:
+    python generation_jobs.py                 # Show job counts and failures
+    python generation_jobs.py --jobs-db other.sqlite
+    python generation_jobs.py --output-dir out/   # Only jobs for one output directory
+"""
+
+import os
+import time
+import socket
+import sqlite3
+import argparse
+import urllib.parse
+
+# Configuration
+JOBS_FILE = "generation_jobs.sqlite"
+
+# An in-flight job older than this is assumed abandoned, even if its
+# worker's process can't be checked (e.g. it ran on another host).
+LEASE_SECONDS = 30 * 60
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+STATUSES = [PENDING, IN_FLIGHT, DONE, FAILED]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    output_dir TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    character TEXT NOT NULL,
+    action TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    model_id TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    claimed_at REAL,
+    finished_at REAL,
+    last_error TEXT,
+    PRIMARY KEY (output_dir, filename)
+)
+"""
+
+# Queues written before jobs were keyed by output directory have no
+# output_dir column. Their rows are migrated with this placeholder and
+# adopted by the first output directory that is seeded.
+LEGACY_DIR = ""
+LEGACY_COLUMNS = ("filename, character, action, version, status, attempts, "
+                  "claimed_by, claimed_at, finished_at, last_error")
+
+
+def worker_id():
+    """Identify the claiming process as host:pid."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def pid_alive(pid):
+    """Return True if a process with this pid exists on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def is_abandoned(claimed_by, claimed_at, now=None, lease_seconds=LEASE_SECONDS):
+    """True if an in-flight claim's worker is gone or its lease has expired."""
+    now = time.time() if now is None else now
+    claim_host, _, pid = (claimed_by or "").rpartition(":")
+    if claim_host == socket.gethostname() and pid.isdigit() and not pid_alive(int(pid)):
+        return True
+    return claimed_at is None or now - claimed_at > lease_seconds
+
+
+class JobQueue:
+    """SQLite-backed queue of image generation jobs for one output directory.
+
+    Every method opens its own short-lived connection, so a single JobQueue
+    can be shared by worker threads. Without an output_dir (the status
+    report), reads cover every directory in the table. A readonly queue
+    never creates, migrates or writes the file (see would_run).
+    """
+
+    def __init__(self, db_file=JOBS_FILE, output_dir=None, readonly=False):
+        self.db_file = db_file
+        self.output_dir = os.path.realpath(output_dir) if output_dir else None
+        self.readonly = readonly
+        if readonly:
+            return
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if columns and "output_dir" not in columns:
+            conn.execute("ALTER TABLE jobs RENAME TO jobs_legacy")
+            conn.execute(SCHEMA)
+            conn.execute(f"INSERT INTO jobs (output_dir, {LEGACY_COLUMNS}) "
+                         f"SELECT ?, {LEGACY_COLUMNS} FROM jobs_legacy", (LEGACY_DIR,))
+            conn.execute("DROP TABLE jobs_legacy")
+        else:
+            conn.execute(SCHEMA)
+        conn.execute("COMMIT")
+        conn.close()
+
+    def _connect(self):
+        # Autocommit mode; transactions are opened explicitly where needed.
+        if self.readonly:
+            uri = f"file:{urllib.parse.quote(os.path.abspath(self.db_file))}?mode=ro"
+            return sqlite3.connect(uri, uri=True, timeout=60, isolation_level=None)
+        return sqlite3.connect(self.db_file, timeout=60, isolation_level=None)
+
+    def _path(self, filename):
+        return os.path.join(self.output_dir, filename)
+
+    def _adopt_legacy(self, conn):
+        conn.execute("UPDATE OR IGNORE jobs SET output_dir = ? WHERE output_dir = ?",
+                     (self.output_dir, LEGACY_DIR))
+
+    def seed(self, jobs):
+        """Add jobs that aren't in the table yet. Existing rows keep their status."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        self._adopt_legacy(conn)
+        before = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        conn.executemany(
+            "INSERT OR IGNORE INTO jobs (output_dir, filename, character, action, version) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(self.output_dir, j["filename"], j["character"], j["action"], j["version"]) for j in jobs]
+        )
+        after = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        conn.execute("COMMIT")
+        conn.close()
+        return after - before
+
+    def reset(self, characters=None, actions=None):
+        """Forget every job (optionally filtered) so the next seed starts them afresh."""
+        where, params = self._filter(characters, actions)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        self._adopt_legacy(conn)
+        cur = conn.execute(f"DELETE FROM jobs WHERE 1 = 1{where}", params)
+        conn.execute("COMMIT")
+        conn.close()
+        return cur.rowcount
+
+    def requeue_missing(self, characters=None, actions=None):
+        """Move done jobs whose output file has since been deleted back to pending."""
+        where, params = self._filter(characters, actions)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        done = [row[0] for row in conn.execute(
+            f"SELECT filename FROM jobs WHERE status = ?{where}", [DONE] + params)]
+        missing = [f for f in done if not os.path.exists(self._path(f))]
+        conn.executemany(
+            "UPDATE jobs SET status = ?, finished_at = NULL WHERE output_dir = ? AND filename = ?",
+            [(PENDING, self.output_dir, f) for f in missing]
+        )
+        conn.execute("COMMIT")
+        conn.close()
+        return len(missing)
+
+    def requeue_abandoned(self, lease_seconds=LEASE_SECONDS):
+        """Return in-flight jobs whose worker is gone (or whose lease expired) to pending."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            "SELECT rowid, claimed_by, claimed_at FROM jobs WHERE status = ?", (IN_FLIGHT,)
+        ).fetchall()
+
+        abandoned = [rowid for rowid, claimed_by, claimed_at in rows
+                     if is_abandoned(claimed_by, claimed_at, now, lease_seconds)]
+
+        conn.executemany(
+            "UPDATE jobs SET status = ?, claimed_by = NULL, claimed_at = NULL WHERE rowid = ?",
+            [(PENDING, rowid) for rowid in abandoned]
+        )
+        conn.execute("COMMIT")
+        conn.close()
+        return len(abandoned)
+
+    def requeue_failed(self, characters=None, actions=None):
+        """Move failed jobs (optionally filtered) back to pending."""
+        where, params = self._filter(characters, actions)
+        conn = self._connect()
+        cur = conn.execute(
+            f"UPDATE jobs SET status = ?, last_error = NULL WHERE status = ?{where}",
+            [PENDING, FAILED] + params
+        )
+        conn.close()
+        return cur.rowcount
+
+    def mark_done_if_exists(self, characters=None, actions=None):
+        """Mark pending jobs done when their output file is already on disk."""
+        where, params = self._filter(characters, actions)
+        conn = self._connect()
+        pending = [row[0] for row in conn.execute(
+            f"SELECT filename FROM jobs WHERE status = ?{where}", [PENDING] + params)]
+        existing = [f for f in pending if os.path.exists(self._path(f))]
+        conn.executemany(
+            "UPDATE jobs SET status = ?, finished_at = ? WHERE output_dir = ? AND filename = ? AND status = ?",
+            [(DONE, time.time(), self.output_dir, f, PENDING) for f in existing]
+        )
+        conn.close()
+        return len(existing)
+
+    def would_run(self, jobs, retry_failed=False, skip_existing=False):
+        """The jobs a run would execute, judged from the table as it stands.
+
+        Applies what seed, requeue_abandoned, requeue_missing, requeue_failed
+        and mark_done_if_exists would do, without writing anything.
+        """
+        rows = self._job_states()
+        now = time.time()
+        planned = []
+        for job in jobs:
+            status, claimed_by, claimed_at = rows.get(job["filename"], (PENDING, None, None))
+            exists = os.path.exists(self._path(job["filename"]))
+            if status == IN_FLIGHT and is_abandoned(claimed_by, claimed_at, now):
+                status = PENDING
+            elif status == DONE and not exists:
+                status = PENDING
+            elif status == FAILED and retry_failed:
+                status = PENDING
+            if status == PENDING and not (skip_existing and exists):
+                planned.append(job)
+        return planned
+
+    def _job_states(self):
+        """{filename: (status, claimed_by, claimed_at)} for this directory,
+        counting legacy rows that seed would adopt."""
+        if not os.path.exists(self.db_file):
+            return {}
+        conn = self._connect()
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if not columns:
+            rows = []
+        elif "output_dir" in columns:
+            rows = conn.execute(
+                "SELECT output_dir, filename, status, claimed_by, claimed_at FROM jobs "
+                "WHERE output_dir IN (?, ?)", (self.output_dir, LEGACY_DIR)).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT ?, filename, status, claimed_by, claimed_at FROM jobs", (LEGACY_DIR,)).fetchall()
+        conn.close()
+        # This directory's own rows win over legacy ones (seed adopts with OR IGNORE).
+        rows.sort(key=lambda row: row[0] != LEGACY_DIR)
+        return {filename: state for _, filename, *state in rows}
+
+    def claim(self, characters=None, actions=None, max_version=None, model_id=None):
+        """Atomically take the next pending job, or return None when the queue is drained."""
+        where, params = self._filter(characters, actions)
+        if max_version:
+            where += " AND version <= ?"
+            params.append(max_version)
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            f"SELECT filename, character, action, version, attempts FROM jobs "
+            f"WHERE status = ?{where} ORDER BY character, action, version LIMIT 1",
+            [PENDING] + params
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, claimed_by = ?, claimed_at = ?, "
+                "model_id = ? WHERE output_dir = ? AND filename = ?",
+                (IN_FLIGHT, worker_id(), time.time(), model_id, self.output_dir, row[0])
+            )
+        conn.execute("COMMIT")
+        conn.close()
+
+        if not row:
+            return None
+        return {
+            "filename": row[0],
+            "character": row[1],
+            "action": row[2],
+            "version": row[3],
+            "attempts": row[4] + 1,
+        }
+
+    def complete(self, filename):
+        self._finish(filename, DONE, None)
+
+    def fail(self, filename, error=""):
+        self._finish(filename, FAILED, error)
+
+    def _finish(self, filename, status, error):
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET status = ?, last_error = ?, finished_at = ?, "
+            "claimed_by = NULL, claimed_at = NULL WHERE output_dir = ? AND filename = ?",
+            (status, error, time.time(), self.output_dir, filename)
+        )
+        conn.close()
+
+    def counts(self, characters=None, actions=None, max_version=None):
+        """Return {status: count}, including zero counts."""
+        where, params = self._filter(characters, actions)
+        if max_version:
+            where += " AND version <= ?"
+            params.append(max_version)
+        conn = self._connect()
+        rows = conn.execute(
+            f"SELECT status, COUNT(*) FROM jobs WHERE 1 = 1{where} GROUP BY status", params
+        ).fetchall()
+        conn.close()
+        counts = {status: 0 for status in STATUSES}
+        counts.update(dict(rows))
+        return counts
+
+    def failures(self):
+        """List (path, attempts, last_error) for failed jobs."""
+        where, params = self._filter(None, None)
+        conn = self._connect()
+        rows = conn.execute(
+            f"SELECT output_dir, filename, attempts, last_error FROM jobs WHERE status = ?{where} "
+            f"ORDER BY output_dir, filename",
+            [FAILED] + params
+        ).fetchall()
+        rows = [(os.path.join(d, f) if d else f, attempts, error) for d, f, attempts, error in rows]
+        conn.close()
+        return rows
+
+    def _filter(self, characters, actions):
+        where, params = "", []
+        if self.output_dir:
+            where += " AND output_dir = ?"
+            params.append(self.output_dir)
+        if characters:
+            where += f" AND character IN ({', '.join('?' * len(characters))})"
+            params.extend(characters)
+        if actions:
+            where += f" AND action IN ({', '.join('?' * len(actions))})"
+            params.extend(actions)
+        return where, params
+
+
+def print_status(queue):
+    """Print job counts by status and the list of failures."""
+    counts = queue.counts()
+    total = sum(counts.values())
+
+    print("\n" + "=" * 60)
+    print("GENERATION JOB QUEUE")
+    print("=" * 60)
+    print(f"\n  Total jobs: {total}")
+    for status in STATUSES:
+        print(f"  {status:<10} {counts[status]}")
+
+    failures = queue.failures()
+    if failures:
+        print(f"\n  Failed jobs (re-queue with generate_new_verbs.py --retry-failed):")
+        for path, attempts, error in failures:
+            print(f"    {path:<35} attempts={attempts}  {error or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the generation job queue")
+    parser.add_argument("--jobs-db", default=JOBS_FILE, help="Job queue SQLite file")
+    parser.add_argument("--output-dir", help="Only jobs for this output directory")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.jobs_db):
+        print(f"No job queue at {args.jobs_db}")
+        return
+
+    print_status(JobQueue(args.jobs_db, args.output_dir))
+
+
+if __name__ == "__main__":
+    main()
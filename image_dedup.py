@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Perceptual-Hash Deduplication
+
+Finds near-identical versions of the same character/action combo so they
+aren't saved, uploaded to Gemini or run through CLIP more than once.
+
+Each image gets a difference hash (dHash) of its grayscale thumbnail. Hashes
+are cached in image_hashes.json by absolute path (re-hashed only when a
+file's size or mtime changes), and near neighbours are found by Hamming
+distance in a BK-tree. Only versions in the same directory are compared.
+
+The line drawings are mostly white, so an 8x8 dHash is too coarse: distinct
+combos can land within 4 bits of each other. At 16x16 (256 bits) no two
+different combos in chunk_includes are closer than ~22 bits, while a copy
+shifted by a few pixels or rotated by a degree lands around 12. The default
+threshold of 12 sits between the two.
+
+Usage:
+    python image_dedup.py                       # List near-duplicate versions
+    python image_dedup.py --distance 6          # Stricter threshold
+    python image_dedup.py --filter chef_read
+"""
+
+import os
+import json
+import glob
+import argparse
+import threading
+
+from PIL import Image
+
+# Configuration
+IMAGE_DIR = "experiments/conceptual-task/chunk_includes"
+HASH_FILE = "image_hashes.json"
+HASH_SIZE = 16
+MAX_DISTANCE = 12
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """Difference hash of a PIL image or image path, as an int of hash_size² bits."""
+    if not isinstance(image, Image.Image):
+        with Image.open(image) as img:
+            return dhash(img, hash_size)
+
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def combo_of(filename):
+    """'chef_read_book_v2.png' -> 'chef_read_book'."""
+    return os.path.basename(filename).rsplit("_v", 1)[0]
+
+
+def same_combo(a, b):
+    """True if two image paths are versions of one combo in one directory."""
+    return os.path.dirname(a) == os.path.dirname(b) and combo_of(a) == combo_of(b)
+
+
+def version_of(filename):
+    """'chef_read_book_v2.png' -> 2 (0 if unversioned)."""
+    version = os.path.basename(filename).replace(".png", "").rsplit("_v", 1)[-1]
+    return int(version) if version.isdigit() else 0
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes with Hamming distance.
+
+    Lookups within distance d only descend into children whose edge distance
+    is within d of the query's distance to the node (triangle inequality).
+    """
+
+    def __init__(self):
+        self.root = None   # [hash, items, {distance: child}]
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Return [(distance, item)] for every item within max_distance, nearest first."""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= max_distance:
+                found.extend((d, item) for item in node[1])
+            for edge, child in node[2].items():
+                if d - max_distance <= edge <= d + max_distance:
+                    stack.append(child)
+        return sorted(found, key=lambda x: x[0])
+
+
+class HashIndex:
+    """Persistent absolute path -> dHash index with BK-tree lookup. Safe to share between threads."""
+
+    def __init__(self, hash_file=HASH_FILE, hash_size=HASH_SIZE):
+        self.hash_file = hash_file
+        self.hash_size = hash_size
+        self.entries = {}
+        self.tree = BKTree()
+        self._lock = threading.Lock()
+
+        if os.path.exists(hash_file):
+            with open(hash_file, 'r') as f:
+                data = json.load(f)
+            if data.get("hash_size") == hash_size:
+                # Older caches were keyed by bare filename; those entries are re-hashed.
+                # Files deleted since the last run are dropped, so they can't block new versions.
+                self.entries = {path: entry for path, entry in data.get("images", {}).items()
+                                if os.path.isabs(path) and os.path.exists(path)}
+        for path, entry in self.entries.items():
+            self.tree.add(int(entry["hash"], 16), path)
+
+    def save(self):
+        with self._lock:
+            data = {"hash_size": self.hash_size, "images": dict(self.entries)}
+        temp_path = self.hash_file + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, self.hash_file)
+
+    def hash_file_path(self, filepath):
+        """Hash of an image on disk, reusing the cached value if the file is unchanged."""
+        path = os.path.abspath(filepath)
+        stat = os.stat(path)
+        with self._lock:
+            entry = self.entries.get(path)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                return int(entry["hash"], 16)
+
+        value = dhash(path, self.hash_size)
+        with self._lock:
+            self._store(path, value, stat.st_size, stat.st_mtime)
+        return value
+
+    def refresh(self, filepaths):
+        """Make sure every file in filepaths is hashed and indexed."""
+        for filepath in filepaths:
+            self.hash_file_path(filepath)
+
+    def nearest_in_combo(self, filepath, value, max_distance=MAX_DISTANCE):
+        """Closest other version of the same combo within max_distance, or None."""
+        path = os.path.abspath(filepath)
+        with self._lock:
+            return self._nearest(path, value, max_distance)
+
+    def add_unless_duplicate(self, filepath, image, max_distance=MAX_DISTANCE):
+        """Hash a new PIL image; index it unless it near-duplicates an existing version.
+
+        Returns (duplicate_of, distance), or None if the image was added. The
+        check and insert happen under one lock, so two workers can't both
+        accept the same near-identical picture. If the image then can't be
+        saved, call discard() so the entry doesn't outlive it.
+        """
+        value = dhash(image, self.hash_size)
+        path = os.path.abspath(filepath)
+        with self._lock:
+            match = self._nearest(path, value, max_distance)
+            if match is None:
+                self._store(path, value, None, None)
+        return match
+
+    def discard(self, filepath):
+        """Drop an entry added for an image that was never saved.
+
+        If an older file is still at that path, it is hashed again.
+        """
+        path = os.path.abspath(filepath)
+        with self._lock:
+            if self.entries.pop(path, None) is not None:
+                self._rebuild()
+        if os.path.exists(path):
+            self.hash_file_path(path)
+
+    def _nearest(self, path, value, max_distance):
+        # Entries with no size are images still being saved by another worker;
+        # any other entry whose file has since been deleted is dropped.
+        stale = []
+        match = None
+        for d, other in self.tree.search(value, max_distance):
+            if other == path or not same_combo(other, path):
+                continue
+            if self.entries[other]["size"] is not None and not os.path.exists(other):
+                stale.append(other)
+                continue
+            match = (other, d)
+            break
+        if stale:
+            for other in stale:
+                del self.entries[other]
+            self._rebuild()
+        return match
+
+    def _store(self, path, value, size, mtime):
+        previous = self.entries.get(path)
+        self.entries[path] = {"hash": f"{value:x}", "size": size, "mtime": mtime}
+        if previous is None:
+            self.tree.add(value, path)
+        elif int(previous["hash"], 16) != value:
+            self._rebuild()
+
+    def _rebuild(self):
+        # A BK-tree can't delete, so rebuild when an entry changes or goes away.
+        self.tree = BKTree()
+        for path, entry in self.entries.items():
+            self.tree.add(int(entry["hash"], 16), path)
+
+
+def find_duplicates(filepaths, max_distance=MAX_DISTANCE, index=None):
+    """Map each near-duplicate file to the earlier version it duplicates.
+
+    Versions are visited in order, so v1 is always kept and a later version
+    is only flagged if it is close to a version that was itself kept.
+    """
+    index = index or HashIndex()
+    index.refresh(filepaths)
+
+    kept = {}          # (directory, combo) -> [(hash, filepath)]
+    duplicates = {}
+    for filepath in sorted(filepaths, key=lambda f: (combo_of(f), version_of(f))):
+        value = index.hash_file_path(filepath)
+        combo = (os.path.dirname(os.path.abspath(filepath)), combo_of(filepath))
+        match = None
+        for other_value, other in kept.get(combo, []):
+            if hamming(value, other_value) <= max_distance:
+                match = other
+                break
+        if match:
+            duplicates[filepath] = match
+        else:
+            kept.setdefault(combo, []).append((value, filepath))
+
+    index.save()
+    return duplicates
+
+
+def drop_duplicates(filepaths, max_distance=MAX_DISTANCE):
+    """Filter a list of image paths down to one representative per near-duplicate group."""
+    duplicates = find_duplicates(filepaths, max_distance)
+    for dup, original in sorted(duplicates.items()):
+        print(f"  Skipping near-duplicate {os.path.basename(dup)} (of {os.path.basename(original)})")
+    return [f for f in filepaths if f not in duplicates]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find near-duplicate image versions by perceptual hash")
+    parser.add_argument("--image-dir", default=IMAGE_DIR, help="Directory containing images")
+    parser.add_argument("--distance", type=int, default=MAX_DISTANCE,
+                        help=f"Max Hamming distance (of {HASH_SIZE * HASH_SIZE} bits) for a duplicate")
+    parser.add_argument("--filter", type=str, help="Only check images matching this pattern")
+    args = parser.parse_args()
+
+    images = [f for f in glob.glob(os.path.join(args.image_dir, "*.png"))
+              if "_v" in os.path.basename(f) and "base" not in f.lower()]
+    if args.filter:
+        images = [f for f in images if args.filter in os.path.basename(f)]
+
+    print(f"Hashing {len(images)} images...")
+    index = HashIndex()
+    duplicates = find_duplicates(images, args.distance, index)
+
+    print("\n" + "=" * 70)
+    print(f"NEAR-DUPLICATE VERSIONS (distance <= {args.distance})")
+    print("=" * 70)
+
+    if not duplicates:
+        print("No near-duplicates found.")
+        return
+
+    for dup, original in sorted(duplicates.items()):
+        d = hamming(index.hash_file_path(dup), index.hash_file_path(original))
+        print(f"  {os.path.basename(dup):<35} ~ {os.path.basename(original):<35} (distance {d})")
+
+    saved = sum(os.path.getsize(f) for f in duplicates)
+    print(f"\n{len(duplicates)} duplicates, {saved / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
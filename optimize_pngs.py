@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+PNG Optimization for Line-Art Stimuli
+
+The stimuli are black-on-white line drawings saved as 24-bit RGB PNGs
+(0.5-1 MB each), and every participant downloads them during preload. This
+re-encodes each image as a 1-, 2- or 4-bit grayscale palette PNG (or an
+adaptive 8-bit palette for images with real colour) at maximum zlib effort.
+
+Candidates are tried from fewest colours up, and the first one whose decoded
+pixels stay within tolerance of the original is kept, so pure bilevel art
+ends up 1-bit while anti-aliased edges keep enough gray levels. A file is
+only replaced when the result is smaller.
+
+Also applied on save by generate_new_verbs.py (disable with --no-optimize-png).
+
+Usage:
+    python optimize_pngs.py                          # conceptual-task stimuli
+    python optimize_pngs.py experiments/morphosyntax/chunk_includes experiments/morphophonology/chunk_includes
+    python optimize_pngs.py --dry-run                # Report savings without writing
+    python optimize_pngs.py --max-error 48           # Allow coarser gray levels
+"""
+
+import io
+import os
+import glob
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageChops, ImageStat
+
+# Configuration
+IMAGE_DIR = "experiments/conceptual-task/chunk_includes"
+
+# Gray levels tried in order, with the PNG bit depth each one is stored at.
+GRAY_LEVELS = [(2, 1), (4, 2), (8, 4), (16, 4)]
+PALETTE_COLORS = 256
+
+# Tolerance against the original, in 0-255 units per channel. The generated
+# art has faint colour fringes of up to ~17, which a gray palette can't keep,
+# so the per-pixel bound is looser than the quantization step alone needs.
+MAX_PIXEL_ERROR = 24
+MAX_MEAN_ERROR = 1.5
+
+SAVE_OPTIONS = {"format": "PNG", "optimize": True, "compress_level": 9}
+
+
+def gray_palette_image(gray, levels):
+    """Quantize an L image to evenly spaced gray levels, as a P image."""
+    lut = [round(v * (levels - 1) / 255) for v in range(256)]
+    indexed = Image.frombytes("P", gray.size, gray.point(lut).tobytes())
+    palette = []
+    for i in range(levels):
+        v = round(i * 255 / (levels - 1))
+        palette += [v, v, v]
+    indexed.putpalette(palette)
+    return indexed
+
+
+def encode(image, bits=None):
+    buffer = io.BytesIO()
+    options = dict(SAVE_OPTIONS, bits=bits) if bits else SAVE_OPTIONS
+    image.save(buffer, **options)
+    return buffer.getvalue()
+
+
+def pixel_error(original, data):
+    """(max, mean) per-channel difference between an RGB image and encoded PNG bytes."""
+    decoded = Image.open(io.BytesIO(data)).convert("RGB")
+    diff = ImageChops.difference(original, decoded)
+    max_error = max(high for _, high in diff.getextrema())
+    mean_error = max(ImageStat.Stat(diff).mean)
+    return max_error, mean_error
+
+
+def optimize_image(image, max_error=MAX_PIXEL_ERROR, max_mean=MAX_MEAN_ERROR):
+    """Smallest-palette encoding of a PIL image that stays within tolerance.
+
+    Returns (png_bytes, description). Images with transparency, or where no
+    candidate passes, are just re-encoded at maximum compression.
+    """
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        return encode(image), "unchanged (has alpha)"
+
+    rgb = image.convert("RGB")
+    gray = rgb.convert("L")
+
+    for levels, bits in GRAY_LEVELS:
+        data = encode(gray_palette_image(gray, levels), bits)
+        worst, mean = pixel_error(rgb, data)
+        if worst <= max_error and mean <= max_mean:
+            return data, f"{bits}-bit gray ({levels} levels, max error {worst})"
+
+    data = encode(rgb.quantize(PALETTE_COLORS, dither=Image.Dither.NONE))
+    worst, mean = pixel_error(rgb, data)
+    if worst <= max_error and mean <= max_mean:
+        return data, f"8-bit palette (max error {worst})"
+
+    return encode(image), "recompressed (no palette within tolerance)"
+
+
+# Read once at import (os.umask can only be read by setting it).
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def replacement_mode(filepath):
+    """Permission bits for a file about to replace filepath.
+
+    mkstemp creates temp files as 0600; renamed into place as-is they would
+    lock the web server out of the stimuli. Existing files keep their mode,
+    new ones get the usual 0666 & ~umask.
+    """
+    try:
+        return os.stat(filepath).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def write_atomic(data, filepath):
+    """Replace filepath with data via a temp file in the same directory."""
+    directory = os.path.dirname(filepath) or "."
+    fd, temp_path = tempfile.mkstemp(suffix=".png.tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(temp_path, replacement_mode(filepath))
+        os.replace(temp_path, filepath)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def optimize_file(filepath, max_error=MAX_PIXEL_ERROR, max_mean=MAX_MEAN_ERROR, dry_run=False):
+    """Optimize one PNG in place if that makes it smaller. Returns a result dict."""
+    before = os.path.getsize(filepath)
+    try:
+        with Image.open(filepath) as img:
+            img.load()
+            data, description = optimize_image(img, max_error, max_mean)
+    except Exception as e:
+        return {"file": filepath, "before": before, "after": before, "note": f"error: {e}"}
+
+    if len(data) >= before:
+        return {"file": filepath, "before": before, "after": before, "note": "already optimal"}
+    if not dry_run:
+        write_atomic(data, filepath)
+    return {"file": filepath, "before": before, "after": len(data), "note": description}
+
+
+def collect_pngs(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.png"))))
+        elif path.endswith(".png"):
+            files.append(path)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shrink line-art PNGs to small-palette PNGs")
+    parser.add_argument("paths", nargs="*", default=[IMAGE_DIR], help="Directories or PNG files")
+    parser.add_argument("--max-error", type=int, default=MAX_PIXEL_ERROR,
+                        help="Max per-channel pixel difference (0-255) from the original")
+    parser.add_argument("--max-mean-error", type=float, default=MAX_MEAN_ERROR,
+                        help="Max mean per-channel difference from the original")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Parallel processes")
+    parser.add_argument("--dry-run", action="store_true", help="Report savings without writing")
+    args = parser.parse_args()
+
+    files = collect_pngs(args.paths)
+    if not files:
+        print("No PNG files found.")
+        return
+
+    print(f"Optimizing {len(files)} PNGs on {args.workers} processes"
+          f"{' (dry run)' if args.dry_run else ''}...")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(optimize_file, f, args.max_error, args.max_mean_error, args.dry_run)
+                   for f in files]
+        for future in futures:
+            r = future.result()
+            results.append(r)
+            print(f"  {os.path.basename(r['file']):<35} {r['before'] / 1024:>8.0f} KB -> "
+                  f"{r['after'] / 1024:>6.0f} KB  {r['note']}")
+
+    before = sum(r["before"] for r in results)
+    after = sum(r["after"] for r in results)
+    changed = sum(1 for r in results if r["after"] < r["before"])
+    print(f"\n{changed}/{len(results)} files {'would shrink' if args.dry_run else 'shrunk'}: "
+          f"{before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB "
+          f"(saved {(before - after) / 1024 / 1024:.1f} MB, {1 - after / before:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Streaming Generate → Score Pipeline
+
+Scores each newly generated image as soon as it lands, instead of waiting
+for the whole batch and then running evaluate_images.py and
+clip_verb_clarity.py by hand.
+
+Each image is pushed through bounded queues to a CLIP stage and a Gemini
+stage. When a queue is full, submit() blocks, so generation can never run
+arbitrarily far ahead of scoring (backpressure). Results are written to the
+same JSON files the batch evaluators use, and the combined score for the
+image's combo is printed as soon as every enabled stage has reported.
+
+Used by generate_new_verbs.py --pipeline. The scorers and ScoreStore are
+also used on their own by --adaptive, which scores one version at a time.
+"""
+
+import os
+import time
+import queue
+import threading
+
+import evaluate_images
+import select_best_images
+
+# Default files (same as the batch evaluators)
+GEMINI_FILE = evaluate_images.OUTPUT_FILE
+CLIP_FILE = "clip_verb_scores.json"
+
+# Maximum images waiting in each stage's queue before submit() blocks
+QUEUE_SIZE = 4
+
+# Seconds between Gemini evaluation calls (as evaluate_images.py --delay)
+GEMINI_DELAY = 3.0
+
+_STOP = object()
+
+
+class ClipScorer:
+    """CLIP verb clarity for single images. The model is loaded on first use."""
+
+    def __init__(self):
+        self._model = None
+        # One model instance is shared by every caller; scoring is fast
+        # enough that serializing it costs nothing next to generation.
+        self._lock = threading.Lock()
+
+    def score(self, filepath):
+        # Imported lazily: torch/CLIP are only needed when CLIP scoring is enabled.
+        import clip_verb_clarity
+        with self._lock:
+            if self._model is None:
+                self.device = clip_verb_clarity.get_device()
+                self._model, self.preprocess = clip_verb_clarity.load_clip_model(self.device)
+            return clip_verb_clarity.evaluate_file(self._model, self.preprocess, self.device, filepath)
+
+
+class GeminiScorer:
+    """Gemini temporal neutrality scores for single images.
+
+    With a limiter (anything with a wait() method, such as
+    generate_new_verbs.RateLimiter), calls are spaced by the limiter, which
+    can be shared by every thread and scorer that evaluates; otherwise the
+    scorer sleeps `delay` seconds after each call.
+    """
+
+    def __init__(self, delay=GEMINI_DELAY, limiter=None):
+        self.client = evaluate_images.get_client()
+        if not self.client:
+            raise RuntimeError("No Gemini client available for scoring")
+        self.delay = delay
+        self.limiter = limiter
+
+    def score(self, filepath):
+        if self.limiter:
+            self.limiter.wait()
+            return evaluate_images.evaluate_image(self.client, filepath)
+        result = evaluate_images.evaluate_image(self.client, filepath)
+        # Same spacing as evaluate_images.py, to stay under the rate limit.
+        time.sleep(self.delay)
+        return result
+
+
+class ScoreStore:
+    """In-memory copies of both evaluation JSON files, saved after every update."""
+
+    def __init__(self, gemini_file=GEMINI_FILE, clip_file=CLIP_FILE, weights=None):
+        self.gemini_file = gemini_file
+        self.clip_file = clip_file
+        self.weights = weights or dict(select_best_images.DEFAULT_WEIGHTS)
+        self.gemini = evaluate_images.load_existing_results(gemini_file)
+        self.clip = self._load_clip(clip_file)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_clip(clip_file):
+        if os.path.exists(clip_file):
+            return select_best_images.load_json(clip_file)
+        return {"evaluations": {}, "rankings": {}}
+
+    def add_gemini(self, filepath, result):
+        with self._lock:
+            self.gemini["evaluations"][filepath] = result
+            self.gemini["best_picks"] = evaluate_images.select_best_versions(self.gemini)
+            evaluate_images.save_results(self.gemini, self.gemini_file)
+
+    def add_clip(self, filepath, entry):
+        # Imported lazily for the same reason as in ClipScorer.
+        import clip_verb_clarity
+        with self._lock:
+            self.clip["evaluations"][filepath] = entry
+            self.clip["rankings"] = clip_verb_clarity.compute_rankings(self.clip)
+            clip_verb_clarity.save_results(self.clip, self.clip_file)
+
+    def has_gemini(self, filepath):
+        with self._lock:
+            return self.gemini["evaluations"].get(filepath) is not None
+
+    def has_clip(self, filepath):
+        with self._lock:
+            return self.clip["evaluations"].get(filepath) is not None
+
+    def combo_ranking(self, filepath):
+        """Combined ranking entry for the combo this image belongs to."""
+        info = select_best_images.parse_filename(os.path.basename(filepath))
+        if not info:
+            return None
+        prefix = f"{info['combo']}_v"
+
+        def subset(data):
+            evaluations = {path: e for path, e in data.get("evaluations", {}).items()
+                           if os.path.basename(path).startswith(prefix)}
+            return {"evaluations": evaluations}
+
+        with self._lock:
+            rankings = select_best_images.combine_evaluations(
+                subset(self.gemini), subset(self.clip), self.weights)
+        return rankings.get(info["combo"])
+
+    def combined_score(self, filepath):
+        """Combined score of this particular image (None if not scored yet)."""
+        ranking = self.combo_ranking(filepath)
+        if not ranking:
+            return None
+        filename = os.path.basename(filepath)
+        for version in ranking["all_versions"]:
+            if version["filename"] == filename:
+                return version["combined_score"]
+        return None
+
+
+class ScorePipeline:
+    """Bounded-queue CLIP and Gemini stages fed by submit(filepath)."""
+
+    def __init__(self, store, use_clip=True, use_gemini=True, queue_size=QUEUE_SIZE, gemini_delay=GEMINI_DELAY):
+        self.store = store
+        self.stages = {}
+        if use_clip:
+            self.stages["clip"] = (ClipScorer(), store.add_clip)
+        if use_gemini:
+            self.stages["gemini"] = (GeminiScorer(gemini_delay), store.add_gemini)
+        if not self.stages:
+            raise ValueError("ScorePipeline needs at least one scoring stage")
+
+        self.queues = {name: queue.Queue(maxsize=queue_size) for name in self.stages}
+        self._pending = {}   # filepath -> set of stages still to report
+        self._lock = threading.Lock()
+        self.scored = 0
+        self.threads = [
+            threading.Thread(target=self._run_stage, args=(name,), name=f"score-{name}", daemon=True)
+            for name in self.stages
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, filepath):
+        """Queue a freshly saved image for every stage. Blocks while a stage is backed up."""
+        with self._lock:
+            self._pending[filepath] = set(self.stages)
+        for q in self.queues.values():
+            q.put(filepath)
+
+    def close(self):
+        """Wait for all queued images to be scored, then stop the stage threads."""
+        for q in self.queues.values():
+            q.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+
+    def _run_stage(self, name):
+        scorer, store_result = self.stages[name]
+        q = self.queues[name]
+        while True:
+            filepath = q.get()
+            if filepath is _STOP:
+                return
+            # Any failure is reported and the image marked done for this stage;
+            # a dead stage thread would leave submit() blocked on a full queue.
+            try:
+                result = scorer.score(filepath)
+                if result is not None:
+                    store_result(filepath, result)
+            except Exception as e:
+                print(f"    [{os.path.basename(filepath)}] {name} scoring error: {e}")
+            finally:
+                self._stage_done(filepath, name)
+
+    def _stage_done(self, filepath, name):
+        with self._lock:
+            remaining = self._pending.get(filepath)
+            if remaining is None:
+                return
+            remaining.discard(name)
+            if remaining:
+                return
+            del self._pending[filepath]
+            self.scored += 1
+        try:
+            self._report(filepath)
+        except Exception as e:
+            print(f"  [score] {os.path.basename(filepath)}: report error: {e}")
+
+    def _report(self, filepath):
+        filename = os.path.basename(filepath)
+        ranking = self.store.combo_ranking(filepath)
+        if not ranking:
+            print(f"  [score] {filename}: no scores")
+            return
+        mine = next((v for v in ranking["all_versions"] if v["filename"] == filename), None)
+        if not mine:
+            print(f"  [score] {filename}: scoring failed")
+            return
+        gemini_str = f"{mine['gemini_score']}/35" if mine["gemini_score"] else "N/A"
+        clip_str = f"{mine['clip_clarity']}/100" if mine["clip_clarity"] else "N/A"
+        print(f"  [score] {filename}: combined={mine['combined_score']:.1f} "
+              f"(Gemini={gemini_str}, CLIP={clip_str}); "
+              f"combo best {ranking['best_file']} {ranking['best_combined']:.1f}")
@@ -14,15 +14,22 @@ Use this to:
 
 import os
 import json
+import time
 import shutil
+import hashlib
 import argparse
+import webbrowser
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 # Default files
 GEMINI_FILE = "image_evaluations.json"
 CLIP_FILE = "clip_verb_scores.json"
 IMAGE_DIR = "experiments/conceptual-task/chunk_includes"
 OUTPUT_DIR = "selected_images"
+EXPORT_MANIFEST = ".export_manifest.json"
 
 # Weights for combined scoring (adjust as needed)
 DEFAULT_WEIGHTS = {
@@ -97,117 +104,338 @@ def normalize_path(filepath):
     return os.path.basename(filepath)
 
 
+def _partition(strings, sep, reverse=False):
+    """Vectorized str.partition (or rpartition) as (head, sep, tail) arrays."""
+    if not len(strings):
+        empty = np.array([], dtype=str)
+        return empty, empty, empty
+    parts = (np.char.rpartition if reverse else np.char.partition)(strings, sep)
+    return parts[:, 0], parts[:, 1], parts[:, 2]
+
+
+def build_score_table(gemini_data, clip_data):
+    """Join Gemini and CLIP evaluations into one columnar table keyed by filename.
+
+    Returns a dict of equal-length NumPy arrays, one row per image, sorted by
+    combo then filename. "codes" numbers the combos (0..n-1, indexing
+    "combos") and "starts" holds the first row of each combo, so per-combo
+    reductions can use np.*.reduceat.
+    """
+    def rows(data):
+        return [(path, e) for path, e in (data or {}).get("evaluations", {}).items() if e]
+
+    gemini_rows = rows(gemini_data)
+    clip_rows = rows(clip_data)
+
+    gemini_names = [normalize_path(path) for path, _ in gemini_rows]
+    clip_names = [normalize_path(path) for path, _ in clip_rows]
+    filenames, inverse = np.unique(np.array(gemini_names + clip_names, dtype=str),
+                                   return_inverse=True)
+    gemini_idx = inverse[:len(gemini_rows)]
+    clip_idx = inverse[len(gemini_rows):]
+    n = len(filenames)
+
+    # Vectorized join: scatter each source's columns into the filename rows.
+    table = {
+        "filename": filenames,
+        "filepath": np.full(n, "", dtype=object),
+        "gemini_score": np.zeros(n),
+        "clip_clarity": np.zeros(n),
+        "clip_discriminability": np.zeros(n),
+        "gemini_recommendation": np.full(n, "N/A", dtype=object),
+        "clip_verdict": np.full(n, "N/A", dtype=object),
+        "issues": np.empty(n, dtype=object),
+    }
+    table["issues"][:] = [[] for _ in range(n)]
+
+    if clip_rows:
+        metrics = [e.get("metrics", {}) for _, e in clip_rows]
+        table["filepath"][clip_idx] = [path for path, _ in clip_rows]
+        table["clip_clarity"][clip_idx] = [m.get("clarity_score") or 0 for m in metrics]
+        table["clip_discriminability"][clip_idx] = [m.get("discriminability") or 0 for m in metrics]
+        table["clip_verdict"][clip_idx] = [m.get("verdict", "unknown") for m in metrics]
+    if gemini_rows:
+        # Gemini's path wins when both sources have the file.
+        table["filepath"][gemini_idx] = [path for path, _ in gemini_rows]
+        table["gemini_score"][gemini_idx] = [e.get("total_score") or 0 for _, e in gemini_rows]
+        table["gemini_recommendation"][gemini_idx] = [e.get("recommendation", "unknown")
+                                                      for _, e in gemini_rows]
+        issues = np.empty(len(gemini_rows), dtype=object)
+        issues[:] = [e.get("issues", []) for _, e in gemini_rows]
+        table["issues"][gemini_idx] = issues
+
+    # Vectorized parse_filename: character_verb_object_v#
+    stem = np.char.replace(filenames, ".png", "") if n else filenames
+    prefix, v_sep, version = _partition(stem, "_v", reverse=True)
+    character, c_sep, verb_object = _partition(prefix, "_")
+    valid = (v_sep == "_v") & (c_sep == "_") & (verb_object != "")
+
+    combos = prefix[valid]
+    verbs = _partition(verb_object[valid], "_")[0]
+    unique_verbs, verb_idx = np.unique(verbs, return_inverse=True)
+    verb_types = np.array([get_verb_type(v) for v in unique_verbs], dtype=object)[verb_idx]
+
+    order = np.lexsort((filenames[valid], combos))
+    table = {key: column[valid][order] for key, column in table.items()}
+    table["combo"] = combos[order]
+    table["character"] = character[valid][order]
+    table["version"] = version[valid][order]
+    table["verb"] = verbs[order]
+    table["verb_type"] = verb_types[order]
+
+    table["combos"], table["codes"] = np.unique(table["combo"], return_inverse=True)
+    table["starts"] = np.flatnonzero(np.diff(table["codes"], prepend=-1))
+    return table
+
+
+def round_scores(values, ndigits=1):
+    """Python's round() over an array.
+
+    np.round rounds values * 10**ndigits, which can tip a score like 75.35
+    (stored as 75.3499...) the other way; reports and tie-breaks need the
+    same 0.1 steps the per-file round() always produced.
+    """
+    values = np.asarray(values, dtype=float)
+    return np.array([round(v, ndigits) for v in values.ravel().tolist()]).reshape(values.shape)
+
+
+def combined_scores(table, weights):
+    """Combined 0-100 score for every row, or a (n_weights, n_rows) matrix.
+
+    weights is a {"gemini": w, "clip": w} dict whose values may be scalars or
+    1-D arrays (one entry per weighting), which broadcast over the rows.
+    Images with only one score use that score alone.
+    """
+    gemini = table["gemini_score"]
+    gemini_normalized = gemini / 35 * 100
+    clip = table["clip_clarity"]
+
+    w_gemini = np.asarray(weights["gemini"], dtype=float)[..., None]
+    w_clip = np.asarray(weights["clip"], dtype=float)[..., None]
+    both = w_gemini * gemini_normalized + w_clip * clip
+    single = np.where(gemini != 0, gemini_normalized, clip)
+    scores = np.where((gemini != 0) & (clip != 0), both, single)
+    return round_scores(scores)
+
+
+def group_argmax(table, scores):
+    """Row index of the best version in each combo (ties go to the first filename).
+
+    scores may be one row of scores or a (n_weights, n_rows) matrix, giving
+    a (n_weights, n_combos) result.
+    """
+    starts = table["starts"]
+    if not len(starts):
+        return np.empty(scores.shape[:-1] + (0,), dtype=int)
+    counts = np.diff(np.r_[starts, len(table["codes"])])
+    best = np.maximum.reduceat(scores, starts, axis=-1)
+    positions = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape)
+    is_best = scores == np.repeat(best, counts, axis=-1)
+    return np.minimum.reduceat(np.where(is_best, positions, scores.shape[-1]), starts, axis=-1)
+
+
+def _plain(value):
+    """NumPy float -> int when whole, so scores print like the source JSON ("30/35")."""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def rankings_view(table, scores):
+    """Build the {combo: {best_file, ..., all_versions}} dict the reports use."""
+    rankings = {}
+    if not len(table["filename"]):
+        return rankings
+
+    order = np.lexsort((np.arange(len(scores)), -scores, table["codes"]))
+    columns = {key: table[key].tolist() for key in (
+        "filepath", "filename", "version", "verb", "verb_type", "gemini_score", "clip_clarity",
+        "clip_discriminability", "gemini_recommendation", "clip_verdict", "issues", "combo")}
+    normalized = round_scores(table["gemini_score"] / 35 * 100).tolist()
+    score_list = scores.tolist()
+
+    for i in order.tolist():
+        version = {
+            "filepath": columns["filepath"][i],
+            "filename": columns["filename"][i],
+            "version": columns["version"][i],
+            "verb": columns["verb"][i],
+            "verb_type": columns["verb_type"][i],
+            # Individual scores
+            "gemini_score": _plain(columns["gemini_score"][i]),
+            "gemini_normalized": normalized[i],
+            "clip_clarity": _plain(columns["clip_clarity"][i]),
+            "clip_discriminability": columns["clip_discriminability"][i],
+            # Combined
+            "combined_score": score_list[i],
+            # Metadata
+            "gemini_recommendation": columns["gemini_recommendation"][i],
+            "clip_verdict": columns["clip_verdict"][i],
+            "issues": columns["issues"][i],
+        }
+        combo = columns["combo"][i]
+        if combo not in rankings:
+            # Rows are in descending score order, so the first one is the best.
+            rankings[combo] = {
+                "best_file": version["filename"],
+                "best_combined": version["combined_score"],
+                "best_gemini": version["gemini_score"],
+                "best_clip": version["clip_clarity"],
+                "verb": version["verb"],
+                "verb_type": version["verb_type"],
+                "all_versions": [],
+            }
+        rankings[combo]["all_versions"].append(version)
+
+    return rankings
+
+
 def combine_evaluations(gemini_data, clip_data, weights):
     """Combine Gemini and CLIP evaluations into unified rankings."""
-    combined = {}
-
-    # Index Gemini evaluations by filename
-    gemini_by_file = {}
-    if gemini_data:
-        for filepath, eval_data in gemini_data.get("evaluations", {}).items():
-            if eval_data:
-                filename = normalize_path(filepath)
-                gemini_by_file[filename] = {
-                    "filepath": filepath,
-                    "score": eval_data.get("total_score", 0),
-                    "recommendation": eval_data.get("recommendation", "unknown"),
-                    "issues": eval_data.get("issues", []),
-                    "notes": eval_data.get("notes", "")
-                }
-
-    # Index CLIP evaluations by filename
-    clip_by_file = {}
-    if clip_data:
-        for filepath, eval_data in clip_data.get("evaluations", {}).items():
-            if eval_data:
-                filename = normalize_path(filepath)
-                metrics = eval_data.get("metrics", {})
-                clip_by_file[filename] = {
-                    "filepath": filepath,
-                    "clarity_score": metrics.get("clarity_score", 0),
-                    "discriminability": metrics.get("discriminability", 0),
-                    "rank": metrics.get("rank", 99),
-                    "verdict": metrics.get("verdict", "unknown")
-                }
-
-    # Get all unique filenames
-    all_files = set(gemini_by_file.keys()) | set(clip_by_file.keys())
-
-    # Combine scores for each file
-    for filename in all_files:
-        gemini = gemini_by_file.get(filename, {})
-        clip = clip_by_file.get(filename, {})
-
-        # Get filepath from either source
-        filepath = gemini.get("filepath") or clip.get("filepath", "")
-
-        # Parse filename to get combo info
-        info = parse_filename(filename)
-        if not info:
-            continue
+    table = build_score_table(gemini_data, clip_data)
+    return rankings_view(table, combined_scores(table, weights))
 
-        combo = info["combo"]
 
-        # Compute normalized scores
-        gemini_score = gemini.get("score", 0)
-        gemini_normalized = (gemini_score / 35) * 100 if gemini_score else 0
+def weight_sweep(table, steps=21):
+    """Best version of every combo across a grid of Gemini weights (CLIP = 1 - Gemini).
 
-        clip_score = clip.get("clarity_score", 0)
+    Scores for the whole grid are one broadcast over the rows. Returns the
+    Gemini weights and a (steps, n_combos) array of best row indices.
+    """
+    if steps < 2:
+        raise ValueError("a weight sweep needs at least 2 steps (Gemini weights 0 and 1)")
+    grid = np.linspace(0, 1, steps)
+    scores = combined_scores(table, {"gemini": grid, "clip": 1 - grid})
+    return grid, group_argmax(table, scores)
 
-        # Combined score
-        if gemini_score and clip_score:
-            combined_score = (weights["gemini"] * gemini_normalized +
-                            weights["clip"] * clip_score)
-        elif gemini_score:
-            combined_score = gemini_normalized
-        elif clip_score:
-            combined_score = clip_score
-        else:
-            combined_score = 0
 
-        # Store in combo group
-        if combo not in combined:
-            combined[combo] = []
+def print_sweep_report(table, grid, best, current_best):
+    """Per-combo weight ranges where the pick changes, plus overall stability.
 
-        # Extract verb and determine type
-        verb = extract_verb_from_combo(combo)
-        verb_type = get_verb_type(verb) if verb else "unknown"
+    A combo's stability is the share of the grid on which it keeps the
+    version picked at the current weights.
+    """
+    print("\n" + "=" * 80)
+    print(f"WEIGHT SENSITIVITY SWEEP (Gemini weight 0-1 in {len(grid)} steps, CLIP = 1 - Gemini)")
+    print("=" * 80)
 
-        combined[combo].append({
-            "filepath": filepath,
-            "filename": filename,
-            "version": info["version"],
-            "verb": verb,
-            "verb_type": verb_type,
-            # Individual scores
-            "gemini_score": gemini_score,
-            "gemini_normalized": round(gemini_normalized, 1),
-            "clip_clarity": clip_score,
-            "clip_discriminability": clip.get("discriminability", 0),
-            # Combined
-            "combined_score": round(combined_score, 1),
-            # Metadata
-            "gemini_recommendation": gemini.get("recommendation", "N/A"),
-            "clip_verdict": clip.get("verdict", "N/A"),
-            "issues": gemini.get("issues", [])
-        })
+    if not len(table["combos"]):
+        print("No evaluations found.")
+        return
+
+    filenames = table["filename"]
+    stability = (best == current_best).mean(axis=0)
+    changing = np.flatnonzero((best != best[0]).any(axis=0))
+
+    for c in changing[np.argsort(stability[changing], kind="stable")]:
+        print(f"\n  {table['combos'][c]}  (stability {stability[c]:.0%}, "
+              f"current pick {filenames[current_best[c]]})")
+        # Split the grid wherever this combo's pick changes
+        bounds = np.flatnonzero(np.diff(best[:, c])) + 1
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(grid)]):
+            span = f"{grid[lo]:.2f}" if hi - lo == 1 else f"{grid[lo]:.2f}-{grid[hi - 1]:.2f}"
+            print(f"    Gemini {span:<9}: {filenames[best[lo, c]]}")
 
-    # Sort versions within each combo by combined score
+    n = len(table["combos"])
+    print(f"\n{'─' * 60}")
+    print(f"  Combos whose pick never changes: {n - len(changing)}/{n}")
+    print(f"  Pick stability (mean share of grid agreeing with current pick): {stability.mean():.0%}")
+    fragile = int((stability < 0.5).sum())
+    if fragile:
+        print(f"  ⚠ {fragile} combo(s) keep their current pick on less than half of the grid")
+
+
+def _combo_of_path(filepath):
+    info = parse_filename(normalize_path(filepath))
+    return info["combo"] if info else None
+
+
+def _group_by_combo(evaluations):
+    """{combo: {filepath: evaluation}} for the non-empty evaluations."""
+    grouped = {}
+    for filepath, evaluation in evaluations.items():
+        combo = _combo_of_path(filepath)
+        if combo and evaluation:
+            grouped.setdefault(combo, {})[filepath] = evaluation
+    return grouped
+
+
+def _file_signature(filepath):
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def watch_rankings(gemini_file, clip_file, weights, min_score=50, problem_threshold=50, interval=2.0):
+    """Keep rankings in memory and redraw the checklist and problems as evaluations land.
+
+    Both evaluators rewrite their JSON file after every image, so a change
+    in a file's mtime/size is the notification. Only the file that changed
+    is re-read, its evaluations are diffed against the previous copy, and
+    only the combos with changed evaluations are re-ranked.
+
+    Limitations: the changed file is still parsed in full on every change
+    (the evaluators rewrite it whole, so there is no smaller unit to read),
+    and each changed combo is re-ranked from a fresh table of just its
+    versions rather than by patching rows of one long-lived columnar table.
+    Per change that is O(file size) parsing plus O(versions) ranking, which
+    is fine at this project's few hundred images.
+    """
+    sources = {"gemini": gemini_file, "clip": clip_file}
+    signatures = {name: None for name in sources}
+    evaluations = {name: {} for name in sources}
+    by_combo = {name: {} for name in sources}
     rankings = {}
-    for combo, versions in combined.items():
-        sorted_versions = sorted(versions, key=lambda x: x["combined_score"], reverse=True)
-        best = sorted_versions[0]
-        rankings[combo] = {
-            "best_file": best["filename"],
-            "best_combined": best["combined_score"],
-            "best_gemini": best["gemini_score"],
-            "best_clip": best["clip_clarity"],
-            "verb": best.get("verb", ""),
-            "verb_type": best.get("verb_type", "unknown"),
-            "all_versions": sorted_versions
-        }
 
-    return rankings
+    def rerank(combos):
+        for combo in combos:
+            ranking = combine_evaluations({"evaluations": by_combo["gemini"].get(combo, {})},
+                                          {"evaluations": by_combo["clip"].get(combo, {})},
+                                          weights).get(combo)
+            if ranking:
+                rankings[combo] = ranking
+            else:
+                rankings.pop(combo, None)
+
+    try:
+        while True:
+            changed = set()
+            for name, filepath in sources.items():
+                signature = _file_signature(filepath)
+                if signature == signatures[name]:
+                    continue
+                try:
+                    current = (load_json(filepath) or {}).get("evaluations", {})
+                except json.JSONDecodeError:
+                    continue   # Caught mid-write by an older writer; retry next tick
+                signatures[name] = signature
+
+                previous = evaluations[name]
+                diff = {path for path in previous.keys() | current.keys()
+                        if previous.get(path) != current.get(path)}
+                evaluations[name] = current
+                for path in diff:
+                    combo = _combo_of_path(path)
+                    if not combo:
+                        continue
+                    group = by_combo[name].setdefault(combo, {})
+                    if current.get(path):
+                        group[path] = current[path]
+                    else:
+                        group.pop(path, None)
+                    changed.add(combo)
+
+            if changed:
+                rerank(changed)
+                print("\033[2J\033[H", end="")
+                print(f"[{time.strftime('%H:%M:%S')}] Watching {gemini_file}, {clip_file} "
+                      f"(Ctrl-C to stop). Re-ranked {len(changed)} combo(s), {len(rankings)} total")
+                print_experiment_checklist(rankings, min_score)
+                print_problems(rankings, problem_threshold)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
 
 
 def print_experiment_checklist(rankings, min_score=50):
@@ -550,16 +778,84 @@ def print_problems(rankings, threshold=50):
             print(f"  Issues: {', '.join(best['issues'][:3])}")
 
 
-def export_best_images(rankings, image_dir, output_dir, min_score=0, experiment_only=False):
-    """Copy best images to output directory."""
-    os.makedirs(output_dir, exist_ok=True)
+def file_sha256(filepath):
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    print(f"\nExporting best images to {output_dir}/")
 
-    exported = 0
+def load_export_manifest(output_dir):
+    """{dst_name: {source, sha256, size, mtime_ns}} for files this script exported."""
+    path = os.path.join(output_dir, EXPORT_MANIFEST)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def save_export_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, EXPORT_MANIFEST)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def _reflink(src_path, dst_path):
+    """Copy-on-write clone (Linux FICLONE, e.g. on btrfs/XFS). Raises OSError if unsupported."""
+    import fcntl
+    FICLONE = 0x40049409
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(src_path, dst_path)
+
+
+def place_file(src_path, dst_path, hardlink=False):
+    """Atomically put src at dst: reflink, else copy. Returns the method.
+
+    With hardlink, a hardlink is tried first. The export then shares its
+    inode with the source, so any in-place change to the source (e.g. by
+    optimize_pngs.py) also changes the exported file.
+    """
+    temp_path = f"{dst_path}.{os.getpid()}.tmp"
+    method = None
+    if hardlink and os.stat(src_path).st_dev == os.stat(os.path.dirname(dst_path) or ".").st_dev:
+        try:
+            os.link(src_path, temp_path)
+            method = "linked"
+        except OSError:
+            pass
+    if method is None:
+        try:
+            _reflink(src_path, temp_path)
+            method = "reflinked"
+        except (OSError, ImportError):
+            shutil.copy2(src_path, temp_path)
+            method = "copied"
+    os.replace(temp_path, dst_path)
+    return method
+
+
+def export_best_images(rankings, image_dir, output_dir, min_score=0, experiment_only=False, workers=8,
+                       hardlink=False):
+    """Export the best image of each combo to one or more output directories.
+
+    Each directory keeps a manifest of what was exported from which source
+    (by SHA-256). Targets whose source is unchanged are skipped; the rest are
+    reflinked when the filesystem supports it (copied otherwise, in parallel;
+    hardlinked first if asked) and renamed into place. Exports that are no
+    longer selected are removed after the new ones are in place. Files not
+    in the manifest are never touched.
+    """
+    output_dirs = [output_dir] if isinstance(output_dir, str) else list(output_dir)
+
+    # Resolve the selection once for all output directories
+    selected = {}
     skipped = 0
     skipped_extra = 0
-
     for combo, data in rankings.items():
         # Skip extra verbs if experiment_only
         if experiment_only and data.get("verb_type") == "extra":
@@ -572,26 +868,75 @@ def export_best_images(rankings, image_dir, output_dir, min_score=0, experiment_
 
         best = data["all_versions"][0]
         src_path = best["filepath"]
-
-        if src_path and os.path.exists(src_path):
-            dst_name = f"{combo}.png"
-            dst_path = os.path.join(output_dir, dst_name)
-            shutil.copy2(src_path, dst_path)
-            exported += 1
-            print(f"  {best['filename']} -> {dst_name} (score: {data['best_combined']:.1f})")
-        else:
+        if not (src_path and os.path.exists(src_path)):
             # Try to find in image_dir
-            alt_path = os.path.join(image_dir, best["filename"])
-            if os.path.exists(alt_path):
-                dst_name = f"{combo}.png"
-                dst_path = os.path.join(output_dir, dst_name)
-                shutil.copy2(alt_path, dst_path)
-                exported += 1
-                print(f"  {best['filename']} -> {dst_name} (score: {data['best_combined']:.1f})")
-            else:
+            src_path = os.path.join(image_dir, best["filename"])
+            if not os.path.exists(src_path):
                 print(f"  Warning: {best['filename']} not found")
-
-    msg = f"\nExported {exported} images, skipped {skipped} (below min score)"
+                continue
+        selected[f"{combo}.png"] = (src_path, best["filename"], data["best_combined"])
+
+    source_hashes = {}
+
+    def source_hash(src_path, previous):
+        """Hash a source, trusting the manifest if the file's size and mtime are unchanged."""
+        stat = os.stat(src_path)
+        key = (os.path.realpath(src_path), stat.st_size, stat.st_mtime_ns)
+        if key not in source_hashes:
+            if (previous and previous.get("source") == key[0]
+                    and previous.get("size") == stat.st_size
+                    and previous.get("mtime_ns") == stat.st_mtime_ns):
+                source_hashes[key] = previous["sha256"]
+            else:
+                source_hashes[key] = file_sha256(src_path)
+        return {"source": key[0], "sha256": source_hashes[key],
+                "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for out_dir in output_dirs:
+            os.makedirs(out_dir, exist_ok=True)
+            print(f"\nExporting best images to {out_dir}/")
+            manifest = load_export_manifest(out_dir)
+            new_manifest = {}
+            tasks = {}
+            unchanged = 0
+
+            for dst_name, (src_path, filename, score) in sorted(selected.items()):
+                dst_path = os.path.join(out_dir, dst_name)
+                entry = source_hash(src_path, manifest.get(dst_name))
+                new_manifest[dst_name] = entry
+
+                previous = manifest.get(dst_name)
+                if (os.path.exists(dst_path) and os.path.getsize(dst_path) == entry["size"]
+                        and (previous or {}).get("sha256") == entry["sha256"]):
+                    unchanged += 1
+                    continue
+                if not previous and os.path.exists(dst_path) and file_sha256(dst_path) == entry["sha256"]:
+                    # Exported before the manifest existed; adopt it.
+                    unchanged += 1
+                    continue
+                tasks[pool.submit(place_file, src_path, dst_path, hardlink)] = (filename, dst_name, score)
+
+            methods = {}
+            for future, (filename, dst_name, score) in tasks.items():
+                method = future.result()
+                methods[method] = methods.get(method, 0) + 1
+                print(f"  {filename} -> {dst_name} ({method}, score: {score:.1f})")
+
+            # Only now that every selected file is in place, drop stale exports
+            removed = 0
+            for dst_name in sorted(set(manifest) - set(new_manifest)):
+                dst_path = os.path.join(out_dir, dst_name)
+                if os.path.exists(dst_path):
+                    os.unlink(dst_path)
+                    removed += 1
+                    print(f"  Removed stale {dst_name}")
+            save_export_manifest(out_dir, new_manifest)
+
+            placed = ", ".join(f"{n} {m}" for m, n in sorted(methods.items())) or "0 written"
+            print(f"  {out_dir}: {placed}, {unchanged} unchanged, {removed} stale removed")
+
+    msg = f"\nExported {len(selected)} images, skipped {skipped} (below min score)"
     if skipped_extra:
         msg += f", {skipped_extra} (extra verbs)"
     print(msg)
@@ -626,12 +971,17 @@ def generate_csv_report(rankings, output_file="combined_selection_report.csv", e
     print(f"CSV report saved to {output_file}")
 
 
-def interactive_review(rankings, image_dir):
-    """Interactive review with combined scores."""
+def interactive_review(rankings, image_dir, sheets=None):
+    """Interactive review with combined scores.
+
+    With sheets ({combo: contact sheet path}), each combo's sheet path is
+    printed and [o] opens it in the browser.
+    """
     print("\n" + "=" * 70)
     print("INTERACTIVE REVIEW (Combined Scores)")
     print("=" * 70)
-    print("Commands: [Enter]=next, [1-5]=select version, [s]=skip, [q]=quit")
+    print("Commands: [Enter]=next, [1-5]=select version, [s]=skip, [q]=quit"
+          + (", [o]=open contact sheet" if sheets else ""))
 
     changes = {}
 
@@ -639,6 +989,9 @@ def interactive_review(rankings, image_dir):
         print(f"\n{'─' * 50}")
         print(f"{combo}")
         print(f"Current best: {data['best_file']} (combined: {data['best_combined']:.1f})")
+        sheet = (sheets or {}).get(combo)
+        if sheet:
+            print(f"Contact sheet: {sheet}")
 
         for i, v in enumerate(data["all_versions"], 1):
             marker = "→" if i == 1 else " "
@@ -647,6 +1000,9 @@ def interactive_review(rankings, image_dir):
             print(f"  {marker} [{i}] v{v['version']}: {v['combined_score']:>5.1f} ({gemini_str}, {clip_str})")
 
         cmd = input("\nYour choice: ").strip().lower()
+        while cmd == 'o' and sheet:
+            webbrowser.open(Path(sheet).resolve().as_uri())
+            cmd = input("Your choice: ").strip().lower()
 
         if cmd == 'q':
             break
@@ -675,14 +1031,23 @@ def main():
                        help="CLIP evaluation results JSON")
     parser.add_argument("--image-dir", default=IMAGE_DIR,
                        help="Source image directory")
-    parser.add_argument("--output-dir", default=OUTPUT_DIR,
-                       help="Output directory for selected images")
+    parser.add_argument("--output-dir", nargs="+", default=[OUTPUT_DIR],
+                       help="Output directory (or directories) for selected images")
 
     # Weights
     parser.add_argument("--gemini-weight", type=float, default=0.5,
                        help="Weight for Gemini score (0-1)")
     parser.add_argument("--clip-weight", type=float, default=0.5,
                        help="Weight for CLIP score (0-1)")
+    parser.add_argument("--sweep", action="store_true",
+                       help="Show how each combo's pick changes across Gemini/CLIP weightings")
+    parser.add_argument("--sweep-steps", type=int, default=21,
+                       help="Number of Gemini weights from 0 to 1 in --sweep")
+    parser.add_argument("--solve", action="store_true",
+                       help="Pick versions jointly so irregular/regular quality is balanced "
+                            "per block and character (applies to all other actions)")
+    parser.add_argument("--max-gap", type=float, default=5.0,
+                       help="Max |irregular mean - regular mean| per group for --solve")
 
     # Actions
     parser.add_argument("--report", action="store_true",
@@ -701,14 +1066,33 @@ def main():
                        help="Export best images")
     parser.add_argument("--min-score", type=float, default=0,
                        help="Minimum combined score for export")
+    parser.add_argument("--hardlink", action="store_true",
+                       help="Hardlink exports to their sources when possible (saves space, but the "
+                            "export then shares the source's inode: editing a source in place, e.g. "
+                            "with optimize_pngs.py, also changes the exported stimulus)")
     parser.add_argument("--csv", action="store_true",
                        help="Generate CSV report")
     parser.add_argument("--interactive", action="store_true",
                        help="Interactive review mode")
+    parser.add_argument("--contact-sheets", action="store_true",
+                       help="Render per-combo thumbnail sheets (shown during --interactive)")
+    parser.add_argument("--watch", action="store_true",
+                       help="Redraw the checklist and problem list as the evaluators write results")
+    parser.add_argument("--watch-interval", type=float, default=2.0,
+                       help="Seconds between checks for new evaluations in --watch")
     parser.add_argument("--experiment-only", action="store_true",
                        help="Only include experiment verbs (exclude hammer, light)")
 
     args = parser.parse_args()
+    if args.sweep_steps < 2:
+        parser.error("--sweep-steps must be at least 2 (Gemini weights 0 and 1)")
+
+    if args.watch:
+        weights = {"gemini": args.gemini_weight, "clip": args.clip_weight}
+        watch_rankings(args.gemini_file, args.clip_file, weights,
+                       args.min_score if args.min_score > 0 else 50,
+                       args.problem_threshold, args.watch_interval)
+        return
 
     # Load data
     gemini_data = load_json(args.gemini_file)
@@ -729,11 +1113,20 @@ def main():
         "gemini": args.gemini_weight,
         "clip": args.clip_weight
     }
-    rankings = combine_evaluations(gemini_data, clip_data, weights)
+    table = build_score_table(gemini_data, clip_data)
+    scores = combined_scores(table, weights)
+    rankings = rankings_view(table, scores)
 
     print(f"Combined {len(rankings)} character-verb combos")
     print(f"Weights: Gemini={weights['gemini']:.0%}, CLIP={weights['clip']:.0%}")
 
+    if args.solve:
+        # Imported lazily: the solver imports this module for its helpers.
+        import selection_solver
+        result = selection_solver.solve_selection(table, scores, args.max_gap)
+        selection_solver.print_solution(table, scores, result)
+        rankings = selection_solver.apply_picks(rankings, table, result["picks"])
+
     # Execute requested actions
     if args.report:
         print_combined_report(rankings, args.min_score)
@@ -750,27 +1143,42 @@ def main():
     if args.problems:
         print_problems(rankings, args.problem_threshold)
 
+    if args.sweep:
+        grid, best = weight_sweep(table, args.sweep_steps)
+        print_sweep_report(table, grid, best, group_argmax(table, scores))
+
     if args.csv:
         generate_csv_report(rankings, experiment_only=args.experiment_only)
 
+    sheets = None
+    if args.contact_sheets:
+        # Imported lazily: contact_sheets imports this module.
+        import contact_sheets
+        sheets = contact_sheets.render_contact_sheets(rankings, args.image_dir)
+
     if args.interactive:
-        interactive_review(rankings, args.image_dir)
+        interactive_review(rankings, args.image_dir, sheets)
 
     if args.export:
-        export_best_images(rankings, args.image_dir, args.output_dir, args.min_score, args.experiment_only)
+        export_best_images(rankings, args.image_dir, args.output_dir, args.min_score, args.experiment_only,
+                           hardlink=args.hardlink)
 
     # Default action if nothing specified
     if not any([args.report, args.summary, args.balance, args.checklist, args.problems,
-                args.csv, args.interactive, args.export]):
+                args.sweep, args.solve, args.csv, args.interactive, args.contact_sheets,
+                args.export]):
         print("\nUsage:")
         print("  python select_best_images.py --summary     # Quick overview")
         print("  python select_best_images.py --checklist   # Verify experiment completeness")
         print("  python select_best_images.py --balance     # Regular/irregular balance")
         print("  python select_best_images.py --report      # Detailed report")
         print("  python select_best_images.py --problems    # Show weak images")
+        print("  python select_best_images.py --sweep       # Pick stability across weightings")
+        print("  python select_best_images.py --solve --balance  # Balanced joint selection")
         print("  python select_best_images.py --csv         # Export to CSV")
         print("  python select_best_images.py --export      # Copy best images")
         print("  python select_best_images.py --interactive # Manual review")
+        print("  python select_best_images.py --watch       # Live checklist while evaluating")
         print("\nAdjust weights:")
         print("  --gemini-weight 0.7 --clip-weight 0.3")
 
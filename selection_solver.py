@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Constrained Selection Solver
+
+Picks one version per combo jointly instead of independently: maximize the
+total combined score subject to the mean score of irregular and regular
+verbs differing by at most --max-gap points within every block of BLOCKS
+and for every character.
+
+Each constraint is linear in the chosen scores, so it is relaxed with a
+Lagrange multiplier. For fixed multipliers the problem splits into one
+independent argmax per combo (a vectorized group argmax over all
+candidates), and the multipliers are updated by subgradient steps. Every
+relaxed solution is repaired into a feasible one by greedy swaps, and the
+best feasible selection is kept. The best dual value is an upper bound,
+so the reported gap says how far from optimal the selection can be.
+
+Used by select_best_images.py --solve.
+"""
+
+import numpy as np
+
+import select_best_images as sbi
+
+# Default bound on |mean irregular - mean regular| per group (0-100 points)
+MAX_GAP = 5.0
+ITERATIONS = 200
+
+_EPS = 1e-9
+
+
+def constraint_groups(table):
+    """Balance groups as (label, coefficient row over combos).
+
+    Coefficients are +1/n_irregular for irregular combos and -1/n_regular
+    for regular ones, so row @ chosen_scores is the mean difference.
+    """
+    starts = table["starts"]
+    characters = table["character"][starts]
+    verbs = table["verb"][starts]
+    verb_types = table["verb_type"][starts]
+    irregular = verb_types == "irregular"
+    regular = verb_types == "regular"
+
+    members = []
+    for block_name, block_verbs in sbi.BLOCKS.items():
+        if block_name != "practice":
+            members.append((block_name, np.isin(verbs, block_verbs)))
+    for character in sorted(set(characters.tolist())):
+        members.append((character, characters == character))
+
+    groups = []
+    for label, in_group in members:
+        n_irregular = (in_group & irregular).sum()
+        n_regular = (in_group & regular).sum()
+        if n_irregular and n_regular:
+            row = np.where(in_group & irregular, 1 / n_irregular, 0.0)
+            row -= np.where(in_group & regular, 1 / n_regular, 0.0)
+            groups.append((label, row))
+    return groups
+
+
+def _violation(diff, max_gap):
+    """Total amount by which |diff| exceeds max_gap (works on stacked columns too)."""
+    return np.maximum(np.abs(diff) - max_gap, 0).sum(axis=0)
+
+
+def repair(table, scores, A, max_gap, picks):
+    """Greedy swaps from picks to a feasible selection, then greedy improvement.
+
+    While infeasible, take the swap that removes the most violation per
+    point of score lost. Once feasible, take the largest score gain that
+    keeps it feasible. Returns (picks, feasible).
+    """
+    picks = picks.copy()
+    codes = table["codes"]
+    coefficients = A[:, codes]          # (groups, rows)
+
+    for _ in range(4 * len(picks) + 10):
+        chosen = scores[picks]
+        diff = A @ chosen
+        violation = _violation(diff, max_gap)
+        gain = scores - chosen[codes]   # score change if row replaced its combo's pick
+        new_violation = _violation(diff[:, None] + coefficients * gain, max_gap)
+
+        if violation > _EPS:
+            reduction = violation - new_violation
+            candidates = reduction > _EPS
+            if not candidates.any():
+                return picks, False
+            cost = np.where(candidates, -gain / np.where(candidates, reduction, 1), np.inf)
+            row = int(np.argmin(cost))
+        else:
+            candidates = (gain > _EPS) & (new_violation <= _EPS)
+            if not candidates.any():
+                return picks, True
+            row = int(np.argmax(np.where(candidates, gain, -np.inf)))
+        picks[codes[row]] = row
+
+    return picks, _violation(A @ scores[picks], max_gap) <= _EPS
+
+
+def solve_selection(table, scores, max_gap=MAX_GAP, iterations=ITERATIONS):
+    """Jointly choose one row per combo. Returns a result dict (see print_solution)."""
+    greedy = sbi.group_argmax(table, scores)
+    groups = constraint_groups(table)
+    result = {
+        "groups": groups,
+        "max_gap": max_gap,
+        "greedy": greedy,
+        "greedy_total": float(scores[greedy].sum()),
+        "picks": greedy,
+        "total": float(scores[greedy].sum()),
+        "feasible": True,
+        "bound": float(scores[greedy].sum()),
+        "iterations": 0,
+    }
+    if not groups or not len(greedy):
+        return result
+
+    A = np.array([row for _, row in groups])
+    codes = table["codes"]
+
+    best_picks, best_total, feasible = None, -np.inf, False
+    picks, ok = repair(table, scores, A, max_gap, greedy)
+    if ok:
+        best_picks, best_total, feasible = picks, scores[picks].sum(), True
+    # Reported instead when no repair reaches feasibility.
+    least_picks, least_violation = picks, _violation(A @ scores[picks], max_gap)
+
+    # Multipliers for d - gap <= 0 and -d - gap <= 0 in each group
+    upper = np.zeros(len(groups))
+    lower = np.zeros(len(groups))
+    bound = np.inf
+    step_scale, stalled = 1.0, 0
+    repaired = set()
+
+    iteration = 0
+    for iteration in range(1, iterations + 1):
+        weight = 1 - (upper - lower) @ A                  # per-combo multiplier on its score
+        adjusted = scores * weight[codes]
+        relaxed = sbi.group_argmax(table, adjusted)
+        dual = adjusted[relaxed].sum() + max_gap * (upper + lower).sum()
+
+        if dual < bound - _EPS:
+            bound, stalled = dual, 0
+        else:
+            stalled += 1
+            if stalled >= 5:
+                step_scale, stalled = step_scale / 2, 0
+
+        # Relaxed solutions repeat once the multipliers settle; repair each only once.
+        key = relaxed.tobytes()
+        if key not in repaired:
+            repaired.add(key)
+            picks, ok = repair(table, scores, A, max_gap, relaxed)
+            if ok and scores[picks].sum() > best_total + _EPS:
+                best_picks, best_total, feasible = picks, scores[picks].sum(), True
+            elif not ok:
+                violation = _violation(A @ scores[picks], max_gap)
+                if violation < least_violation - _EPS:
+                    least_picks, least_violation = picks, violation
+
+        diff = A @ scores[relaxed]
+        g_upper, g_lower = diff - max_gap, -diff - max_gap
+        norm = (np.maximum(g_upper, -upper) ** 2).sum() + (np.maximum(g_lower, -lower) ** 2).sum()
+        if bound - best_total < 1e-6 or norm < _EPS or step_scale < 1e-4:
+            break
+        target = best_total if feasible else 0.95 * dual
+        step = step_scale * (dual - target) / norm
+        upper = np.maximum(0, upper + step * g_upper)
+        lower = np.maximum(0, lower + step * g_lower)
+
+    result.update({
+        "picks": best_picks if feasible else least_picks,
+        "total": float(best_total) if feasible else float(scores[least_picks].sum()),
+        "feasible": feasible,
+        "bound": float(min(bound, result["greedy_total"])),
+        "iterations": iteration,
+    })
+    return result
+
+
+def apply_picks(rankings, table, picks):
+    """Move each combo's solved pick to the front of its rankings entry."""
+    filenames = table["filename"]
+    for combo, row in zip(table["combos"].tolist(), picks.tolist()):
+        data = rankings.get(combo)
+        if not data:
+            continue
+        chosen = next(v for v in data["all_versions"] if v["filename"] == filenames[row])
+        data["all_versions"].remove(chosen)
+        data["all_versions"].insert(0, chosen)
+        data.update({
+            "best_file": chosen["filename"],
+            "best_combined": chosen["combined_score"],
+            "best_gemini": chosen["gemini_score"],
+            "best_clip": chosen["clip_clarity"],
+        })
+    return rankings
+
+
+def print_solution(table, scores, result):
+    """Group balance before/after, score cost and changed picks."""
+    print("\n" + "=" * 80)
+    print(f"CONSTRAINED SELECTION (|mean irregular - mean regular| <= {result['max_gap']:.1f} "
+          f"per block and character)")
+    print("=" * 80)
+
+    if not result["groups"]:
+        print("No block or character has both irregular and regular verbs; nothing to balance.")
+        return
+
+    greedy, picks = result["greedy"], result["picks"]
+    print(f"\n  {'Group':<12} {'Independent picks':>20} {'Solved':>12}")
+    for label, row in result["groups"]:
+        before = row @ scores[greedy]
+        after = row @ scores[picks]
+        marker = "✓" if abs(after) <= result["max_gap"] + 1e-6 else "✗"
+        print(f"  {label:<12} {before:>+20.1f} {after:>+11.1f} {marker}")
+    print("  (irregular mean - regular mean, in combined-score points)")
+
+    n = len(picks)
+    print(f"\n  Total score: {result['greedy_total']:.1f} independent -> {result['total']:.1f} solved "
+          f"(mean {result['greedy_total'] / n:.1f} -> {result['total'] / n:.1f})")
+    print(f"  Upper bound: {result['bound']:.1f} (gap {result['bound'] - result['total']:.1f}), "
+          f"{result['iterations']} iterations")
+    if not result["feasible"]:
+        print("  ✗ No feasible selection found; showing the least-violating one. Try a larger --max-gap.")
+
+    changed = np.flatnonzero(picks != greedy)
+    if changed.size:
+        print(f"\n  Changed picks ({changed.size}):")
+        filenames = table["filename"]
+        for c in changed:
+            print(f"    {table['combos'][c]:<28} {filenames[greedy[c]]} ({scores[greedy[c]]:.1f}) -> "
+                  f"{filenames[picks[c]]} ({scores[picks[c]]:.1f})")
+    else:
+        print("\n  The independent picks already satisfy every constraint.")